@@ -23,3 +23,19 @@ t2 = time()-t0
 print "Summing using barray iterator: %.3f  speedup: %.2f" % (t2, t1/t2)
 
 assert sum1 == sum2, "Summations are not equal!"
+
+# Now, the iterators of a btable
+t = blz.btable([a, a*2, a%7], names=['f0', 'f1', 'f2'])
+
+t0 = time()
+sum3 = sum((r.f1 for r in t.iter(2, None, 3) if r.f0 < 10))
+t3 = time()-t0
+print "Summing using btable iterator: %.3f  speedup: %.2f" % (t3, t1/t3)
+
+t0 = time()
+sum4 = sum((b['f1'][b['f0'] < 10].sum()
+            for b in t.iter(2, None, 3, as_blocks=True)))
+t4 = time()-t0
+print "Summing using btable blocks: %.3f  speedup: %.2f" % (t4, t1/t4)
+
+assert sum3 == sum4 == 2*sum1, "Summations are not equal!"
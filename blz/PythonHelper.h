@@ -12,6 +12,22 @@
 #define PyString_AsString(v) PyBytes_AsString(v)
 #define PyString_GET_SIZE(string) PyBytes_GET_SIZE(string)
 #define PyBuffer_FromMemory(ptr, size) PyMemoryView_FromMemory(ptr, size, PyBUF_READ|PyBUF_WRITE)
+#define PyBuffer_FromObject(base, offset, size) blz_memoryview_slice(base, offset, size)
+
+/* A memoryview on a part of `base`, without copying its data */
+static PyObject *blz_memoryview_slice(PyObject *base, Py_ssize_t offset,
+                                      Py_ssize_t size)
+{
+  PyObject *view, *slice;
+
+  view = PyMemoryView_FromObject(base);
+  if (view == NULL) {
+    return NULL;
+  }
+  slice = PySequence_GetSlice(view, offset, offset + size);
+  Py_DECREF(view);
+  return slice;
+}
 #endif
 
 #endif /* PYTHON_HELPER_H */
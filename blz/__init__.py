@@ -21,9 +21,11 @@ from .arrayprint import (
 from .blz_ext import (
     barray, blosc_version, blosc_compressor_list,
      _blosc_set_nthreads as blosc_set_nthreads,
-    _blosc_init, _blosc_destroy,
+    _blosc_init, _blosc_destroy, set_cache_size, cache_info,
      )
 from .btable import btable
+from .dictarray import dictarray
+from .vlarray import vlarray
 from .vtable import vtable
 from .chunked_eval import eval, defaults
 from .bfuncs import (
@@ -69,3 +71,6 @@ ncores = detect_number_of_cores()
 blosc_set_nthreads(ncores)
 import atexit
 atexit.register(_blosc_destroy)
+# Registered last, so that the thread pools are gone before Blosc
+from .utils import _close_pools
+atexit.register(_close_pools)
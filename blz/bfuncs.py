@@ -19,6 +19,8 @@ import numpy as np
 import math
 from .blz_ext import barray
 from .btable import btable
+from .dictarray import dictarray, DICTARRAY_META
+from .vlarray import vlarray, VLARRAY_META
 from .bparams import bparams
 from .py2help import xrange, _inttypes
 
@@ -28,7 +30,7 @@ def open(rootdir, mode='a'):
     """
     open(rootdir, mode='a')
 
-    Open a disk-based barray/btable.
+    Open a disk-based barray/btable/dictarray/vlarray.
 
     Parameters
     ----------
@@ -44,13 +46,17 @@ def open(rootdir, mode='a'):
 
     Returns
     -------
-    out : a barray/btable object
+    out : a barray/btable/dictarray/vlarray object
 
     """
-    # Use the existence of __rootdirs__ to
-    # distinguish between btable and barray
+    # Use the existence of __rootdirs__ (or __dictarray__, __vlarray__)
+    # to distinguish between btable, dictarray, vlarray and barray
     if os.path.exists(os.path.join(rootdir, '__rootdirs__')):
         obj = btable(rootdir=rootdir, mode=mode)
+    elif os.path.exists(os.path.join(rootdir, DICTARRAY_META)):
+        obj = dictarray(rootdir=rootdir, mode=mode)
+    elif os.path.exists(os.path.join(rootdir, VLARRAY_META)):
+        obj = vlarray(rootdir=rootdir, mode=mode)
     else:
         obj = barray(rootdir=rootdir, mode=mode)
     return obj
@@ -461,32 +467,42 @@ def whereblocks(table, expression, blen=None, outfields=None, limit=None,
         # Get the minimum chunklen for every field
         blen = min(table[col].chunklen for col in table.cols)
     if outfields is None:
-        dtype = table.dtype
+        outfields = table.names
     else:
         if not isinstance(outfields, (list, tuple)):
             raise ValueError("only a sequence is supported for outfields")
-        # Get the dtype for the outfields set
-        try:
-            dtype = [(name, table[name].dtype) for name in outfields]
-        except IndexError:
+        if set(outfields) - set(table.names + ['nrow__']) != set():
             raise ValueError("Some names in `outfields` are not real fields")
+    dtype = table._outdtype(outfields)
+
+    # The expression is evaluated a block at a time, and the matching
+    # rows come in blocks of variable length that are regrouped here
+    blocks = table._where_blocks(expression, outfields, limit, skip, depth=4)
+    return _reblock(blocks, blen, dtype)
+
 
+def _reblock(blocks, blen, dtype):
+    """Iterate over `blocks` of structured arrays in blocks of `blen`."""
     buf = np.empty(blen, dtype=dtype)
     nrow = 0
-    for row in table.where(expression, outfields, limit, skip):
-        buf[nrow] = row
-        nrow += 1
-        if nrow == blen:
-            yield buf
-            buf = np.empty(blen, dtype=dtype)
-            nrow = 0
+    for block in blocks:
+        while len(block) > 0:
+            n = min(blen - nrow, len(block))
+            buf[nrow:nrow+n] = block[:n]
+            block = block[n:]
+            nrow += n
+            if nrow == blen:
+                yield buf
+                buf = np.empty(blen, dtype=dtype)
+                nrow = 0
     yield buf[:nrow]
 
 
 def walk(dir, classname=None, mode='a'):
     """walk(dir, classname=None, mode='a')
 
-    Recursively iterate over barray/btable objects hanging from `dir`.
+    Recursively iterate over barray/btable/dictarray/vlarray objects
+    hanging from `dir`.
 
     Parameters
     ----------
@@ -494,7 +510,7 @@ def walk(dir, classname=None, mode='a'):
         The directory from which the listing starts.
     classname : string
         If specified, only object of this class are returned.  The values
-        supported are 'barray' and 'btable'.
+        supported are 'barray', 'btable', 'dictarray' and 'vlarray'.
     mode : string
         The mode in which the object should be opened.
 
@@ -511,7 +527,12 @@ def walk(dir, classname=None, mode='a'):
     for node in glob.glob(names):
         if os.path.isdir(node):
             try:
-                obj = barray(rootdir=node, mode=mode)
+                if os.path.exists(os.path.join(node, DICTARRAY_META)):
+                    obj = dictarray(rootdir=node, mode=mode)
+                elif os.path.exists(os.path.join(node, VLARRAY_META)):
+                    obj = vlarray(rootdir=node, mode=mode)
+                else:
+                    obj = barray(rootdir=node, mode=mode)
             except:
                 try:
                     obj = btable(rootdir=node, mode=mode)
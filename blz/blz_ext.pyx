@@ -12,31 +12,69 @@ import numpy as np
 import blz
 from blz import utils, attrs, array2string
 import os, os.path
+import mmap
 import struct
 import shutil
 import tempfile
 import json
 import datetime
+import itertools
+import threading
+import timeit
 import cython
 
 if sys.version_info >= (3, 0):
+    import pickle
     _MAXINT = 2**31 - 1
     _inttypes = (int, np.integer)
 else:
+    import cPickle as pickle
     _MAXINT = sys.maxint
     _inttypes = (int, long, np.integer)
 
 _KB = 1024
 _MB = 1024*_KB
 
+# The default budget for the cache of chunks and blocks
+CACHE_SIZE = 64*_MB
+
+# Blosc keeps the compressor to use in global state, so selecting it
+# and compressing has to be atomic when several threads compress
+# containers with different `bparams`.
+_compr_lock = threading.Lock()
+
+# The codecs tried on every chunk by ``bparams(cname='auto')``, and the
+# number of bytes (split in evenly spaced pieces) of their trial sample
+AUTO_CNAMES = (b'blosclz', b'lz4', b'lz4hc', b'snappy', b'zlib')
+AUTO_SAMPLE_SIZE = 64*_KB
+AUTO_SAMPLE_PIECES = 4
+
+# Chunks transformed by ``bparams(prefilter=...)`` carry a trailer after
+# their Blosc buffer with the filter code and its reference value.
+# Constant chunks on disk keep a single item in their Blosc buffer, and
+# the number of items in the trailer.
+PREFILTER_CODES = {'delta': 1, 'for': 2, 'xor': 3}
+PREFILTER_MAGIC = b'BLZF'
+CONSTANT_MAGIC = b'BLZC'
+CHUNK_TRAILER = struct.Struct('<4sB3xQ')
+
 # Directories for saving the data and metadata for BLZ persistency
 DATA_DIR = 'data'
 META_DIR = 'meta'
 SIZES_FILE = 'sizes'
 STORAGE_FILE = 'storage'
+ZONEMAPS_FILE = 'zonemaps'
 
 # For the persistence layer
 EXTENSION = '.blp'
+SEGMENT_FILE = '__segment__' + EXTENSION
+INDEX_FILE = '__index__'
+INDEX_ENTRY = struct.Struct('<qq')
+STORAGE_KINDS = ('files', 'packed')
+# The version of the on-disk layout, kept in the storage metadata.
+# Version 2 adds chunk trailers and the packed storage; containers
+# without it (BLZ <= 0.6.2) are version 1.
+STORAGE_FORMAT = 2
 MAGIC = b'blpk'
 BLOSCPACK_HEADER_LENGTH = 16
 BLOSC_HEADER_LENGTH = 16
@@ -55,12 +93,13 @@ IntType = np.dtype(np.int_)
 
 # numpy functions & objects
 from definitions cimport import_array, ndarray, dtype, \
-     malloc, realloc, free, memcpy, memset, strdup, strcmp, \
+     malloc, realloc, free, memcpy, memset, memcmp, strdup, strcmp, \
      PyString_AsString, PyString_GET_SIZE, \
      PyString_FromStringAndSize, \
      Py_BEGIN_ALLOW_THREADS, Py_END_ALLOW_THREADS, \
      PyArray_GETITEM, PyArray_SETITEM, \
-     npy_intp, PyBuffer_FromMemory, Py_uintptr_t
+     npy_intp, npy_uint64, PyBuffer_FromMemory, PyBuffer_FromObject, \
+     PyObject_AsReadBuffer, Py_uintptr_t
 
 #-----------------------------------------------------------------
 
@@ -93,6 +132,7 @@ cdef extern from "blosc.h":
                            size_t *cbytes, size_t *blocksize)
   void blosc_cbuffer_metainfo(void *cbuffer, size_t *typesize, int *flags)
   void blosc_cbuffer_versions(void *cbuffer, int *version, int *versionlz)
+  char *blosc_cbuffer_complib(void *cbuffer)
   void blosc_set_blocksize(size_t blocksize)
   char* blosc_list_compressors()
 
@@ -163,6 +203,49 @@ def _blosc_destroy():
   """
   blosc_destroy()
 
+def set_cache_size(nbytes):
+  """
+  set_cache_size(nbytes)
+
+  Sets the maximum amount of memory for the cache of chunks and blocks.
+
+  The cache is shared by all the barrays in the process, and it keeps
+  both compressed chunks read from disk and decompressed blocks (used
+  for accessing single elements).  A size of 0 disables the cache.
+
+  Parameters
+  ----------
+  nbytes : int
+      The new size of the cache (in bytes).
+
+  Returns
+  -------
+  out : int
+      The previous size of the cache.
+  """
+  if nbytes < 0:
+    raise ValueError("the size of the cache cannot be negative")
+  oldsize = _cache.maxsize
+  _cache.resize(nbytes)
+  return oldsize
+
+def cache_info():
+  """
+  cache_info()
+
+  Returns statistics about the cache of chunks and blocks.
+
+  Returns
+  -------
+  out : dict
+      With the `maxsize` and the current `size` (in bytes) of the cache,
+      the number of `entries` in it and the number of `hits` and
+      `misses` so far.
+  """
+  return {'maxsize': _cache.maxsize, 'size': _cache.size,
+          'entries': len(_cache.entries),
+          'hits': _cache.hits, 'misses': _cache.misses}
+
 def blosc_version():
   """
   blosc_version()
@@ -253,6 +336,11 @@ cdef int check_zeros(char *data, int nbytes):
           break
   return iszero
 
+cdef int check_constant(char *data, int nbytes, int atomsize):
+  """Check whether all the items in [data, data+nbytes] are equal."""
+  # Comparing the data with itself shifted by one item
+  return memcmp(data, data + atomsize, nbytes - atomsize) == 0
+
 cdef int true_count(char *data, int nbytes):
   """Count the number of true values in data (boolean)."""
   cdef int i, count
@@ -263,8 +351,222 @@ cdef int true_count(char *data, int nbytes):
       count += <int>(data[i])
   return count
 
+cdef get_stats(ndarray array):
+  """Compute the zone map (min, max, nnans) of `array`.
+
+  Only unidimensional arrays of boolean, integer or floating point kinds
+  are supported.  For the rest, None is returned.  When all the values
+  are NaN, the min and max entries are None.
+  """
+  cdef object vmin, vmax
+  cdef npy_intp nnans, alen
+
+  if array.dtype.kind not in ('b', 'i', 'u', 'f') or array.ndim != 1:
+    return None
+  alen = len(array)
+  if alen == 0:
+    return None
+  if array.strides[0] == 0:
+    # A constant array: look just at its first element
+    array = array[:1]
+  nnans = 0
+  vmin = array.min()
+  vmax = array.max()
+  if array.dtype.kind == 'f' and (vmin != vmin or vmax != vmax):
+    # NaNs are propagated by min/max; get rid of them
+    nnans = np.isnan(array).sum()
+    if nnans == len(array):
+      return (None, None, alen)
+    vmin = np.nanmin(array)
+    vmax = np.nanmax(array)
+  return (vmin.item(), vmax.item(), nnans)
+
+cdef merge_stats(object stats):
+  """Merge a sequence of zone maps into a single one.
+
+  If any of the zone maps is unknown (None), None is returned.
+  """
+  cdef object vmin, vmax, smin, smax
+  cdef npy_intp nnans
+
+  vmin, vmax, nnans = None, None, 0
+  for st in stats:
+    if st is None:
+      return None
+    smin, smax, snans = st
+    nnans += snans
+    if smin is None:
+      # All NaNs in this chunk
+      continue
+    if vmin is None or smin < vmin:
+      vmin = smin
+    if vmax is None or smax > vmax:
+      vmax = smax
+  return (vmin, vmax, nnans)
+
+cdef object first_item(ndarray array):
+  """Return the first item in `array`, to be used as a chunk constant."""
+  # Avoid this NumPy quirk:
+  # np.array(['1'], dtype='S3').dtype != s[0].dtype
+  if array.dtype.kind != 'S':
+    return array[0]
+  return np.array(array[0], dtype=array.dtype)
+
+cdef size_t constant_blocksize(int itemsize):
+  """Return the size of the blocks to cache for constant chunks."""
+  cdef size_t blocksize
+
+  blocksize = 4*1024  # use 4 KB as a cache for blocks
+  # Make blocksize a multiple of itemsize
+  if blocksize % itemsize > 0:
+    blocksize = cython.cdiv(blocksize, itemsize) * itemsize
+  # Correct in case we have a large itemsize
+  if blocksize == 0:
+    blocksize = itemsize
+  return blocksize
+
 #-------------------------------------------------------------
 
+cdef enum:
+  PREFILTER_DELTA = 1
+  PREFILTER_FOR = 2
+  PREFILTER_XOR = 3
+
+cdef inline npy_uint64 load_item(char *p, int size) nogil:
+  if size == 8:
+    return (<npy_uint64 *>p)[0]
+  elif size == 4:
+    return (<unsigned int *>p)[0]
+  elif size == 2:
+    return (<unsigned short *>p)[0]
+  return (<unsigned char *>p)[0]
+
+cdef inline void store_item(char *p, int size, npy_uint64 value) nogil:
+  if size == 8:
+    (<npy_uint64 *>p)[0] = value
+  elif size == 4:
+    (<unsigned int *>p)[0] = <unsigned int>value
+  elif size == 2:
+    (<unsigned short *>p)[0] = <unsigned short>value
+  else:
+    (<unsigned char *>p)[0] = <unsigned char>value
+
+cdef void prefilter_encode(char *src, char *dest, npy_intp n, int size,
+                           int code, npy_uint64 ref) nogil:
+  """Transform the `n` items in `src` into `dest` (modular arithmetic)."""
+  cdef npy_intp i
+  cdef npy_uint64 value, prev = 0
+
+  for i from 0 <= i < n:
+    value = load_item(src + i * size, size)
+    if code == PREFILTER_DELTA:
+      store_item(dest + i * size, size, value - prev)
+      prev = value
+    elif code == PREFILTER_FOR:
+      store_item(dest + i * size, size, value - ref)
+    else:
+      store_item(dest + i * size, size, value ^ prev)
+      prev = value
+
+cdef void prefilter_decode(char *data, npy_intp n, int size,
+                           int code, npy_uint64 ref) nogil:
+  """Undo `prefilter_encode` in place for the first `n` items."""
+  cdef npy_intp i
+  cdef npy_uint64 prev = 0
+
+  for i from 0 <= i < n:
+    if code == PREFILTER_DELTA:
+      prev = prev + load_item(data + i * size, size)
+      store_item(data + i * size, size, prev)
+    elif code == PREFILTER_FOR:
+      store_item(data + i * size, size,
+                 load_item(data + i * size, size) + ref)
+    else:
+      prev = prev ^ load_item(data + i * size, size)
+      store_item(data + i * size, size, prev)
+
+cdef int prefilter_code(object prefilter, object dtype_):
+  """The code of `prefilter` for chunks of `dtype_` (0 if unfiltered)."""
+  if (prefilter is None or dtype_.shape != () or
+      dtype_.itemsize not in (1, 2, 4, 8)):
+    return 0
+  if dtype_.kind in 'iumM' or (dtype_.kind == 'f' and prefilter == 'xor'):
+    return PREFILTER_CODES[prefilter]
+  return 0
+
+
+cdef object auto_cname(char *data, size_t itemsize, size_t nbytes,
+                       object bparams):
+  """Return the codec that suits `bparams.objective` best for `data`.
+
+  The codecs in `AUTO_CNAMES` available in this build are tried on a
+  sample of `data`.  The objective can be 'ratio' (the smallest output),
+  'speed' (the fastest decompression) or a number for a budget: the
+  fastest decompression among the codecs whose output is not larger
+  than that many times the smallest one.
+  """
+  cdef char *sample
+  cdef char *dest
+  cdef char *back
+  cdef size_t ssize, psize, offset, i
+  cdef int clevel, shuffle, ret
+  cdef object cname, objective, results, best, timer
+
+  # Build the sample out of evenly spaced pieces
+  if nbytes <= AUTO_SAMPLE_SIZE:
+    sample, ssize = data, nbytes
+  else:
+    psize = cython.cdiv(cython.cdiv(AUTO_SAMPLE_SIZE, AUTO_SAMPLE_PIECES),
+                        itemsize) * itemsize
+    ssize = psize * AUTO_SAMPLE_PIECES
+    sample = <char *>malloc(ssize)
+    for i from 0 <= i < AUTO_SAMPLE_PIECES:
+      offset = cython.cdiv(cython.cdiv((nbytes - psize) * i,
+                                       AUTO_SAMPLE_PIECES - 1), itemsize)
+      memcpy(sample + i * psize, data + offset * itemsize, psize)
+  dest = <char *>malloc(ssize+BLOSC_MAX_OVERHEAD)
+  back = <char *>malloc(ssize)
+
+  clevel = bparams.clevel
+  shuffle = bparams.shuffle
+  objective = bparams.objective
+  timer = timeit.default_timer
+  results = []
+  try:
+    for cname in AUTO_CNAMES:
+      with _compr_lock:
+        if blosc_set_compressor(cname) < 0:
+          # Not available in this build
+          continue
+        blosc_set_blocksize(bparams.blocksize)
+        with nogil:
+          ret = blosc_compress(clevel, shuffle, itemsize, ssize, sample,
+                               dest, ssize+BLOSC_MAX_OVERHEAD)
+      if ret <= 0:
+        continue
+      t = 0.
+      if objective != 'ratio':
+        t = timer()
+        with nogil:
+          blosc_decompress(dest, back, ssize)
+        t = timer() - t
+      results.append((ret, t, cname))
+  finally:
+    if sample != data:
+      free(sample)
+    free(dest)
+    free(back)
+
+  if not results:
+    return b'blosclz'
+  if objective == 'ratio':
+    return min(results, key=lambda r: r[0])[2]
+  if objective != 'speed':
+    # Only the codecs within the budget are eligible
+    best = min(r[0] for r in results) * objective
+    results = [r for r in results if r[0] <= best]
+  return min(results, key=lambda r: (r[1], r[0]))[2]
+
 
 cdef class chunk:
   """
@@ -276,13 +578,21 @@ cdef class chunk:
 
   """
   cdef char typekind, isconstant
+  cdef int prefilter
+  cdef npy_uint64 reference
   cdef public int atomsize, itemsize, blocksize
   cdef public int nbytes, cbytes, cdbytes
   cdef int true_count
+  # Chunks of objects written by BLZ <= 0.6.2 keep a single object
+  cdef public int oneobj
   cdef char *data
   cdef object atom, constant, dobject
+  cdef public object stats
 
   cdef void _getitem(self, int start, int stop, char *dest)
+  cdef size_t add_trailer(self, size_t cbytes, object magic, int code,
+                          npy_uint64 value)
+  cdef read_constant(self)
   cdef compress_data(self, char *data, size_t itemsize, size_t nbytes,
                      object bparams)
   cdef compress_arrdata(self, ndarray array, int itemsize,
@@ -299,8 +609,12 @@ cdef class chunk:
     cdef size_t nbytes, cbytes, blocksize
     cdef dtype dtype_
     cdef char *data
+    cdef void *buf
+    cdef Py_ssize_t buflen
 
     self.atom = atom
+    self.prefilter = 0
+    self.reference = 0
     self.atomsize = atom.itemsize
     dtype_ = atom.base
     self.typekind = dtype_.kind
@@ -321,17 +635,36 @@ cdef class chunk:
         "than %d bytes" % (itemsize, BLOSC_MAX_TYPESIZE))
     self.itemsize = itemsize
     self.dobject = None
+    self.stats = None
+    # Unknown unless computed during compression
+    self.true_count = -1
     footprint = 0
 
     if _compr:
       # Data comes in an already compressed state inside a Python String
-      self.data = PyString_AsString(dobject)
+      # (or any other object exposing a buffer, like a view of a mmap)
+      if PyObject_AsReadBuffer(dobject, &buf, &buflen) < 0:
+        raise TypeError("compressed data must support the buffer interface")
+      self.data = <char *>buf
       # Increment the reference so that data don't go away
       self.dobject = dobject
       # Set size info for the instance
       blosc_cbuffer_sizes(self.data, &nbytes, &cbytes, &blocksize)
+      if <size_t>buflen >= cbytes + CHUNK_TRAILER.size:
+        magic, code, value = CHUNK_TRAILER.unpack(PyString_FromStringAndSize(
+          self.data + cbytes, CHUNK_TRAILER.size))
+        if magic == PREFILTER_MAGIC:
+          self.prefilter, self.reference = code, value
+          cbytes += CHUNK_TRAILER.size
+        elif magic == CONSTANT_MAGIC:
+          self.read_constant()
+          footprint += 64 + self.constant.size * self.constant.itemsize
+          nbytes = value * self.atomsize
+          blocksize = constant_blocksize(itemsize)
+          cbytes += CHUNK_TRAILER.size
     elif dtype_ == 'O':
-      # The objects should arrive here already pickled
+      # The objects in the array are pickled all together
+      dobject = pickle.dumps(dobject, pickle.HIGHEST_PROTOCOL)
       data = PyString_AsString(dobject)
       nbytes = PyString_GET_SIZE(dobject)
       cbytes, blocksize = self.compress_data(data, 1, nbytes, bparams)
@@ -351,37 +684,39 @@ cdef class chunk:
                         object bparams, object _memory):
     """Compress data in `array` and put it in ``self.data``"""
     cdef size_t nbytes, cbytes, blocksize, footprint
+    cdef npy_intp nitems
+    cdef int size
+    cdef ndarray encoded
 
     # Compute the total number of bytes in this array
     nbytes = array.itemsize * array.size
     cbytes = 0
     footprint = 0
 
-    # Check whether incoming data can be expressed as a constant or not.
-    # Disk-based chunks are not allowed to do this.
+    # Compute the zone map (min, max, nnans) for this chunk
+    self.stats = get_stats(array)
+
+    # Check whether incoming data can be expressed as a constant or not
     self.isconstant = 0
     self.constant = None
-    if _memory and (array.strides[0] == 0
-                    or check_zeros(array.data, nbytes)):
+    if (array.strides[0] == 0 or
+        check_constant(array.data, nbytes, self.atomsize)):
 
       self.isconstant = 1
-      # Get the NumPy constant.  Avoid this NumPy quirk:
-      # np.array(['1'], dtype='S3').dtype != s[0].dtype
-      if array.dtype.kind != 'S':
-        self.constant = array[0]
-      else:
-        self.constant = np.array(array[0], dtype=array.dtype)
+      self.constant = first_item(array)
       # Add overhead (64 bytes for the overhead of the numpy container)
       footprint += 64 + self.constant.size * self.constant.itemsize
 
     if self.isconstant:
-      blocksize = 4*1024  # use 4 KB as a cache for blocks
-      # Make blocksize a multiple of itemsize
-      if blocksize % itemsize > 0:
-        blocksize = cython.cdiv(blocksize, itemsize) * itemsize
-      # Correct in case we have a large itemsize
-      if blocksize == 0:
-        blocksize = itemsize
+      blocksize = constant_blocksize(itemsize)
+      if not _memory:
+        # Disk-based chunks keep the constant compressed, followed by
+        # the number of items
+        array = np.ascontiguousarray(array[:1])
+        cbytes, _ = self.compress_data(array.data, itemsize, self.atomsize,
+                                       bparams)
+        cbytes = self.add_trailer(cbytes, CONSTANT_MAGIC, 0,
+                                  cython.cdiv(nbytes, self.atomsize))
     else:
       if self.typekind == 'b':
         self.true_count = true_count(array.data, nbytes)
@@ -390,12 +725,50 @@ cdef class chunk:
         # The chunk is made of constants.  Regenerate the actual data.
         array = array.copy()
 
+      self.prefilter = prefilter_code(bparams.prefilter, array.dtype)
+      if self.prefilter:
+        if self.prefilter == PREFILTER_FOR:
+          # The reference is the minimum, as raw bits
+          self.reference = int(array.view(
+            'u%d' % array.itemsize if self.typekind == 'u'
+            else 'i%d' % array.itemsize).min()) % 2**64
+        encoded = np.empty(array.size, dtype=array.dtype)
+        nitems, size = array.size, array.itemsize
+        with nogil:
+          prefilter_encode(array.data, encoded.data, nitems, size,
+                           self.prefilter, self.reference)
+        array = encoded
+
       # Compress data
       cbytes, blocksize = self.compress_data(array.data, itemsize, nbytes,
                                              bparams)
+      if self.prefilter:
+        cbytes = self.add_trailer(cbytes, PREFILTER_MAGIC, self.prefilter,
+                                  self.reference)
 
     return (nbytes, cbytes, blocksize, footprint)
 
+  cdef size_t add_trailer(self, size_t cbytes, object magic, int code,
+                          npy_uint64 value):
+    """Append a trailer to the compressed data and return its new size."""
+    trailer = CHUNK_TRAILER.pack(magic, code, value)
+    self.data = <char *>realloc(self.data, cbytes + CHUNK_TRAILER.size)
+    memcpy(self.data + cbytes, PyString_AsString(trailer), CHUNK_TRAILER.size)
+    return cbytes + CHUNK_TRAILER.size
+
+  cdef read_constant(self):
+    """Decompress the item of a constant chunk coming from disk."""
+    cdef ndarray array
+    cdef int ret
+
+    array = np.empty(1, dtype=self.atom)
+    with nogil:
+      ret = blosc_decompress(self.data, array.data, self.atomsize)
+    if ret < 0:
+      raise RuntimeError, "fatal error during Blosc decompression: %d" % ret
+    self.isconstant = 1
+    self.constant = first_item(array)
+
   cdef compress_data(self, char *data, size_t itemsize, size_t nbytes,
                      object bparams):
     """Compress data with `bparams` and return metadata."""
@@ -406,13 +779,19 @@ cdef class chunk:
     clevel = bparams.clevel
     shuffle = bparams.shuffle
     cname = bparams.cname
-    if blosc_set_compressor(cname) < 0:
-      raise ValueError(
-        "Compressor '%s' is not available in this build" % cname)
+    blocksize = bparams.blocksize
+    if cname == b'auto':
+      cname = auto_cname(data, itemsize, nbytes, bparams)
     dest = <char *>malloc(nbytes+BLOSC_MAX_OVERHEAD)
-    with nogil:
-      ret = blosc_compress(clevel, shuffle, itemsize, nbytes,
-                           data, dest, nbytes+BLOSC_MAX_OVERHEAD)
+    with _compr_lock:
+      if blosc_set_compressor(cname) < 0:
+        free(dest)
+        raise ValueError(
+          "Compressor '%s' is not available in this build" % cname)
+      blosc_set_blocksize(blocksize)
+      with nogil:
+        ret = blosc_compress(clevel, shuffle, itemsize, nbytes,
+                             data, dest, nbytes+BLOSC_MAX_OVERHEAD)
     if ret <= 0:
       raise RuntimeError, "fatal error during Blosc compression: %d" % ret
     # Free the unused data
@@ -443,13 +822,26 @@ cdef class chunk:
     with nogil:
       ret = blosc_decompress(self.data, dest, self.nbytes)
     if ret < 0:
+      free(dest)
       raise RuntimeError, "fatal error during Blosc decompression: %d" % ret
     string = PyString_FromStringAndSize(dest, <Py_ssize_t>self.nbytes)
+    free(dest)
     return string
 
+  def getobjs(self):
+    """Get the array of objects in this chunk (for 'O'bject types)."""
+    cdef ndarray objs
+
+    if self.oneobj:
+      objs = np.empty(shape=(1,), dtype=self.dtype)
+      objs[0] = pickle.loads(self.getudata())
+      return objs
+    return pickle.loads(self.getudata())
+
   cdef void _getitem(self, int start, int stop, char *dest):
     """Read data from `start` to `stop` and return it as a numpy array."""
     cdef int ret, bsize, blen, nitems, nstart
+    cdef char *tmp
     cdef ndarray constants
 
     blen = stop - start
@@ -464,12 +856,35 @@ cdef class chunk:
       memcpy(dest, constants.data, bsize)
       return
 
+    if start > 0 and self.prefilter in (PREFILTER_DELTA, PREFILTER_XOR):
+      # Decoding needs every item from the start of the chunk
+      tmp = <char *>malloc(stop * self.atomsize)
+      with nogil:
+        if stop * self.atomsize == self.nbytes:
+          ret = blosc_decompress(self.data, tmp, self.nbytes)
+        else:
+          ret = blosc_getitem(self.data, 0, nstart + nitems, tmp)
+        if ret >= 0:
+          # Items of multidimensional atoms are filtered one by one
+          prefilter_decode(tmp, cython.cdiv(stop * self.atomsize,
+                                            self.itemsize),
+                           self.itemsize, self.prefilter, self.reference)
+      if ret >= 0:
+        memcpy(dest, tmp + start * self.atomsize, bsize)
+      free(tmp)
+      if ret < 0:
+        raise RuntimeError, "fatal error during Blosc decompression: %d" % ret
+      return
+
     # Fill dest with uncompressed data
     with nogil:
       if bsize == self.nbytes:
         ret = blosc_decompress(self.data, dest, bsize)
       else:
         ret = blosc_getitem(self.data, nstart, nitems, dest)
+      if ret >= 0 and self.prefilter:
+        prefilter_decode(dest, nitems, self.itemsize, self.prefilter,
+                         self.reference)
     if ret < 0:
       raise RuntimeError, "fatal error during Blosc decompression: %d" % ret
 
@@ -478,6 +893,9 @@ cdef class chunk:
     cdef ndarray array
     cdef object start, stop, step, clen, idx
 
+    if self.typekind == 'O':
+      # Objects can only be unpickled all together
+      return self.getobjs()[key]
     if isinstance(key, _inttypes):
       # Quickly return a single element
       array = np.empty(shape=(1,), dtype=self.dtype)
@@ -513,6 +931,13 @@ cdef class chunk:
       return array[::step]
     return array
 
+  property complib:
+    "The compression library used for this chunk (None for constants in memory)."
+    def __get__(self):
+      if self.data == NULL:
+        return None
+      return blosc_cbuffer_complib(self.data)
+
   @property
   def pointer(self):
       return <Py_uintptr_t> self.data+BLOSCPACK_HEADER_LENGTH
@@ -539,12 +964,74 @@ cdef class chunk:
 
   def __dealloc__(self):
     """Release C resources before destruction."""
-    if self.dobject:
+    if self.dobject is not None:
       self.dobject = None  # DECREF pointer to data object
     else:
       free(self.data)   # explictly free the data area
 
 
+# Helpers for chunk-level reductions.  They receive either a `chunk`
+# or, for the leftover of a barray, a NumPy array.
+
+cdef chunk_array(object data, int onerow=False):
+  """Return the values in `data` as a NumPy array.
+
+  Constant chunks are returned as a view with zero strides, so they are
+  neither decompressed nor copied.  If `onerow` is true, the array for
+  a constant chunk has only one row.
+  """
+  cdef chunk chunk_
+  cdef npy_intp nrows
+
+  if not isinstance(data, chunk):
+    return data
+  chunk_ = data
+  if not chunk_.isconstant:
+    return chunk_[:]
+  nrows = 1 if onerow else cython.cdiv(chunk_.nbytes, chunk_.atomsize)
+  return np.ndarray(shape=(nrows,), dtype=chunk_.dtype,
+                    buffer=chunk_.constant, strides=(0,))
+
+def _chunk_count_nonzero(object data):
+  """Return the (nonzeros, elements) counts for `data`."""
+  cdef chunk chunk_
+  cdef npy_intp nrows
+
+  if isinstance(data, chunk):
+    chunk_ = data
+    nrows = cython.cdiv(chunk_.nbytes, chunk_.atomsize)
+    if chunk_.isconstant:
+      return (np.count_nonzero(chunk_.constant) * nrows,
+              chunk_.constant.size * nrows)
+    if chunk_.typekind == 'b' and chunk_.true_count >= 0:
+      return (chunk_.true_count, nrows)
+    if chunk_.stats is not None:
+      # NaNs count as nonzeros
+      vmin, vmax, nnans = chunk_.stats
+      if vmin is None or vmin > 0 or vmax < 0:
+        return (nrows, nrows)
+      if vmin == vmax == 0:
+        return (nnans, nrows)
+  array = chunk_array(data)
+  return (np.count_nonzero(array), array.size)
+
+def _chunk_moments(object data):
+  """Return the (elements, mean, sum of squared deviations) of `data`."""
+  cdef npy_intp repeat
+
+  array = chunk_array(data)
+  if array.size == 0:
+    return (0, 0., 0.)
+  repeat = 1
+  if array.strides[0] == 0:
+    # A constant chunk: compute on a single row
+    repeat = len(array)
+    array = array[:1]
+  mean = array.mean(dtype=np.float64)
+  m2 = ((array - mean)**2).sum()
+  return (array.size * repeat, mean, m2 * repeat)
+
+
 cdef create_bloscpack_header(nchunks=None, format_version=FORMAT_VERSION):
     """ Create the bloscpack header string.
 
@@ -585,7 +1072,7 @@ cdef create_bloscpack_header(nchunks=None, format_version=FORMAT_VERSION):
         if the format_version is too large or negative
 
     """
-    if not 0 <= nchunks <= MAX_CHUNKS and nchunks is not None:
+    if nchunks is not None and not 0 <= nchunks <= MAX_CHUNKS:
       raise ValueError(
         "'nchunks' must be in the range 0 <= n <= %d, not '%s'" %
         (MAX_CHUNKS, str(nchunks)))
@@ -642,12 +1129,92 @@ cdef decode_blosc_header(buffer_):
             'ctbytes': decode_uint32(buffer_[12:16])}
 
 
+cdef class lrucache:
+  """A cache that evicts the least recently used entries.
+
+  Its size is measured in bytes (each entry declares how much memory it
+  takes).  The entries are kept in a dictionary and in a circular doubly
+  linked list (of [prev, next, key, value, nbytes] lists) that keeps
+  them in order of use.  The keys of every owner (the first element of
+  keys) are kept too, so that they can be removed all at once.
+  """
+  cdef object entries, root, owners
+  cdef public npy_intp maxsize, size, hits, misses
+
+  def __cinit__(self, maxsize):
+    self.entries = {}
+    self.owners = {}
+    self.root = []
+    self.root[:] = [self.root, self.root, None, None, 0]
+    self.maxsize = maxsize
+    self.size = self.hits = self.misses = 0
+
+  cdef get(self, key):
+    """Return the value for `key` (or None if it is not cached)."""
+    link = self.entries.get(key)
+    if link is None:
+      self.misses += 1
+      return None
+    # Move the entry to the most recently used end
+    link[0][1], link[1][0] = link[1], link[0]
+    last = self.root[0]
+    last[1] = self.root[0] = link
+    link[0], link[1] = last, self.root
+    self.hits += 1
+    return link[3]
+
+  cdef put(self, key, value, npy_intp nbytes):
+    """Cache `value` under `key`, evicting old entries if needed."""
+    self.remove(key)
+    if nbytes > self.maxsize:
+      return
+    self.shrink(self.maxsize - nbytes)
+    last = self.root[0]
+    link = [last, self.root, key, value, nbytes]
+    last[1] = self.root[0] = self.entries[key] = link
+    self.owners.setdefault(key[0], set()).add(key)
+    self.size += nbytes
+
+  cdef remove(self, key):
+    """Remove the entry for `key`, if any."""
+    link = self.entries.pop(key, None)
+    if link is not None:
+      link[0][1], link[1][0] = link[1], link[0]
+      self.size -= link[4]
+      keys = self.owners[key[0]]
+      keys.discard(key)
+      if not keys:
+        del self.owners[key[0]]
+
+  cdef shrink(self, npy_intp maxsize):
+    """Evict the least recently used entries until `maxsize` is reached."""
+    while self.size > maxsize:
+      self.remove(self.root[1][2])
+
+  def resize(self, npy_intp maxsize):
+    self.maxsize = maxsize
+    self.shrink(maxsize)
+
+  def remove_owner(self, owner):
+    """Remove the entries whose key starts by `owner`."""
+    for key in list(self.owners.get(owner, ())):
+      self.remove(key)
+
+# The cache shared by all the containers.  Keys are tuples whose first
+# element is a token that is unique for every cache user.
+cdef lrucache _cache = lrucache(CACHE_SIZE)
+_cache_tokens = itertools.count()
+
+
 cdef class chunks(object):
   """Store the different barray chunks in a directory on-disk."""
   cdef object _rootdir, _mode
   cdef object dtype, bparams, lastchunkarr
-  cdef object chunk_cached
-  cdef npy_intp nchunks, nchunk_cached, len
+  cdef object token
+  cdef npy_intp nchunks, len
+  cdef public object stats
+  cdef public int oneobj
+  cdef int stats_dirty
 
   property mode:
     "The mode used to create/open the `mode`."
@@ -670,41 +1237,62 @@ cdef class chunks(object):
 
   def __cinit__(self, rootdir, metainfo=None, _new=False):
     cdef ndarray lastchunkarr
-    cdef void *decompressed, *compressed
+    cdef chunk chunk_
     cdef int leftover
     cdef char *lastchunk
-    cdef size_t chunksize
     cdef object scomp
-    cdef int ret
     cdef int itemsize, atomsize
 
     self._rootdir = rootdir
     self.nchunks = 0
-    self.nchunk_cached = -1    # no chunk cached initially
+    self.token = next(_cache_tokens)
     self.dtype, self.bparams, self.len, lastchunkarr, self._mode = metainfo
     atomsize = self.dtype.itemsize
     itemsize = self.dtype.base.itemsize
 
-    # For 'O'bject types, the number of chunks is equal to the number of
-    # elements
-    if self.dtype.char == 'O':
-      self.nchunks = self.len
-
-    # Initialize last chunk (not valid for 'O'bject dtypes)
-    if not _new and self.dtype.char != 'O':
+    # Initialize last chunk
+    if not _new:
       self.nchunks = cython.cdiv(self.len, len(lastchunkarr))
-      chunksize = len(lastchunkarr) * atomsize
       lastchunk = lastchunkarr.data
       leftover = (self.len % len(lastchunkarr)) * atomsize
-      if leftover:
-        # Fill lastchunk with data on disk
+      if leftover and self.dtype.char == 'O':
+        # Objects have to be unpickled
         scomp = self.read_chunk(self.nchunks)
-        compressed = PyString_AsString(scomp)
-        with nogil:
-          ret = blosc_decompress(compressed, lastchunk, chunksize)
-        if ret < 0:
-          raise RuntimeError(
-            "error decompressing the last chunk (error code: %d)" % ret)
+        objs = chunk(scomp, self.dtype, self.bparams,
+                     _memory=False, _compr=True).getobjs()
+        lastchunkarr[:len(objs)] = objs
+      elif leftover:
+        # Fill lastchunk with data on disk (undoing any prefilter)
+        scomp = self.read_chunk(self.nchunks)
+        chunk_ = chunk(scomp, self.dtype, self.bparams,
+                       _memory=False, _compr=True)
+        chunk_._getitem(0, cython.cdiv(chunk_.nbytes, atomsize), lastchunk)
+
+    # Zone maps for the chunks
+    self.stats = []
+    if not _new:
+      self.stats = self.read_stats()
+
+  def read_stats(self):
+    """Read the zone maps for the chunks on-disk."""
+    statsfile = os.path.join(self.rootdir, META_DIR, ZONEMAPS_FILE)
+    stats = []
+    if os.path.exists(statsfile):
+      with open(statsfile, 'rb') as statsfh:
+        stats = json.loads(statsfh.read().decode('ascii'))
+    # Entries past the number of chunks cannot be trusted
+    stats = [tuple(st) if st is not None else None
+             for st in stats[:self.nchunks]]
+    stats += [None] * (self.nchunks - len(stats))
+    return stats
+
+  def write_stats(self):
+    """Write the zone maps for the chunks on-disk."""
+    self.stats_dirty = 0
+    statsfile = os.path.join(self.rootdir, META_DIR, ZONEMAPS_FILE)
+    with open(statsfile, 'wb') as statsfh:
+      statsfh.write(json.dumps(self.stats).encode('ascii'))
+      statsfh.write(b"\n")
 
   cdef read_chunk(self, nchunk):
     """Read a chunk and return it in compressed form."""
@@ -712,47 +1300,55 @@ cdef class chunks(object):
     schunkfile = os.path.join(self.datadir, dname)
     if not os.path.exists(schunkfile):
       raise ValueError("chunkfile %s not found" % schunkfile)
+    if self._mode == 'r':
+      # Read-only chunks are served directly from the page cache
+      with open(schunkfile, 'rb') as schunk:
+        smap = mmap.mmap(schunk.fileno(), 0, access=mmap.ACCESS_READ)
+      return PyBuffer_FromObject(smap, BLOSCPACK_HEADER_LENGTH,
+                                 len(smap) - BLOSCPACK_HEADER_LENGTH)
     with open(schunkfile, 'rb') as schunk:
-      bloscpack_header = schunk.read(BLOSCPACK_HEADER_LENGTH)
-      blosc_header_raw = schunk.read(BLOSC_HEADER_LENGTH)
-      blosc_header = decode_blosc_header(blosc_header_raw)
-      ctbytes = blosc_header['ctbytes']
-      nbytes = blosc_header['nbytes']
-      # seek back BLOSC_HEADER_LENGTH bytes in file relative to current
-      # position
-      schunk.seek(-BLOSC_HEADER_LENGTH, 1)
-      scomp = schunk.read(ctbytes)
+      schunk.seek(BLOSCPACK_HEADER_LENGTH)
+      # The Blosc buffer, followed by the prefilter trailer (if any)
+      scomp = schunk.read()
     return scomp
 
   def __getitem__(self, nchunk):
-    cdef void *decompressed, *compressed
+    cdef chunk chunk_
 
-    if nchunk == self.nchunk_cached:
-      # Hit!
-      return self.chunk_cached
-    else:
+    key = (self.token, nchunk)
+    chunk_ = _cache.get(key)
+    if chunk_ is None:
       scomp = self.read_chunk(nchunk)
       # Data chunk should be compressed already
       chunk_ = chunk(scomp, self.dtype, self.bparams,
                      _memory=False, _compr=True)
+      chunk_.stats = self.stats[nchunk]
+      chunk_.oneobj = self.oneobj
       # Fill cache
-      self.nchunk_cached = nchunk
-      self.chunk_cached = chunk_
+      _cache.put(key, chunk_, chunk_.cdbytes)
     return chunk_
 
   def __setitem__(self, nchunk, chunk_):
     self._save(nchunk, chunk_)
+    # The zone maps are written once per update (see `sync_stats()`)
+    self.stats[nchunk] = chunk_.stats
+    self.stats_dirty = 1
+
+  def sync_stats(self):
+    """Write the zone maps on-disk if chunks were modified."""
+    if self.stats_dirty:
+      self.write_stats()
 
   def __len__(self):
     return self.nchunks
 
   def free_cachemem(self):
-      self.nchunk_cached = -1
-      self.chunk_cached = None
+      _cache.remove_owner(self.token)
 
   def append(self, chunk_):
     """Append an new chunk to the barray."""
     self._save(self.nchunks, chunk_)
+    self.stats.append(chunk_.stats)
     self.nchunks += 1
 
   cdef _save(self, nchunk, chunk_):
@@ -762,6 +1358,12 @@ cdef class chunks(object):
       raise IOError(
         "cannot modify data because mode is '%s'" % self.mode)
 
+    if self.oneobj and not chunk_.oneobj:
+      # Keep the layout of BLZ <= 0.6.2: the object is pickled alone
+      chunk_ = chunk(chunk_.getobjs()[0], self.dtype, self.bparams,
+                     _memory=False)
+      chunk_.oneobj = 1
+
     dname = "__%d%s" % (nchunk, EXTENSION)
     schunkfile = os.path.join(self.datadir, dname)
     bloscpack_header = create_bloscpack_header(1)
@@ -769,9 +1371,8 @@ cdef class chunks(object):
       schunk.write(bloscpack_header)
       data = chunk_.getdata()
       schunk.write(data)
-    # Mark the cache as dirty if needed
-    if nchunk == self.nchunk_cached:
-      self.nchunk_cached = -1
+    # Mark the cache as dirty
+    _cache.remove((self.token, nchunk))
 
   def flush(self, chunk_):
     """Flush the leftover chunk."""
@@ -786,6 +1387,7 @@ cdef class chunks(object):
     if not os.path.exists(schunkfile):
       raise IOError("chunk filename %s does exist" % schunkfile)
     os.remove(schunkfile)
+    _cache.remove((self.token, nchunk))
 
     # When poping a chunk, we must be sure that we don't leave anything
     # behind (i.e. the lastchunk)
@@ -795,12 +1397,149 @@ cdef class chunks(object):
       os.remove(schunkfile)
 
     self.nchunks -= 1
+    del self.stats[self.nchunks:]
     return chunk_
 
 
+cdef class packedchunks(chunks):
+  """Store the different barray chunks packed in a single file on-disk.
+
+  Full chunks are appended to a segment file, and an index file keeps
+  the offset and the length of each of them inside the segment.  The
+  leftover chunk is still saved in a file of its own (as in `chunks`),
+  as it is rewritten on every flush.
+
+  In read-only mode, the segment file is memory mapped and chunks are
+  views on it.
+  """
+  cdef object segfh, indexfh, index, segmap, seglock
+
+  def __cinit__(self, rootdir, metainfo=None, _new=False):
+    # Serializes the seek + read pairs on the shared segment handle
+    self.seglock = threading.Lock()
+    segfile = os.path.join(self.datadir, SEGMENT_FILE)
+    indexfile = os.path.join(self.datadir, INDEX_FILE)
+    if _new:
+      with open(segfile, 'wb') as segfh:
+        segfh.write(create_bloscpack_header())
+      open(indexfile, 'wb').close()
+    # Unbuffered, so that every chunk goes to the OS right away
+    fmode = 'rb' if self._mode == 'r' else 'r+b'
+    self.segfh = open(segfile, fmode, 0)
+    self.indexfh = open(indexfile, fmode, 0)
+    index = self.indexfh.read()
+    self.index = [INDEX_ENTRY.unpack_from(index, i)
+                  for i in range(0, len(index), INDEX_ENTRY.size)]
+    if len(self.index) < self.nchunks:
+      raise IOError("the index file %s is truncated" % indexfile)
+    if self._mode == 'r':
+      self.segmap = mmap.mmap(self.segfh.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+
+  def __dealloc__(self):
+    # Chunks read from the map keep it alive on their own
+    for fh in (self.segfh, self.indexfh):
+      if fh is not None:
+        fh.close()
+
+  cdef read_chunk(self, nchunk):
+    """Read a chunk and return it in compressed form."""
+    if nchunk == self.nchunks:
+      # The leftover lives in its own file
+      return chunks.read_chunk(self, nchunk)
+    offset, length = self.index[nchunk]
+    if self.segmap is not None:
+      return PyBuffer_FromObject(self.segmap, offset, length)
+    with self.seglock:
+      self.segfh.seek(offset)
+      return self.segfh.read(length)
+
+  cdef _save(self, nchunk, chunk_):
+    """Save the `chunk_` as chunk #`nchunk` in the segment file. """
+
+    if self.mode == "r":
+      raise IOError(
+        "cannot modify data because mode is '%s'" % self.mode)
+
+    data = chunk_.getdata()
+    if nchunk == self.nchunks:
+      # This chunk supersedes a leftover that might have been flushed
+      self.remove_leftover(nchunk)
+    if nchunk < self.nchunks and len(data) <= self.index[nchunk][1]:
+      # Overwrite the chunk in place, as the new data fits
+      offset = self.index[nchunk][0]
+      self.segfh.seek(offset)
+    else:
+      self.segfh.seek(0, 2)
+      offset = self.segfh.tell()
+    self.segfh.write(data)
+    entry = (offset, len(data))
+    if nchunk < len(self.index):
+      self.index[nchunk] = entry
+    else:
+      self.index.append(entry)
+    self.indexfh.seek(nchunk * INDEX_ENTRY.size)
+    self.indexfh.write(INDEX_ENTRY.pack(*entry))
+    # Mark the cache as dirty
+    _cache.remove((self.token, nchunk))
+
+  cdef remove_leftover(self, nchunk):
+    """Remove the leftover flushed as chunk #`nchunk`, if any."""
+    dname = "__%d%s" % (nchunk, EXTENSION)
+    schunkfile = os.path.join(self.datadir, dname)
+    if os.path.exists(schunkfile):
+      os.remove(schunkfile)
+
+  def flush(self, chunk_):
+    """Flush the leftover chunk."""
+    chunks._save(self, self.nchunks, chunk_)
+
+  def pop(self):
+    """Remove the last chunk and return it."""
+    nchunk = self.nchunks - 1
+    chunk_ = self.__getitem__(nchunk)
+    offset, length = self.index[nchunk]
+    del self.index[nchunk:]
+    self.indexfh.truncate(nchunk * INDEX_ENTRY.size)
+    # Give the space back when the chunk is at the end of the segment
+    self.segfh.seek(0, 2)
+    if offset + length == self.segfh.tell():
+      self.segfh.truncate(offset)
+
+    # When poping a chunk, we must be sure that we don't leave anything
+    # behind (i.e. the lastchunk)
+    self.remove_leftover(nchunk+1)
+
+    _cache.remove((self.token, nchunk))
+    self.nchunks -= 1
+    del self.stats[self.nchunks:]
+    return chunk_
+
+
+def _bparams_key(object bparams):
+  """Return the settings in `bparams` that affect the compressed data."""
+  return (bparams.clevel, bparams.shuffle, bparams.cname,
+          bparams.blocksize, bparams.objective, bparams.prefilter)
+
+
+def _objarray(object seq):
+  """Return a unidimensional array with the objects in `seq`.
+
+  Sequences in `seq` (e.g. the rows of a multidimensional array) are
+  kept as objects of their own.
+  """
+  cdef ndarray objs
+  cdef npy_intp i
+
+  objs = np.empty(shape=(len(seq),), dtype=np.object_)
+  for i from 0 <= i < len(seq):
+    objs[i] = seq[i]
+  return objs
+
+
 cdef class barray:
   """
-  barray(array, bparams=None, dtype=None, dflt=None, expectedlen=None, chunklen=None, rootdir=None, mode='a')
+  barray(array, bparams=None, dtype=None, dflt=None, expectedlen=None, chunklen=None, rootdir=None, mode='a', storage='files')
 
   A compressed and enlargeable in-memory data container.
 
@@ -843,6 +1582,17 @@ cdef class barray:
           resized to 0.
         * 'a' for append (possible data inside `rootdir` will not be removed).
 
+  storage : str, optional
+      How a *persistent* barray lays out its chunks on-disk.  The values
+      can be:
+
+        * 'files' for storing every chunk in a file of its own.
+        * 'packed' for appending all the chunks to a single segment file,
+          plus an index with the position of each chunk.  This saves
+          lots of files (and system calls) for large barrays.
+
+      When opening an existing barray, this is read from its metadata.
+
   """
 
   cdef public int itemsize, atomsize
@@ -860,13 +1610,14 @@ cdef class barray:
   cdef object _bparams, _dflt
   cdef object _dtype
   cdef public object chunks
-  cdef object _rootdir, datadir, metadir, _mode
+  cdef object _rootdir, datadir, metadir, _mode, _storage
   cdef object _attrs
   cdef ndarray iobuf, where_buf
-  # For block cache
-  cdef int idxcache
-  cdef ndarray blockcache
-  cdef char *datacache
+  # For the block cache (changed whenever cached blocks become stale)
+  cdef object token
+  # The number of in-place updates, so that indexes can tell when the
+  # data changed under them
+  cdef readonly npy_intp _nupdates
 
   property leftovers:
     def __get__(self):
@@ -923,11 +1674,8 @@ cdef class barray:
   property len:
     "The length (leading dimension) of this object."
     def __get__(self):
-      if self._dtype.char == 'O':
-        return len(self.chunks)
-      else:
-        # Important to do the cast in order to get a npy_intp result
-        return <npy_intp>cython.cdiv(self._nbytes, self.atomsize)
+      # Important to do the cast in order to get a npy_intp result
+      return <npy_intp>cython.cdiv(self._nbytes, self.atomsize)
 
   property mode:
     "The mode used to create/open the `mode`."
@@ -938,6 +1686,11 @@ cdef class barray:
       if hasattr(self.chunks, 'mode'):
         self.chunks.mode = value
 
+  property storage:
+    "The layout of the chunks on-disk ('files' or 'packed')."
+    def __get__(self):
+      return self._storage
+
   property nbytes:
     "The original (uncompressed) size of this object (in bytes)."
     def __get__(self):
@@ -972,12 +1725,16 @@ cdef class barray:
   def __cinit__(self, object array=None, object bparams=None,
                 object dtype=None, object dflt=None,
                 object expectedlen=None, object chunklen=None,
-                object rootdir=None, object mode="a"):
+                object rootdir=None, object mode="a",
+                object storage="files"):
 
     self._rootdir = rootdir
     if mode not in ('r', 'w', 'a'):
       raise ValueError("mode should be 'r', 'w' or 'a'")
     self._mode = mode
+    if storage not in STORAGE_KINDS:
+      raise ValueError("storage should be 'files' or 'packed'")
+    self._storage = storage
 
     if array is not None:
       self.create_barray(array, bparams, dtype, dflt,
@@ -1000,7 +1757,7 @@ cdef class barray:
     self.sss_mode = False
     self.wheretrue_mode = False
     self.where_mode = False
-    self.idxcache = -1       # cache not initialized
+    self.token = next(_cache_tokens)
 
   cdef _adapt_dtype(self, dtype, shape):
     """adapt the dtype to one supported in barray.
@@ -1038,15 +1795,24 @@ cdef class barray:
     if type(dtype) is str:
         dtype = np.dtype(dtype)
 
-    # avoid bad performance with another barray, as in utils it would
-    # construct the temp ndarray using a slow iterator.
-    #
-    # TODO: There should be a fast path creating barrays from other barrays
-    # (especially when dtypes and compression params match)
+    # Another barray is copied chunk by chunk after the setup, moving
+    # the compressed chunks whenever dtype, chunklen and bparams match.
+    src = None
     if isinstance(array, barray):
-      array = array[:]
+      src = array
+      if dtype is not None and np.dtype(dtype) != src.dtype:
+        # Values have to be converted
+        src = None
+        array = array[:]
+      else:
+        if expectedlen is None:
+          expectedlen = len(src)
+        array = np.empty((0,) + src.shape[1:], dtype=src.dtype)
 
     array_ = utils.to_ndarray(array, dtype)
+    if array_.dtype.char == 'O' and array_.ndim > 1:
+      # Rows become objects of their own
+      array_ = _objarray(array_)
 
     # if no base dtype is provided, use the dtype from the array.
     if dtype is None:
@@ -1119,27 +1885,69 @@ cdef class barray:
     if rootdir is not None:
       self.mkdirs(rootdir, mode)
       metainfo = (dtype, bparams, self.shape[0], lastchunkarr, self._mode)
-      self.chunks = chunks(self._rootdir, metainfo=metainfo, _new=True)
+      self.chunks = self.chunks_class()(
+        self._rootdir, metainfo=metainfo, _new=True)
       # We can write the metainfo already
       self.write_meta()
 
     # Finally, fill the chunks
-    # Object dtype requires special storage
-    if array_.dtype.char == 'O':
-      for obj in array_:
-        self.store_obj(obj)
-    else:
-      self.fill_chunks(array_)
+    self.fill_chunks(array_)
+    if src is not None:
+      self._append_barray(src)
 
     # and flush the data pending...
     self.flush()
 
+  def _append_barray(self, barray src):
+    """Append the contents of the `src` barray to this instance.
+
+    When the dtypes, chunklens and bparams match and there is no
+    leftover, the compressed chunks of `src` are moved over as they
+    are (memory or disk, in any direction); else, `src` is appended
+    a chunk at a time.
+    """
+    cdef npy_intp i, nchunk, nchunks, cbytes
+    cdef int chunklen, memory
+    cdef chunk chunk_
+
+    chunklen = self._chunklen
+    if (self.leftover or src._dtype != self._dtype or
+        src._chunklen != chunklen or
+        _bparams_key(src._bparams) != _bparams_key(self._bparams) or
+        (self._dtype.char == 'O' and getattr(src.chunks, 'oneobj', 0))):
+      for i from 0 <= i < src.len by chunklen:
+        self.append(src[i:i+chunklen])
+      return
+
+    memory = self._rootdir is None
+    nchunks = src.nchunks
+    cbytes = 0
+    for nchunk from 0 <= nchunk < nchunks:
+      chunk_ = src.chunks[nchunk]
+      if chunk_.isconstant and chunk_.cdbytes == 0 and not memory:
+        # Constants in memory have no compressed form for going to disk
+        chunk_ = chunk(chunk_array(chunk_), self._dtype, self._bparams,
+                       _memory=False)
+      self.chunks.append(chunk_)
+      cbytes += chunk_.cbytes
+    self._cbytes += cbytes
+    self._nbytes += nchunks * self._chunksize
+    if src.leftover:
+      self.append(src.lastchunkarr[:cython.cdiv(src.leftover, src.atomsize)])
+
+  def chunks_class(self):
+    """Return the class for storing the chunks on-disk."""
+    if self._storage == 'packed':
+      return packedchunks
+    return chunks
+
   def open_barray(self, shape, bparams, dtype, dflt,
-                  expectedlen, cbytes, chunklen):
+                  expectedlen, cbytes, chunklen, storage, objbatch):
     """Open an existing array."""
     cdef ndarray lastchunkarr
     cdef object array_, _dflt
     cdef npy_intp calen
+    cdef int oneobj
 
     if len(shape) == 1:
         self._dtype = dtype
@@ -1156,12 +1964,24 @@ cdef class barray:
     self.itemsize = dtype.base.itemsize
     self._chunklen = chunklen
     self._chunksize = chunklen * self.atomsize
-    self._dflt = dflt
+    _dflt = np.zeros((), dtype=dtype)
+    if dtype.shape == ():
+      _dflt[()] = dflt
+    else:
+      _dflt[:] = dflt
+    self._dflt = _dflt
     self.expectedlen = expectedlen
+    self._storage = storage
+
+    # Objects written by BLZ <= 0.6.2 come in chunks of their own
+    oneobj = dtype.char == 'O' and not objbatch
+    if oneobj:
+      self._chunklen = 1
+      self._chunksize = self.atomsize
 
     # Book memory for last chunk (uncompressed)
     # Use np.zeros here because they compress better
-    lastchunkarr = np.zeros(dtype=dtype, shape=(chunklen,))
+    lastchunkarr = np.zeros(dtype=dtype, shape=(self._chunklen,))
     self.lastchunk = lastchunkarr.data
     self.lastchunkarr = lastchunkarr
 
@@ -1178,10 +1998,12 @@ cdef class barray:
     calen = shape[0]    # the length ot the barray
     # Finally, open data directory
     metainfo = (dtype, bparams, calen, lastchunkarr, self._mode)
-    self.chunks = chunks(self._rootdir, metainfo=metainfo, _new=False)
+    self.chunks = self.chunks_class()(
+      self._rootdir, metainfo=metainfo, _new=False)
+    self.chunks.oneobj = oneobj
 
     # Update some counters
-    self.leftover = (calen % chunklen) * self.atomsize
+    self.leftover = (calen % self._chunklen) * self.atomsize
     self._cbytes = cbytes
     self._nbytes = calen * self.atomsize
 
@@ -1189,12 +2011,76 @@ cdef class barray:
       # Remove all entries when mode is 'w'
       self.resize(0)
 
+  def batch_objects(self, chunklen=None):
+    """
+    batch_objects(chunklen=None)
+
+    Rewrite a barray of objects written by BLZ <= 0.6.2 in batches.
+
+    Such barrays keep a pickled object per chunk (and per file).  They
+    are still readable and writable, but this rewrites them so that
+    `chunklen` objects are pickled together in every chunk.  The new
+    layout is written to a temporary directory next to `rootdir`, which
+    replaces it when done, so a failure leaves the original intact.
+
+    Parameters
+    ----------
+    chunklen : int
+        The number of objects per chunk.  If None, the one in the
+        metadata is used.
+
+    """
+    cdef npy_intp i
+
+    if self._mode == "r":
+      raise IOError(
+        "cannot modify data because mode is '%s'" % self._mode)
+    if not getattr(self.chunks, 'oneobj', 0):
+      return
+    if chunklen is None:
+      chunklen = self.read_meta()[6]
+    rootdir = self._temp_rootdir()
+    out = barray([], dtype=self._dtype, bparams=self._bparams,
+                 dflt=self._dflt[()], chunklen=chunklen, rootdir=rootdir,
+                 mode='w')
+    for i from 0 <= i < self.len by chunklen:
+      out.append(self[i:i+chunklen])
+    out.flush()
+    self._replace_rootdir(rootdir)
+
+  def _temp_rootdir(self):
+    """Return a new temporary directory next to `rootdir`."""
+    absdir = os.path.dirname(os.path.abspath(self._rootdir))
+    return tempfile.mkdtemp(suffix='__temp__', dir=absdir)
+
+  def _replace_rootdir(self, rootdir):
+    """Replace `rootdir` by the container in `rootdir` and open it.
+
+    The attributes are kept.  A failure before the swap of directories
+    leaves the original container intact.
+    """
+    attrsfile = os.path.join(self._rootdir, attrs.ATTRSDIR)
+    if os.path.exists(attrsfile):
+      shutil.copy(attrsfile, rootdir)
+
+    # Swap the directories and open the new one
+    olddir = rootdir + '__old__'
+    os.rename(self._rootdir, olddir)
+    os.rename(rootdir, self._rootdir)
+    shutil.rmtree(olddir)
+    self.chunks.free_cachemem()
+    mode = self._mode
+    # Do not let the 'w' mode empty it
+    self._mode = 'a'
+    self.open_barray(*self.read_meta())
+    self._mode = self.chunks.mode = mode
+    self._renew_token()
+
   def fill_chunks(self, object array_):
     """Fill chunks, either in-memory or on-disk."""
     cdef int leftover, chunklen
-    cdef npy_intp i, nchunks
+    cdef npy_intp nchunks
     cdef npy_intp nbytes, cbytes
-    cdef chunk chunk_
     cdef ndarray remainder
 
     # The number of bytes in incoming array
@@ -1202,23 +2088,48 @@ cdef class barray:
     self._nbytes = nbytes
 
     # Compress data in chunks
-    cbytes = 0
     chunklen = self._chunklen
     nchunks = <npy_intp>cython.cdiv(nbytes, self._chunksize)
-    for i from 0 <= i < nchunks:
-      assert i*chunklen < array_.size, "i, nchunks: %d, %d" % (i, nchunks)
-      chunk_ = chunk(array_[i*chunklen:(i+1)*chunklen],
-                     self._dtype, self._bparams,
-                     _memory = self._rootdir is None)
-      self.chunks.append(chunk_)
-      cbytes += chunk_.cbytes
+    cbytes = self._compress_chunks(array_, nchunks)
     self.leftover = leftover = nbytes % self._chunksize
     if leftover:
       remainder = array_[nchunks*chunklen:]
-      memcpy(self.lastchunk, remainder.data, leftover)
+      if array_.dtype.char == 'O':
+        self.lastchunkarr[:len(remainder)] = remainder
+      else:
+        memcpy(self.lastchunk, remainder.data, leftover)
     cbytes += self._chunksize  # count the space in last chunk
     self._cbytes = cbytes
 
+  def _compress_chunks(self, ndarray array, npy_intp nchunks):
+    """Compress the first `nchunks` chunks in `array` and append them.
+
+    If `blz.defaults.nthreads` is larger than 1, the chunks are compressed
+    by a pool of threads (the GIL is released during compression) while
+    they are being appended here, in order.  Returns the compressed size.
+    """
+    cdef npy_intp cbytes, chunklen
+    cdef chunk chunk_
+
+    chunklen = self._chunklen
+    memory = self._rootdir is None
+    # Keep `self` out of the closure, the pool may outlive this call
+    dtype, bparams = self._dtype, self._bparams
+    def compress(i):
+      return chunk(array[i*chunklen:(i+1)*chunklen],
+                   dtype, bparams, _memory=memory)
+
+    nthreads = blz.defaults.nthreads
+    if nthreads > 1 and nchunks > 1:
+      compressed = utils.thread_pool(nthreads).imap(compress, xrange(nchunks))
+    else:
+      compressed = (compress(i) for i in xrange(nchunks))
+    cbytes = 0
+    for chunk_ in compressed:
+      self.chunks.append(chunk_)
+      cbytes += chunk_.cbytes
+    return cbytes
+
   def mkdirs(self, object rootdir, object mode):
     """Create the basic directory layout for persistent storage."""
     if os.path.exists(rootdir):
@@ -1255,10 +2166,18 @@ cdef class barray:
           "bparams": {
             "clevel": self.bparams.clevel,
             "shuffle": self.bparams.shuffle,
+            "cname": self.bparams.cname.decode('ascii'),
+            "blocksize": self.bparams.blocksize,
+            "objective": self.bparams.objective,
+            "prefilter": self.bparams.prefilter,
             },
           "chunklen": self._chunklen,
           "expectedlen": self.expectedlen,
           "dflt": dflt_list,
+          "storage": self._storage,
+          "format": STORAGE_FORMAT,
+          # Only barrays of objects written by BLZ <= 0.6.2 lack this
+          "objbatch": not getattr(self.chunks, 'oneobj', 0),
           }, ensure_ascii=True).encode('ascii'))
         storagefh.write(b"\n")
 
@@ -1280,28 +2199,34 @@ cdef class barray:
     storagef = os.path.join(metadir, STORAGE_FILE)
     with open(storagef, 'rb') as storagefh:
       data = json.loads(storagefh.read().decode('ascii'))
+    # Chunks of newer layouts cannot be read as plain Blosc buffers
+    version = data.get("format", 1)
+    if version > STORAGE_FORMAT:
+      raise IOError(
+        "'%s' has format version %s, but this version of BLZ only reads "
+        "up to %d" % (self._rootdir, version, STORAGE_FORMAT))
     dtype_ = np.dtype(data["dtype"])
     chunklen = data["chunklen"]
+    # Containers written by BLZ <= 0.6.2 only keep clevel and shuffle
     bparams = blz.bparams(
       clevel = data["bparams"]["clevel"],
-      shuffle = data["bparams"]["shuffle"])
+      shuffle = data["bparams"]["shuffle"],
+      cname = data["bparams"].get("cname", "blosclz"),
+      blocksize = data["bparams"].get("blocksize", 0),
+      objective = data["bparams"].get("objective", "ratio"),
+      prefilter = data["bparams"].get("prefilter"))
     expectedlen = data["expectedlen"]
     dflt = data["dflt"]
-    return (shape, bparams, dtype_, dflt, expectedlen, cbytes, chunklen)
+    # Containers without this entry store a file per chunk
+    storage = data.get("storage", "files")
+    # Containers without this entry store an object per chunk
+    objbatch = data.get("objbatch", False)
+    return (shape, bparams, dtype_, dflt, expectedlen, cbytes, chunklen,
+            storage, objbatch)
 
   def store_obj(self, object arrobj):
-    cdef chunk chunk_
-    import pickle
-
-    pick_obj = pickle.dumps(arrobj, pickle.HIGHEST_PROTOCOL)
-    chunk_ = chunk(pick_obj, np.dtype('O'), self._bparams,
-                   _memory = self._rootdir is None)
-
-    self.chunks.append(chunk_)
-    # Update some counters
-    nbytes, cbytes = chunk_.nbytes, chunk_.cbytes
-    self._cbytes += cbytes
-    self._nbytes += nbytes
+    """Append `arrobj` as a single object."""
+    self.append(_objarray([arrobj]))
 
   def append(self, object array):
     """
@@ -1313,7 +2238,9 @@ cdef class barray:
     ----------
     array : NumPy-like object
         The array to be appended.  Must be compatible with shape and type of
-        the barray.
+        the barray.  For barrays of objects, the elements of NumPy arrays
+        of objects are appended; anything else is appended as a single
+        object.
 
     """
     cdef int atomsize, itemsize, chunksize, leftover
@@ -1326,15 +2253,16 @@ cdef class barray:
       raise IOError(
         "cannot modify data because mode is '%s'" % self.mode)
 
-    arrcpy = utils.to_ndarray(array, self._dtype)
+    if self._dtype.char == 'O':
+      if isinstance(array, np.ndarray) and array.dtype.char == 'O':
+        arrcpy = _objarray(array) if array.ndim != 1 else array
+      else:
+        arrcpy = _objarray([array])
+    else:
+      arrcpy = utils.to_ndarray(array, self._dtype)
     if arrcpy.dtype != self._dtype.base:
       raise TypeError, "array dtype does not match with self"
 
-    # Object dtype requires special storage
-    if arrcpy.dtype.char == 'O':
-      self.store_obj(array)
-      return
-
     # Appending a single row should be supported
     if arrcpy.shape == self._dtype.shape:
       arrcpy = arrcpy.reshape((1,)+arrcpy.shape)
@@ -1352,7 +2280,7 @@ cdef class barray:
     # Check if array fits in existing buffer
     if (bsize + leftover) < chunksize:
       # Data fits in lastchunk buffer.  Just copy it
-      if arrcpy.strides[0] > 0:
+      if arrcpy.strides[0] > 0 and arrcpy.dtype.char != 'O':
         memcpy(self.lastchunk+leftover, arrcpy.data, bsize)
       else:
         start = cython.cdiv(leftover, atomsize)
@@ -1365,12 +2293,12 @@ cdef class barray:
       # First, fill the last buffer completely (if needed)
       if leftover:
         nbytesfirst = chunksize - leftover
-        if arrcpy.strides[0] > 0:
+        if arrcpy.strides[0] > 0 and arrcpy.dtype.char != 'O':
           memcpy(self.lastchunk+leftover, arrcpy.data, nbytesfirst)
         else:
           start = cython.cdiv(leftover, atomsize)
           stop = cython.cdiv((leftover+nbytesfirst), atomsize)
-          self.lastchunkarr[start:stop] = arrcpy[start:stop]
+          self.lastchunkarr[start:stop] = arrcpy[:stop-start]
         # Compress the last chunk and add it to the list
         chunk_ = chunk(self.lastchunkarr, self._dtype, self._bparams,
                        _memory = self._rootdir is None)
@@ -1385,18 +2313,13 @@ cdef class barray:
       chunklen = self._chunklen
       # Get a new view skipping the elements that have been already copied
       remainder = arrcpy[cython.cdiv(nbytesfirst, atomsize):]
-      for i from 0 <= i < nchunks:
-        chunk_ = chunk(
-          remainder[i*chunklen:(i+1)*chunklen], self._dtype, self._bparams,
-          _memory = self._rootdir is None)
-        chunks.append(chunk_)
-        cbytes += chunk_.cbytes
+      cbytes += self._compress_chunks(remainder, nchunks)
 
       # Finally, deal with the leftover
       leftover = nbytes % chunksize
       if leftover:
         remainder = remainder[nchunks*chunklen:]
-        if arrcpy.strides[0] > 0:
+        if arrcpy.strides[0] > 0 and arrcpy.dtype.char != 'O':
           memcpy(self.lastchunk, remainder.data, leftover)
         else:
           self.lastchunkarr[:len(remainder)] = remainder
@@ -1451,7 +2374,8 @@ cdef class barray:
       leftover2 = (self.len - nitems) % self._chunklen
       leftover = leftover2 * atomsize
 
-      # Remove complete chunks
+      # Remove complete chunks (and their blocks from the cache)
+      self._renew_token()
       nchunk2 = lnchunk = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
       while nchunk2 > nchunk:
         chunk_ = chunks.pop()
@@ -1465,7 +2389,7 @@ cdef class barray:
           # Last chunk is removed automatically by the chunks.pop() call, and
           # always is counted as if it is not compressed (although it is in
           # this state on-disk)
-          cbytes += chunk_.nbytes
+          cbytes += self._chunksize
 
     # Update some counters
     self.leftover = leftover
@@ -1497,7 +2421,12 @@ cdef class barray:
     elif nitems < 0:
       raise ValueError, "`nitems` cannot be negative"
 
-    if nitems > self.len:
+    if nitems > self.len and self._dtype.char == 'O':
+      chunk = np.empty(nitems-self.len, dtype=self._dtype)
+      chunk[:] = self._dflt
+      self.append(chunk)
+      self.flush()
+    elif nitems > self.len:
       # Create a 0-strided array and append it to self
       chunk = np.ndarray(nitems-self.len, dtype=self._dtype,
                          buffer=self._dflt, strides=(0,))
@@ -1574,7 +2503,7 @@ cdef class barray:
     # Create the final container and fill it
     out = barray([], dtype=newdtype, bparams=self.bparams,
                  expectedlen=newlen,
-                 rootdir=rootdir, mode='w')
+                 rootdir=rootdir, mode='w', storage=self._storage)
     if newlen < ilen:
       rsize = isize / newlen
       for i from 0 <= i < newlen:
@@ -1611,25 +2540,82 @@ cdef class barray:
         The copy of this object.
 
     """
-    cdef object chunklen
 
     # Get defaults for some parameters
     bparams = kwargs.pop('bparams', self._bparams)
+    if 'expectedlen' not in kwargs:
+      # Keep the chunklen, so that chunks can be copied compressed
+      kwargs.setdefault('chunklen', self._chunklen)
     expectedlen = kwargs.pop('expectedlen', self.len)
+    storage = kwargs.pop('storage', self._storage)
 
-    # Create a new, empty barray
-    ccopy = barray(np.empty(0, dtype=self._dtype),
-                   bparams=bparams,
-                   expectedlen=expectedlen,
-                   **kwargs)
+    # The chunks are copied by the constructor
+    return barray(self, bparams=bparams, expectedlen=expectedlen,
+                  storage=storage, **kwargs)
 
-    # Now copy the barray chunk by chunk
-    chunklen = self._chunklen
-    for i from 0 <= i < self.len by chunklen:
-      ccopy.append(self[i:i+chunklen])
-    ccopy.flush()
+  def recompress(self, bparams):
+    """
+    recompress(bparams)
 
-    return ccopy
+    Recompress this object in-place with new compression parameters.
+
+    The chunks are recompressed one at a time, so that memory
+    consumption stays low even for large persistent objects.  The new
+    `bparams` are used for later appends too, and are saved in the
+    metadata of persistent objects.  With the 'packed' storage, the
+    chunks are written to a new segment (in a temporary directory
+    next to `rootdir`), so that the space of the old ones is given
+    back.
+
+    Parameters
+    ----------
+    bparams : instance of the `bparams` class
+        The new parameters for the internal Blosc compressor.
+
+    """
+    cdef npy_intp nchunk, nchunks, cbytes
+    cdef chunk chunk_
+
+    if self._mode == "r":
+      raise IOError(
+        "cannot modify data because mode is '%s'" % self._mode)
+    if not isinstance(bparams, blz.bparams):
+      raise ValueError, "`bparams` param must be an instance of `bparams` class"
+
+    memory = self._rootdir is None
+    if not memory and self._storage == 'packed':
+      # Chunks growing in place would leave holes in the segment
+      rootdir = self._temp_rootdir()
+      out = barray(self, bparams=bparams, dflt=self._dflt[()],
+                   chunklen=self._chunklen, rootdir=rootdir, mode='w',
+                   storage=self._storage)
+      out.flush()
+      self._replace_rootdir(rootdir)
+      return
+    if not memory:
+      (<chunks>self.chunks).bparams = bparams
+    nchunks = self.nchunks
+    cbytes = self._cbytes
+    for nchunk from 0 <= nchunk < nchunks:
+      chunk_ = self.chunks[nchunk]
+      if self._dtype.char == 'O':
+        data = chunk_.getobjs()
+      else:
+        data = chunk_[:]
+      cbytes -= chunk_.cbytes
+      chunk_ = chunk(data, self._dtype, bparams, _memory=memory)
+      cbytes += chunk_.cbytes
+      if memory:
+        self.chunks[nchunk] = chunk_
+      else:
+        # The zone maps do not change, so there is no need to save them
+        (<chunks>self.chunks)._save(nchunk, chunk_)
+    self._cbytes = cbytes
+    self._bparams = bparams
+    if not memory:
+      self.write_meta()
+      # The leftover is compressed with the new bparams too
+      self.flush()
 
   def sum(self, dtype=None):
     """
@@ -1673,8 +2659,8 @@ cdef class barray:
     for nchunk from 0 <= nchunk < nchunks:
       chunk_ = self.chunks[nchunk]
       if chunk_.isconstant:
-        result += chunk_.constant * self._chunklen
-      elif self._dtype.type == np.bool_:
+        result += chunk_.constant.sum(dtype=dtype) * self._chunklen
+      elif self._dtype.type == np.bool_ and chunk_.true_count >= 0:
         result += chunk_.true_count
       else:
         result += chunk_[:].sum(dtype=dtype)
@@ -1684,6 +2670,296 @@ cdef class barray:
 
     return result
 
+  def _map_chunks(self, func):
+    """Yield `func(data)` for every chunk, in order.
+
+    `data` is a `chunk` object for the compressed chunks and a NumPy
+    array for the leftover.  If `blz.defaults.nthreads` is larger than
+    1, the chunks are processed by a pool of threads.
+    """
+    cdef npy_intp nchunks, leftover
+
+    nchunks = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
+    def apply(nchunk):
+      return func(self.chunks[nchunk])
+
+    nthreads = blz.defaults.nthreads
+    if nthreads > 1 and nchunks > 1:
+      results = utils.thread_pool(nthreads).imap(apply, xrange(nchunks))
+    else:
+      results = (apply(nchunk) for nchunk in xrange(nchunks))
+    for result in results:
+      yield result
+    if self.leftover:
+      leftover = cython.cdiv(self.leftover, self.atomsize)
+      yield func(self.lastchunkarr[:leftover])
+
+  def _check_reduce(self, name, numeric=True):
+    """Check that reduction `name` can be performed on this barray."""
+    kind = self._dtype.base.kind
+    if kind == 'O' or (numeric and kind not in ('b', 'i', 'u', 'f')):
+      raise TypeError("cannot perform %s with %s type" % (
+        name, self._dtype.base))
+
+  def _extreme(self, ufunc, int pos):
+    """Return the reduction of all the elements with `ufunc`.
+
+    `pos` is the position of the outcome in the zone maps.
+    """
+    dtype = self._dtype.base
+    self._check_reduce(ufunc.__name__)
+    if self.size == 0:
+      raise ValueError("zero-size barray to reduction operation %s "
+                       "which has no identity" % ufunc.__name__)
+
+    # The zone map of the whole array does not need decompression
+    zmap = self._getstats(0, self.len)
+    if zmap is not None:
+      if zmap[2] > 0:
+        # NaNs are propagated (NumPy convention)
+        return dtype.type(np.nan)
+      return dtype.type(zmap[pos])
+
+    result = None
+    for value in self._map_chunks(
+        lambda data: ufunc.reduce(chunk_array(data, True), axis=None)):
+      result = value if result is None else ufunc(result, value)
+    return result
+
+  def _argextreme(self, name, better, int pos):
+    """Return the index of the first element beating the rest by `better`.
+
+    NaNs win over the rest of values (NumPy convention).  `pos` is the
+    position of the extreme value in the zone maps.
+    """
+    cdef npy_intp chunklen, nchunk, nchunks, start
+    cdef object zmap, stats, array
+
+    self._check_reduce(name)
+    if self.size == 0:
+      raise ValueError("attempt to get %s of an empty sequence" % name)
+    argfunc = np.argmin if pos == 0 else np.argmax
+
+    zmap = self._getstats(0, self.len)
+    if zmap is not None:
+      # Only the chunk with the first NaN or extreme value is decompressed
+      chunklen = self._chunklen
+      nchunks = <npy_intp>cython.cdiv(self.len + chunklen - 1, chunklen)
+      for nchunk from 0 <= nchunk < nchunks:
+        start = nchunk * chunklen
+        stats = self._getstats(start, start + chunklen)
+        if zmap[2] > 0:
+          found = stats[2] > 0
+        else:
+          found = stats[pos] == zmap[pos]
+        if found:
+          return start + argfunc(self[start:start+chunklen])
+
+    def partial(data):
+      array = chunk_array(data)
+      idx = argfunc(array, axis=None)
+      return (idx, array.flat[idx], array.size)
+
+    best, bestidx, start = None, 0, 0
+    for idx, value, nelems in self._map_chunks(partial):
+      if (best is None or (value != value and best == best) or
+          better(value, best)):
+        best, bestidx = value, start + idx
+      start += nelems
+    return bestidx
+
+  def min(self):
+    """
+    min()
+
+    Return the minimum of the array elements.
+
+    The zone maps of the chunks are used when available, so that no
+    chunk is decompressed.  NaNs are propagated (NumPy convention).
+
+    Return value
+    ------------
+    out : NumPy scalar with the dtype of `self`
+
+    """
+    return self._extreme(np.minimum, 0)
+
+  def max(self):
+    """
+    max()
+
+    Return the maximum of the array elements.
+
+    The zone maps of the chunks are used when available, so that no
+    chunk is decompressed.  NaNs are propagated (NumPy convention).
+
+    Return value
+    ------------
+    out : NumPy scalar with the dtype of `self`
+
+    """
+    return self._extreme(np.maximum, 1)
+
+  def argmin(self):
+    """
+    argmin()
+
+    Return the index of the (first) minimum of the array elements.
+
+    For multidimensional arrays, the index is into the flattened array.
+
+    Return value
+    ------------
+    out : int
+
+    """
+    return self._argextreme("argmin", np.less, 0)
+
+  def argmax(self):
+    """
+    argmax()
+
+    Return the index of the (first) maximum of the array elements.
+
+    For multidimensional arrays, the index is into the flattened array.
+
+    Return value
+    ------------
+    out : int
+
+    """
+    return self._argextreme("argmax", np.greater, 1)
+
+  def mean(self):
+    """
+    mean()
+
+    Return the mean of the array elements.
+
+    Return value
+    ------------
+    out : NumPy scalar with float64 type (or the dtype of `self` for
+          floating point types)
+
+    """
+    self._check_reduce("mean")
+    dtype = self._dtype.base
+    if dtype.kind != 'f':
+      dtype = np.dtype(np.float64)
+    if self.size == 0:
+      return dtype.type(np.nan)
+    return dtype.type(self.sum(dtype=np.float64) / self.size)
+
+  def var(self, ddof=0):
+    """
+    var(ddof=0)
+
+    Return the variance of the array elements.
+
+    Partial results for every chunk are combined in a numerically
+    stable way, so only a chunk is decompressed at a time.
+
+    Parameters
+    ----------
+    ddof : int
+        The divisor used in calculations is ``N - ddof``, where ``N``
+        represents the number of elements.
+
+    Return value
+    ------------
+    out : NumPy scalar with float64 type (or the dtype of `self` for
+          floating point types)
+
+    """
+    self._check_reduce("var")
+    dtype = self._dtype.base
+    if dtype.kind != 'f':
+      dtype = np.dtype(np.float64)
+
+    n, mean, m2 = 0, 0., 0.
+    for nb, meanb, m2b in self._map_chunks(_chunk_moments):
+      if nb == 0:
+        continue
+      # Parallel algorithm by Chan et al.
+      delta = meanb - mean
+      m2 += m2b + delta * delta * n * nb / (n + nb)
+      mean += delta * nb / (n + nb)
+      n += nb
+    if n - ddof <= 0:
+      return dtype.type(np.nan)
+    return dtype.type(m2 / (n - ddof))
+
+  def std(self, ddof=0):
+    """
+    std(ddof=0)
+
+    Return the standard deviation of the array elements.
+
+    Parameters
+    ----------
+    ddof : int
+        The divisor used in calculations is ``N - ddof``, where ``N``
+        represents the number of elements.
+
+    Return value
+    ------------
+    out : NumPy scalar with float64 type (or the dtype of `self` for
+          floating point types)
+
+    """
+    return np.sqrt(self.var(ddof))
+
+  def count_nonzero(self):
+    """
+    count_nonzero()
+
+    Return the number of elements that are not zero.
+
+    The count of true values kept for boolean chunks, constant chunks
+    and zone maps are used when possible, instead of decompressing.
+
+    Return value
+    ------------
+    out : int
+
+    """
+    self._check_reduce("count_nonzero", numeric=False)
+    return sum(count for count, n in self._map_chunks(_chunk_count_nonzero))
+
+  def any(self):
+    """
+    any()
+
+    Return whether any of the array elements is true.
+
+    Return value
+    ------------
+    out : bool
+
+    """
+    self._check_reduce("any", numeric=False)
+    for count, n in self._map_chunks(_chunk_count_nonzero):
+      if count > 0:
+        return True
+    return False
+
+  def all(self):
+    """
+    all()
+
+    Return whether all of the array elements are true.
+
+    Return value
+    ------------
+    out : bool
+
+    """
+    self._check_reduce("all", numeric=False)
+    for count, n in self._map_chunks(_chunk_count_nonzero):
+      if count < n:
+        return False
+    return True
+
   def __len__(self):
     return self.len
 
@@ -1700,13 +2976,13 @@ cdef class barray:
     data that is cached is a *block*, as it is the least amount of data that
     can be decompressed.  This saves both time and memory.
 
-    IMPORTANT: Any update operation (e.g. __setitem__) *must* disable this
-    cache by setting self.idxcache = -2.
+    IMPORTANT: Any update operation (e.g. __setitem__) *must* invalidate
+    the cached blocks by renewing self.token.
     """
-    cdef int ret, atomsize, blocksize, offset
-    cdef int idxcache, posinbytes, blocklen
-    cdef npy_intp nchunk, nchunks, chunklen
+    cdef int atomsize, blocksize, blocklen, posinbytes
+    cdef npy_intp nchunk, nchunks, chunklen, posinchunk, offset
     cdef chunk chunk_
+    cdef ndarray block
 
     atomsize = self.atomsize
     nchunks = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
@@ -1724,56 +3000,215 @@ cdef class barray:
     blocksize = chunk_.blocksize
     blocklen = <npy_intp>cython.cdiv(blocksize, atomsize)
 
-    if ((atomsize > blocksize) or ((pos + blocklen) > chunklen)):
+    if atomsize > blocksize:
       # This request cannot be resolved here
       return 0
 
-    # Check whether the cache block has to be initialized
-    if self.idxcache < 0:
-      self.blockcache = np.empty(shape=(blocklen,), dtype=self._dtype)
-      self.datacache = self.blockcache.data
-      # We don't want this to contribute to cbytes counter!
-      # if self.idxcache == -1:
-      #   # Absolute first time.  Add the cache size to cbytes counter.
-      #   self._cbytes += chunksize
-
     # Check if block is cached
-    idxcache = <npy_intp>cython.cdiv(pos, blocklen) * blocklen
-    if idxcache == self.idxcache:
-      # Hit!
-      posinbytes = (pos % blocklen) * atomsize
-      memcpy(dest, self.datacache + posinbytes, atomsize)
-      return 1
+    posinchunk = pos % chunklen
+    offset = <npy_intp>cython.cdiv(posinchunk, blocklen) * blocklen
+    key = (self.token, nchunk, offset)
+    block = _cache.get(key)
+    if block is None:
+      # No luck. Read a complete block (the last one can be shorter).
+      block = np.empty(shape=(min(blocklen, chunklen - offset),),
+                       dtype=self._dtype)
+      chunk_._getitem(offset, offset + len(block), block.data)
+      _cache.put(key, block, block.nbytes)
 
-    # No luck. Read a complete block.
-    offset = idxcache % chunklen
-    chunk_._getitem(offset, offset+blocklen, self.datacache)
     # Copy the interesting bits to dest
-    posinbytes = (pos % blocklen) * atomsize
-    memcpy(dest, self.datacache + posinbytes, atomsize)
-    # Update the cache index
-    self.idxcache = idxcache
+    memcpy(dest, block.data + (posinchunk - offset) * atomsize, atomsize)
     return 1
 
   def free_cachemem(self):
     if type(self.chunks) is not list:
       self.chunks.free_cachemem()
-    self.idxcache = -1
-    self.blockcache = None
+    _cache.remove_owner(self.token)
+
+  cdef _renew_token(self):
+    """Make the cached blocks stale, giving their memory back."""
+    _cache.remove_owner(self.token)
+    self.token = next(_cache_tokens)
   
+  cdef _check_indices(self, ndarray key):
+    """Return `key` (an integer array) with negative indices resolved."""
+    cdef ndarray idx
+
+    idx = np.where(key < 0, key + self.len, key)
+    if len(idx) > 0 and (idx.min() < 0 or idx.max() >= self.len):
+      raise IndexError, "index out of range"
+    return idx
+
+  cdef _chunk_groups(self, ndarray idx):
+    """Group the positions in `idx` by chunk.
+
+    Returns the permutation that sorts `idx` by chunk and the bounds of
+    each group in the permuted positions.  The sort is stable, so
+    repeated positions keep their original order.
+    """
+    cdef ndarray order, bounds
+
+    order = np.argsort(idx // self._chunklen, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(idx[order] // self._chunklen)) + 1
+    bounds = np.concatenate(([0], bounds, [len(idx)]))
+    return order, bounds
+
+  cdef _getitems(self, ndarray key):
+    """Get the elements at the positions in `key` (an integer array).
+
+    Positions are grouped by chunk, so that every chunk touched is
+    decompressed just once (and only for the span of blocks needed).
+    """
+    cdef npy_intp nchunk, nchunks, chunklen, lo, hi, i
+    cdef ndarray out, idx, order, bounds, pos, sidx, data
+    cdef chunk chunk_
+
+    idx = self._check_indices(key)
+    out = np.empty(shape=(len(idx),), dtype=self._dtype)
+    if len(idx) == 0:
+      return out
+    chunklen = self._chunklen
+    nchunks = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
+    order, bounds = self._chunk_groups(idx)
+    sidx = idx[order]
+    for i from 0 <= i < len(bounds) - 1:
+      pos = sidx[bounds[i]:bounds[i+1]]
+      nchunk = pos[0] // chunklen
+      pos = pos - nchunk * chunklen
+      if nchunk == nchunks:
+        data = self.lastchunkarr
+        lo = 0
+      elif self._dtype.char == 'O':
+        data = self.chunks[nchunk][:]
+        lo = 0
+      else:
+        # Decompress the blocks between the first and the last position
+        lo, hi = pos.min(), pos.max() + 1
+        data = np.empty(shape=(hi - lo,), dtype=self._dtype)
+        chunk_ = self.chunks[nchunk]
+        chunk_._getitem(lo, hi, data.data)
+      out[order[bounds[i]:bounds[i+1]]] = data[pos - lo]
+    return out
+
+  cdef _getmask(self, object boolarr):
+    """Get the elements where `boolarr` (a boolean array) is true.
+
+    The mask is applied chunk by chunk with NumPy into a preallocated
+    output.  Chunks are only decompressed for the span between the first
+    and the last true values in the mask, and not at all if there are no
+    true values.
+    """
+    cdef npy_intp nchunk, nchunks, chunklen, start, n, nwrow, lo, hi
+    cdef ndarray out, maskb, data
+    cdef barray mask
+    cdef chunk chunk_
+
+    mask = None
+    if isinstance(boolarr, barray):
+      mask = boolarr
+      n = mask.count_nonzero()
+    else:
+      n = np.count_nonzero(boolarr)
+    out = np.empty(shape=(n,), dtype=self._dtype)
+    chunklen = self._chunklen
+    nchunks = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
+    if self.leftover > 0:
+      nchunks += 1
+    nwrow = 0
+    for nchunk from 0 <= nchunk < nchunks:
+      if nwrow == len(out):
+        break
+      if (mask is not None and mask._chunklen == chunklen and
+          nchunk < len(mask.chunks)):
+        # Mask chunks without true values are not even decompressed
+        if _chunk_count_nonzero(mask.chunks[nchunk])[0] == 0:
+          continue
+      start = nchunk * chunklen
+      maskb = np.asarray(boolarr[start:start+chunklen])
+      n = np.count_nonzero(maskb)
+      if n == 0:
+        continue
+      if nchunk == nchunks - 1 and self.leftover:
+        data = self.lastchunkarr
+        lo = 0
+      elif self._dtype.char == 'O':
+        data = self.chunks[nchunk][:]
+        lo = 0
+      else:
+        lo = maskb.argmax()
+        hi = len(maskb) - maskb[::-1].argmax()
+        data = np.empty(shape=(hi - lo,), dtype=self._dtype)
+        chunk_ = self.chunks[nchunk]
+        chunk_._getitem(lo, hi, data.data)
+      np.compress(maskb[lo:lo+len(data)], data[:len(maskb)-lo], axis=0,
+                  out=out[nwrow:nwrow+n])
+      nwrow += n
+    return out
+
+  cdef _setitems(self, ndarray key, ndarray value):
+    """Set the elements at the positions in `key` (an integer array).
+
+    Positions are grouped by chunk, so that every chunk touched is
+    decompressed and compressed just once.  As in NumPy, the last value
+    wins for repeated positions.
+    """
+    cdef npy_intp nchunk, nchunks, chunklen, i
+    cdef ndarray idx, order, bounds, pos, sidx, svalue, cdata
+    cdef chunk chunk_
+
+    idx = self._check_indices(key)
+    if len(idx) == 0:
+      return
+    chunklen = self._chunklen
+    nchunks = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
+    order, bounds = self._chunk_groups(idx)
+    sidx, svalue = idx[order], value[order]
+    for i from 0 <= i < len(bounds) - 1:
+      pos = sidx[bounds[i]:bounds[i+1]]
+      nchunk = pos[0] // chunklen
+      pos = pos - nchunk * chunklen
+      if nchunk == nchunks:
+        self.lastchunkarr[pos] = svalue[bounds[i]:bounds[i+1]]
+        continue
+      # Get the data chunk
+      chunk_ = self.chunks[nchunk]
+      self._cbytes -= chunk_.cbytes
+      # Get all the values there and overwrite them with data from value
+      cdata = chunk_[:]
+      cdata[pos] = svalue[bounds[i]:bounds[i+1]]
+      # Replace the chunk
+      chunk_ = chunk(cdata, self._dtype, self._bparams,
+                     _memory = self._rootdir is None)
+      self.chunks[nchunk] = chunk_
+      # Update cbytes counter
+      self._cbytes += chunk_.cbytes
+    self._sync_stats()
+
+  cdef _sync_stats(self):
+    """Persist the zone maps of the chunks modified by an update."""
+    if self._rootdir is not None:
+      self.chunks.sync_stats()
+
   def getitem_object(self, start, stop=None, step=None):
     """Retrieve elements of type object."""
-    import pickle
+    cdef npy_intp nchunk, nchunks
 
-    if stop is None and step is None:
-      # Integer
-      cchunk = self.chunks[start]
-      chunk = cchunk.getudata()
-      return pickle.loads(chunk)
+    if stop is not None or step is not None:
+      # Range
+      return self[start:stop:step]
 
-    # Range
-    objs = [self.getitem_object(i) for i in xrange(start, stop, step)]
-    return np.array(objs, dtype=self._dtype)
+    # Integer.  The whole chunk has to be unpickled, so keep it cached.
+    nchunk = <npy_intp>cython.cdiv(start, self._chunklen)
+    nchunks = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
+    if nchunk == nchunks:
+      return self.lastchunkarr[start % self._chunklen]
+    key = (self.token, nchunk, -1)
+    objs = _cache.get(key)
+    if objs is None:
+      chunk_ = self.chunks[nchunk]
+      objs = chunk_[:]
+      _cache.put(key, objs, chunk_.nbytes)
+    return objs[start % self._chunklen]
 
   def __getitem__(self, object key):
     """
@@ -1860,14 +3295,10 @@ cdef class barray:
         # A boolean array
         if len(key) != self.len:
           raise IndexError, "boolean array length must match len(self)"
-        if isinstance(key, barray):
-          count = key.sum()
-        else:
-          count = -1
-        return np.fromiter(self.where(key), dtype=self._dtype, count=count)
+        return self._getmask(key)
       elif np.issubsctype(key, np.int_):
         # An integer array
-        return np.array([self[i] for i in key], dtype=self._dtype)
+        return self._getitems(key)
       else:
         raise IndexError, \
               "arrays used as indices must be of integer (or boolean) type"
@@ -1889,32 +3320,10 @@ cdef class barray:
     # Get the corrected values for start, stop, step
     (start, stop, step) = slice(start, stop, step).indices(self.len)
 
-    # Build a numpy container
+    # Build a numpy container and fill it from data in chunks
     blen = get_len_of_range(start, stop, step)
     arr = np.empty(shape=(blen,), dtype=self._dtype)
-    if blen == 0:
-      # If empty, return immediately
-      return arr
-
-    if self.dtype.char == 'O':
-      return self.getitem_object(start, stop, step)
-
-    # Fill it from data in chunks
-    nwrow = 0
-    nchunks = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
-    if self.leftover > 0:
-      nchunks += 1
-    for nchunk from 0 <= nchunk < nchunks:
-      # Compute start & stop for each block
-      startb, stopb, blen = clip_chunk(nchunk, chunklen, start, stop, step)
-      if blen == 0:
-        continue
-      # Get the data chunk and assign it to result array
-      if nchunk == nchunks-1 and self.leftover:
-        arr[nwrow:nwrow+blen] = self.lastchunkarr[startb:stopb:step]
-      else:
-        arr[nwrow:nwrow+blen] = self.chunks[nchunk][startb:stopb:step]
-      nwrow += blen
+    self._getslice(start, stop, step, arr)
 
     return arr
 
@@ -1950,9 +3359,8 @@ cdef class barray:
         "cannot modify data because mode is '%s'" % self.mode)
 
     # We are going to modify data.  Mark block cache as dirty.
-    if self.idxcache >= 0:
-      # -2 means that cbytes counter has not to be changed
-      self.idxcache = -2
+    self._renew_token()
+    self._nupdates += 1
 
     # Check for integer
     if isinstance(key, _inttypes):
@@ -2006,9 +3414,7 @@ cdef class barray:
       elif np.issubsctype(key, np.int_):
         # An integer array
         value = utils.to_ndarray(value, self._dtype, arrlen=len(key))
-        # XXX This could be optimised, but it works like this
-        for i, item in enumerate(key):
-          self[item] = value[i]
+        self._setitems(key, value)
         return
       else:
         raise IndexError, \
@@ -2070,6 +3476,7 @@ cdef class barray:
 
     # Safety check
     assert (nwrow == vlen)
+    self._sync_stats()
 
   # This is a private function that is specific for `eval`
   def _getrange(self, npy_intp start, npy_intp blen, ndarray out):
@@ -2108,12 +3515,97 @@ cdef class barray:
       # Get the data chunk and assign it to result array
       if nchunk == nchunks and self.leftover:
         out[nwrow:nwrow+cblen] = self.lastchunkarr[startb:stopb]
+      elif self._dtype.char == 'O':
+        out[nwrow:nwrow+cblen] = self.chunks[nchunk][startb:stopb]
       else:
         chunk_ = self.chunks[nchunk]
         chunk_._getitem(startb, stopb, out.data+nwrow*self.atomsize)
       nwrow += cblen
       start += cblen
 
+  def _getslice(self, npy_intp start, npy_intp stop, npy_intp step,
+                ndarray out):
+    """Fill `out` with the values in the `start:stop:step` slice.
+
+    `out` can be a strided view, like a field of a structured array.
+    When it is contiguous and `step` is 1, chunks are decompressed
+    straight into it; else, through a temporary of (at most) a chunk.
+    """
+    cdef int chunklen, direct
+    cdef npy_intp startb, stopb, blen, nwrow
+    cdef npy_intp nchunk, schunk, echunk, nchunks
+    cdef chunk chunk_
+    cdef ndarray tmp
+
+    if stop <= start:
+      return
+    chunklen = self._chunklen
+    direct = (step == 1 and (<object>out).flags.c_contiguous and
+              out.dtype == self._dtype and self._dtype.char != 'O')
+    if not direct and self._dtype.char != 'O':
+      # A temporary for the chunks, reused for all of them
+      tmp = np.empty(shape=(chunklen,), dtype=self._dtype)
+    nchunks = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
+    schunk = <npy_intp>cython.cdiv(start, chunklen)
+    echunk = <npy_intp>cython.cdiv(stop - 1, chunklen)
+    nwrow = 0
+    for nchunk from schunk <= nchunk <= echunk:
+      # Compute start & stop for each block
+      startb, stopb, blen = clip_chunk(nchunk, chunklen, start, stop, step)
+      if blen == 0:
+        continue
+      if nchunk == nchunks:
+        out[nwrow:nwrow+blen] = self.lastchunkarr[startb:stopb:step]
+      elif direct:
+        chunk_ = self.chunks[nchunk]
+        chunk_._getitem(startb, stopb, out.data + nwrow * self.atomsize)
+      elif self._dtype.char == 'O':
+        out[nwrow:nwrow+blen] = self.chunks[nchunk][startb:stopb:step]
+      else:
+        chunk_ = self.chunks[nchunk]
+        chunk_._getitem(startb, stopb, tmp.data)
+        out[nwrow:nwrow+blen] = tmp[:stopb-startb:step]
+      nwrow += blen
+
+  # This is a private function that is specific for `eval`
+  def _getstats(self, npy_intp start, npy_intp stop):
+    """Return the zone map (min, max, nnans) for rows in [start, stop).
+
+    The zone map is computed out of the chunk metadata, so no
+    decompression happens.  None is returned if it cannot be determined.
+    """
+    cdef int chunklen, leftover_atoms
+    cdef npy_intp nchunk, schunk, echunk, nchunks, nrows
+    cdef object stats, chunkstats
+
+    if self._dtype.char == 'O':
+      return None
+    nrows = <npy_intp>cython.cdiv(self._nbytes, self.atomsize)
+    if stop > nrows:
+      stop = nrows
+    if start >= stop:
+      return None
+
+    chunklen = self._chunklen
+    nchunks = <npy_intp>cython.cdiv(self._nbytes, self._chunksize)
+    schunk = <npy_intp>cython.cdiv(start, chunklen)
+    echunk = <npy_intp>cython.cdiv(stop - 1, chunklen)
+    chunkstats = None
+    if type(self.chunks) is not list:
+      # Avoid reading the on-disk chunks
+      chunkstats = self.chunks.stats
+    stats = []
+    for nchunk from schunk <= nchunk <= echunk:
+      if nchunk == nchunks:
+        # The leftover is not compressed, so compute its stats directly
+        leftover_atoms = cython.cdiv(self.leftover, self.atomsize)
+        stats.append(get_stats(self.lastchunkarr[:leftover_atoms]))
+      elif chunkstats is not None:
+        stats.append(chunkstats[nchunk])
+      else:
+        stats.append(self.chunks[nchunk].stats)
+    return merge_stats(stats)
+
   cdef void bool_update(self, boolarr, value):
     """Update self in positions where `boolarr` is true with `value` array."""
     cdef int chunklen
@@ -2163,6 +3655,7 @@ cdef class barray:
 
     # Safety check
     assert (nwrow == vlen)
+    self._sync_stats()
 
   def __iter__(self):
 
@@ -2459,13 +3952,14 @@ cdef class barray:
 
     if self.leftover:
       leftover_atoms = cython.cdiv(self.leftover, self.atomsize)
-      chunk_ = chunk(self.lastchunkarr[:leftover_atoms], self.dtype,
+      chunk_ = chunk(self.lastchunkarr[:leftover_atoms], self._dtype,
                      self.bparams,
                      _memory = self._rootdir is None)
       # Flush this chunk to disk
       self.chunks.flush(chunk_)
 
-    # Finally, update the sizes metadata on-disk
+    # Update the zone maps and the sizes metadata on-disk
+    self.chunks.write_stats()
     self._update_disk_sizes()
 
   # XXX This does not work.  Will have to realize how to properly
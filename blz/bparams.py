@@ -10,7 +10,8 @@ from blz import blosc_compressor_list
 
 class bparams(object):
     """
-    bparams(clevel=5, shuffle=True, cname=b"blosclz")
+    bparams(clevel=5, shuffle=True, cname=b"blosclz", blocksize=0,
+            objective='ratio', prefilter=None)
 
     Class to host parameters for compression and other filters.
 
@@ -20,8 +21,27 @@ class bparams(object):
         The compression level.
     shuffle : bool
         Whether the shuffle filter is active or not.
-    cname : string ('blosclz', 'lz4', 'lz4hc', 'snappy', 'zlib', others?)
-        Select the compressor to use inside Blosc.
+    cname : string ('blosclz', 'lz4', 'lz4hc', 'snappy', 'zlib', 'auto')
+        Select the compressor to use inside Blosc.  With 'auto', the
+        available compressors are tried on a sample of every chunk, and
+        the one that suits `objective` best is used for that chunk.
+    blocksize : int
+        The size (in bytes) of the blocks that Blosc compresses
+        independently inside every chunk.  0 (the default) means that
+        Blosc chooses it automatically.
+    objective : string or float
+        What 'auto' compressor selection optimizes: 'ratio' for the
+        smallest chunks, 'speed' for the fastest decompression, or a
+        number (>= 1) for the fastest decompression among the
+        compressors whose output is at most that many times the size
+        of the smallest one.
+    prefilter : string or None
+        A reversible transform applied to every chunk before handing it
+        to Blosc: 'delta' (differences between consecutive items) or
+        'for' (frame of reference: offsets from the chunk minimum) for
+        integer and datetime data, and 'xor' (bitwise XOR with the
+        previous item) for floats and integers.  Chunks of other types
+        are stored unfiltered.
 
     Notes
     -----
@@ -45,7 +65,23 @@ class bparams(object):
         """The compressor name."""
         return self._cname
 
-    def __init__(self, clevel=5, shuffle=True, cname="blosclz"):
+    @property
+    def blocksize(self):
+        """The size of the Blosc blocks (0 means automatic)."""
+        return self._blocksize
+
+    @property
+    def objective(self):
+        """What the 'auto' compressor selection optimizes."""
+        return self._objective
+
+    @property
+    def prefilter(self):
+        """The transform applied to chunks before compression."""
+        return self._prefilter
+
+    def __init__(self, clevel=5, shuffle=True, cname="blosclz", blocksize=0,
+                 objective='ratio', prefilter=None):
         if not isinstance(clevel, int):
             raise ValueError("`clevel` must an int.")
         if not isinstance(shuffle, (bool, int)):
@@ -59,16 +95,35 @@ class bparams(object):
         # Store the cname as bytes object internally
         if hasattr(cname, 'encode'):
             cname = cname.encode()
-        if cname not in list_cnames:
+        if cname not in list_cnames and cname != b'auto':
             raise ValueError(
                 "Compressor '%s' is not available in this build" % cname)
         self._cname = cname
+        if not isinstance(blocksize, int) or blocksize < 0:
+            raise ValueError("`blocksize` must be a non-negative int.")
+        self._blocksize = blocksize
+        if objective not in ('ratio', 'speed'):
+            if (not isinstance(objective, (int, float)) or
+                isinstance(objective, bool) or objective < 1):
+                raise ValueError("`objective` must be 'ratio', 'speed' "
+                                 "or a number >= 1.")
+        self._objective = objective
+        if prefilter not in (None, 'delta', 'for', 'xor'):
+            raise ValueError("`prefilter` must be None, 'delta', 'for' "
+                             "or 'xor'.")
+        self._prefilter = prefilter
 
     def __repr__(self):
         args = ["clevel=%d"%self._clevel,
                 "shuffle=%s"%self._shuffle,
                 "cname=%s"%self._cname,
                 ]
+        if self._blocksize:
+            args.append("blocksize=%d"%self._blocksize)
+        if self._cname == b'auto':
+            args.append("objective=%r"%(self._objective,))
+        if self._prefilter:
+            args.append("prefilter=%r"%self._prefilter)
         return '%s(%s)' % (self.__class__.__name__, ', '.join(args))
 
 ## Local Variables:
@@ -18,8 +18,12 @@ import shutil
 
 from .blz_ext import barray
 from .bparams import bparams
-from .chunked_eval import eval as blz_eval
-from .py2help import _inttypes, _strtypes, imap, xrange
+from .chunked_eval import eval as blz_eval, _eval_iter
+from .dictarray import dictarray, pushdown, DICTARRAY_META
+from .vlarray import vlarray, VLARRAY_META
+from .groupby import groupby
+from .indexes import create_index, open_indexes, index_rows
+from .py2help import _inttypes, _strtypes, imap, izip, xrange
 
 # BLZ utilities
 from . import utils, attrs, arrayprint
@@ -30,6 +34,19 @@ islice = itertools.islice
 
 ROOTDIRS = '__rootdirs__'
 
+# The classes of the objects that can be used as columns
+COLTYPES = (barray, dictarray, vlarray)
+
+def _gather(col, rows):
+    """Get the values in `col` for `rows` (sorted row numbers)."""
+    first, last = rows[0], rows[-1] + 1
+    if len(rows) * 8 < last - first:
+        # For sparse rows, fancy indexing decompresses just the blocks
+        # that are needed
+        return col[rows]
+    return col[first:last][rows - first]
+
+
 class cols(object):
     """Class for accessing the columns on the btable object."""
 
@@ -54,7 +71,13 @@ class cols(object):
             # to get rid of the parent dirs.
             dir_ = os.path.basename(dir_)
             dir_ = os.path.join(self.rootdir, dir_)
-            self._cols[str(name)] = barray(rootdir=dir_, mode=self.mode)
+            if os.path.exists(os.path.join(dir_, DICTARRAY_META)):
+                col = dictarray(rootdir=dir_, mode=self.mode)
+            elif os.path.exists(os.path.join(dir_, VLARRAY_META)):
+                col = vlarray(rootdir=dir_, mode=self.mode)
+            else:
+                col = barray(rootdir=dir_, mode=self.mode)
+            self._cols[str(name)] = col
 
     def update_meta(self):
         """Update metainfo about directories on-disk."""
@@ -221,6 +244,10 @@ class btable(object):
         # Attach the attrs to this object
         self.attrs = attrs.attrs(self.rootdir, self.mode, _new=_new)
 
+        # The secondary indexes, keyed by column name
+        self.indexes = {} if _new else open_indexes(self)
+        "The indexes of the btable columns (a dictionary)."
+
         # Cache a structured array of len 1 for btable[int] acceleration
         self._arr1 = np.empty(shape=(1,), dtype=self.dtype)
 
@@ -257,7 +284,7 @@ class btable(object):
         # Guess the kind of columns input
         calist, nalist, ratype = False, False, False
         if type(columns) in (tuple, list):
-            calist = [type(v) for v in columns] == [barray for v in columns]
+            calist = all(type(v) in COLTYPES for v in columns)
             nalist = [type(v) for v in columns] == [np.ndarray for v in columns]
         elif isinstance(columns, np.ndarray):
             ratype = hasattr(columns.dtype, "names")
@@ -269,7 +296,8 @@ class btable(object):
         if not (calist or nalist or ratype):
             # Try to convert the elements to barrays
             try:
-                columns = [barray(col) for col in columns]
+                columns = [col if type(col) in COLTYPES
+                           else barray(col) for col in columns]
                 calist = True
             except:
                 raise ValueError("`columns` input is not supported")
@@ -345,7 +373,7 @@ class btable(object):
         # Guess the kind of rows input
         calist, nalist, sclist, ratype = False, False, False, False
         if type(rows) in (tuple, list):
-            calist = [type(v) for v in rows] == [barray for v in rows]
+            calist = all(type(v) in COLTYPES for v in rows)
             nalist = [type(v) for v in rows] == [np.ndarray for v in rows]
             if not (calist or nalist):
                 # Try with a scalar list
@@ -363,6 +391,7 @@ class btable(object):
 
         # Populate the columns
         clen = -1
+        start = self.len
         for i, name in enumerate(self.names):
             if calist or sclist:
                 column = rows[i]
@@ -385,6 +414,8 @@ class btable(object):
             #     raise ValueError("all cols in `rows` must have the same length")
             clen = clen2
         self.len += clen
+        for index in self.indexes.values():
+            index.append(start)
 
     def trim(self, nitems):
         """
@@ -402,6 +433,8 @@ class btable(object):
         for name in self.names:
             self.cols[name].trim(nitems)
         self.len -= nitems
+        for index in self.indexes.values():
+            index.trim(self.len)
 
     def resize(self, nitems):
         """
@@ -418,9 +451,12 @@ class btable(object):
 
         """
 
+        oldlen = self.len
         for name in self.names:
             self.cols[name].resize(nitems)
         self.len = nitems
+        for index in self.indexes.values():
+            index.resize(oldlen)
 
     def addcol(self, newcol, name=None, pos=None, **kwargs):
         """
@@ -430,8 +466,9 @@ class btable(object):
 
         Parameters
         ----------
-        newcol : barray, ndarray, list or tuple
-            If a barray is passed, no conversion will be carried out.
+        newcol : barray, dictarray, vlarray, ndarray, list or tuple
+            If a barray, dictarray or vlarray is passed, no conversion
+            will be carried out.
             If conversion to a barray has to be done, `kwargs` will
             apply.
         name : string, optional
@@ -484,7 +521,7 @@ class btable(object):
             if 'bparams' not in kwargs:
                 kwargs['bparams'] = self.bparams
             newcol = barray(newcol, **kwargs)
-        elif type(newcol) != barray:
+        elif type(newcol) not in COLTYPES:
             raise ValueError("`newcol` type not supported")
 
         # Insert the column
@@ -534,7 +571,9 @@ class btable(object):
                 raise ValueError("`pos` must be >= 0 and <= len(self.cols)")
             name = self.names[pos]
 
-        # Remove the column
+        # Remove the column (and its index)
+        if name in self.indexes:
+            self.drop_index(name)
         self.cols.pop(name)
         # Update _arr1
         self._arr1 = np.empty(shape=(1,), dtype=self.dtype)
@@ -615,47 +654,130 @@ class btable(object):
 
         """
 
-        # Check input
-        if type(expression) is str:
-            # That must be an expression
-            boolarr = self.eval(expression, **kwargs)
-        elif hasattr(expression, "dtype") and expression.dtype.kind == 'b':
-            boolarr = expression
-        else:
-            raise ValueError("only boolean expressions or arrays are supported")
+        kwargs.setdefault('depth', 4)
+        blocks = self._where_blocks(expression, outcols, limit, skip,
+                                    **kwargs)
+        return self._rows(blocks, self._outcols(outcols))
+
+    def _rows(self, blocks, outcols):
+        """Iterate over the rows of structured `blocks` as namedtuples."""
+
+        namedt = namedtuple('row', outcols)
+        # Building the rows with tuple.__new__ skips the (pure Python)
+        # namedtuple constructor
+        newrow = itertools.repeat(namedt)
+
+        def rows(block):
+            values = [block[name] if block[name].ndim > 1
+                      else block[name].tolist() for name in outcols]
+            return imap(tuple.__new__, newrow, izip(*values))
+
+        return itertools.chain.from_iterable(imap(rows, blocks))
+
+    def _outcols(self, outcols):
+        """Return the list of column names in `outcols`."""
 
-        # Check outcols
         if outcols is None:
-            outcols = self.names
-        else:
-            if type(outcols) not in (list, tuple, str):
-                raise ValueError("only list/str is supported for outcols")
-            # Check name validity
-            nt = namedtuple('_nt', outcols, verbose=False)
-            outcols = list(nt._fields)
-            if set(outcols) - set(self.names+['nrow__']) != set():
-                raise ValueError("not all outcols are real column names")
-
-        # Get iterators for selected columns
-        icols, dtypes = [], []
+            return self.names
+        if type(outcols) not in (list, tuple, str):
+            raise ValueError("only list/str is supported for outcols")
+        # Check name validity
+        nt = namedtuple('_nt', outcols, verbose=False)
+        outcols = list(nt._fields)
+        if set(outcols) - set(self.names+['nrow__']) != set():
+            raise ValueError("not all outcols are real column names")
+        return outcols
+
+    def _outdtype(self, outcols):
+        """Return the structured dtype for the `outcols` column names."""
+
+        dtypes = []
         for name in outcols:
             if name == "nrow__":
-                icols.append(boolarr.wheretrue(limit=limit, skip=skip))
                 dtypes.append((name, np.int_))
             else:
                 col = self.cols[name]
-                icols.append(col.where(boolarr, limit=limit, skip=skip))
-                dtypes.append((name, col.dtype))
-        dtype = np.dtype(dtypes)
-        return self._iter(icols, dtype)
+                dtypes.append((name, col.dtype, col.shape[1:]))
+        return np.dtype(dtypes)
+
+    def _where_blocks(self, expression, outcols=None, limit=None, skip=0,
+                      **kwargs):
+        """Iterate over the rows where `expression` is true in blocks.
+
+        The `expression` is evaluated a block at a time, and the rows
+        where it is true are gathered column by column with NumPy.  The
+        blocks returned are structured arrays with the `outcols` fields;
+        their length varies, and blocks without rows are not returned.
+        """
+
+        outcols = self._outcols(outcols)
+        dtype = self._outdtype(outcols)
+        blen = min(self.cols[name].chunklen for name in self.names)
+
+        # Get the (start, mask) pairs or, for indexes, the rows
+        rows = None
+        if type(expression) is str:
+            # That must be an expression
+            rows = index_rows(self, expression)
+            if rows is None and self.len > 0:
+                depth = kwargs.pop('depth', 3)
+                user_dict = self.cols
+                if any(type(self.cols[name]) is dictarray
+                       for name in self.names):
+                    expression, user_dict = pushdown(expression, self.cols)
+                masks = _eval_iter(expression, user_dict=user_dict,
+                                   depth=depth, **kwargs)
+            elif rows is None:
+                masks = iter(())
+            else:
+                masks = ((None, rows[i:i+blen])
+                         for i in xrange(0, len(rows), blen))
+        elif hasattr(expression, "dtype") and expression.dtype.kind == 'b':
+            if len(expression) != self.len:
+                raise ValueError(
+                    "`expression` must be of the same length than ``self``")
+            masks = ((i, expression[i:i+blen])
+                     for i in xrange(0, self.len, blen))
+        else:
+            raise ValueError("only boolean expressions or arrays are supported")
+
+        def blocks():
+            nhits = 0
+            stop = None if limit is None else skip + limit
+            for start, mask in masks:
+                if start is None:
+                    rows = mask
+                elif mask.dtype.kind != 'b':
+                    raise ValueError("only boolean expressions are supported")
+                else:
+                    rows = np.flatnonzero(mask) + start
+                # Apply skip and limit
+                first = max(skip - nhits, 0)
+                last = len(rows) if stop is None else min(len(rows),
+                                                          stop - nhits)
+                nhits += len(rows)
+                rows = rows[first:last]
+                if len(rows) > 0:
+                    out = np.empty(len(rows), dtype=dtype)
+                    for name in outcols:
+                        if name == "nrow__":
+                            out[name] = rows
+                        else:
+                            out[name] = _gather(self.cols[name], rows)
+                    yield out
+                if stop is not None and nhits >= stop:
+                    break
+
+        return blocks()
 
     def __iter__(self):
         return self.iter(0, self.len, 1)
 
     def iter(self, start=0, stop=None, step=1, outcols=None,
-             limit=None, skip=0):
+             limit=None, skip=0, as_blocks=False):
         """
-        iter(start=0, stop=None, step=1, outcols=None, limit=None, skip=0)
+        iter(start=0, stop=None, step=1, outcols=None, limit=None, skip=0,
+             as_blocks=False)
 
         Iterator with `start`, `stop` and `step` bounds.
 
@@ -679,6 +801,9 @@ class btable(object):
             everything.
         skip : int
             An initial number of elements to skip.  The default is 0.
+        as_blocks : bool
+            If True, the iterator returns NumPy structured arrays holding
+            up to a chunk of rows each, instead of single rows.
 
         Returns
         -------
@@ -691,46 +816,47 @@ class btable(object):
         """
 
         # Check outcols
-        if outcols is None:
-            outcols = self.names
-        else:
-            if type(outcols) not in (list, tuple, str):
-                raise ValueError("only list/str is supported for outcols")
-            # Check name validity
-            nt = namedtuple('_nt', outcols, verbose=False)
-            outcols = list(nt._fields)
-            if set(outcols) - set(self.names+['nrow__']) != set():
-                raise ValueError("not all outcols are real column names")
+        outcols = self._outcols(outcols)
 
         # Check limits
         if step <= 0:
             raise NotImplementedError("step param can only be positive")
         start, stop, step = slice(start, stop, step).indices(self.len)
+        # Translate skip and limit into the bounds of the range
+        start = min(start + skip * step, stop)
+        if limit is not None:
+            stop = min(stop, start + limit * step)
 
-        # Get iterators for selected columns
-        icols, dtypes = [], []
-        for name in outcols:
-            if name == "nrow__":
-                istop = None
-                if limit is not None:
-                    istop = limit + skip
-                icols.append(islice(xrange(start, stop, step), skip, istop))
-                dtypes.append((name, np.int_))
-            else:
-                col = self.cols[name]
-                icols.append(
-                    col.iter(start, stop, step, limit=limit, skip=skip))
-                dtypes.append((name, col.dtype))
-        dtype = np.dtype(dtypes)
-        return self._iter(icols, dtype)
+        blocks = self._iter_blocks(start, stop, step, outcols)
+        if as_blocks:
+            return blocks
+        return self._rows(blocks, outcols)
 
-    def _iter(self, icols, dtype):
-        """Return a list of `icols` iterators with `dtype` names."""
+    def _iter_blocks(self, start, stop, step, outcols):
+        """Iterate over the `start:stop:step` rows in structured blocks.
 
-        icols = tuple(icols)
-        namedt = namedtuple('row', dtype.names)
-        iterable = imap(namedt, *icols)
-        return iterable
+        Blocks are read column by column, and every one spans (at most)
+        a chunk of the column with the smallest chunklen.
+        """
+
+        dtype = self._outdtype(outcols)
+        blen = min(self.cols[name].chunklen for name in self.names)
+        bstart = start
+        while bstart < stop:
+            if step == 1:
+                # Make the bounds of the blocks match the chunk boundaries
+                bstop = min((bstart // blen + 1) * blen, stop)
+            else:
+                bstop = min(bstart + blen * step, stop)
+            out = np.empty(len(xrange(bstart, bstop, step)), dtype=dtype)
+            for name in outcols:
+                if name == "nrow__":
+                    out[name] = np.arange(bstart, bstop, step)
+                else:
+                    self._getslice(name, bstart, bstop, step, out[name])
+            yield out
+            # The next row in the range
+            bstart += len(out) * step
 
     def _where(self, boolarr, colnames=None):
         """Return rows where `boolarr` is true as an structured array.
@@ -741,9 +867,13 @@ class btable(object):
 
         if colnames is None:
             colnames = self.names
-        cols = [self.cols[name][boolarr] for name in colnames]
-        dtype = np.dtype([(name, self.cols[name].dtype) for name in colnames])
-        result = np.rec.fromarrays(cols, dtype=dtype).view(np.ndarray)
+        if isinstance(boolarr, barray):
+            nrows = boolarr.count_nonzero()
+        else:
+            nrows = np.count_nonzero(boolarr)
+        result = np.empty(nrows, dtype=self._outdtype(colnames))
+        for name in colnames:
+            result[name] = self.cols[name][boolarr]
 
         return result
 
@@ -807,22 +937,28 @@ class btable(object):
             except:
                 raise IndexError(
                       "key cannot be converted to an array of indices")
-            return np.fromiter((self[i] for i in key),
-                               dtype=self.dtype, count=len(key))
+            return self[key]
         # A boolean array (case of fancy indexing)
         elif hasattr(key, "dtype"):
             if key.dtype.type == np.bool_:
                 return self._where(key)
             elif np.issubsctype(key, np.int_):
-                # An integer array
-                return np.array([self[i] for i in key], dtype=self.dtype)
+                # An integer array.  Gather it column by column.
+                ra = np.empty(len(key), dtype=self.dtype)
+                for name in self.names:
+                    ra[name] = self.cols[name][key]
+                return ra
             else:
                 raise IndexError(
                       "arrays used as indices must be integer (or boolean)")
         # Column name or expression
         elif type(key) in _strtypes:
             if key not in self.names:
-                # key is not a column name, try to evaluate
+                # key is not a column name, try with the indexes first
+                rows = index_rows(self, key)
+                if rows is not None:
+                    return self[rows]
+                # ...and then evaluate it
                 arr = self.eval(key, depth=4)
                 if arr.dtype.type != np.bool_:
                     raise IndexError(
@@ -841,12 +977,71 @@ class btable(object):
         # Build a numpy container
         n = utils.get_len_of_range(start, stop, step)
         ra = np.empty(shape=(n,), dtype=self.dtype)
-        # Fill it
+        # Fill it, decompressing every column straight into its field
         for name in self.names:
-            ra[name][:] = self.cols[name][start:stop:step]
+            self._getslice(name, start, stop, step, ra[name])
 
         return ra
 
+    def _getslice(self, name, start, stop, step, out):
+        """Fill `out` with the `start:stop:step` rows of column `name`."""
+
+        col = self.cols[name]
+        if type(col) is barray:
+            col._getslice(start, stop, step, out)
+        else:
+            out[:] = col[start:stop:step]
+
+    def todict(self, start=0, stop=None, step=1, outcols=None):
+        """
+        todict(start=0, stop=None, step=1, outcols=None)
+
+        Return the `start:stop:step` rows as a dictionary of NumPy arrays.
+
+        Every column is decompressed straight into its own (contiguous)
+        array, so this is cheaper than slicing into a structured array
+        when the values are going to be used column by column.
+
+        Parameters
+        ----------
+        start : int
+            The starting row.
+        stop : int
+            The row after which the selection stops.
+        step : int
+            The distance between selected rows.  Cannot be negative.
+        outcols : list of strings or string
+            The list of column names that you want to get back in results.
+            Alternatively, it can be specified as a string such as 'f0 f1' or
+            'f0, f1'.  If None, all the columns are returned.
+
+        Returns
+        -------
+        out : dict
+            A dictionary with the column names as keys and NumPy arrays as
+            values.
+
+        See Also
+        --------
+        iter
+
+        """
+
+        outcols = self._outcols(outcols)
+        if step <= 0:
+            raise NotImplementedError("step param can only be positive")
+        start, stop, step = slice(start, stop, step).indices(self.len)
+        n = utils.get_len_of_range(start, stop, step)
+        result = {}
+        for name in outcols:
+            if name == "nrow__":
+                result[name] = np.arange(start, stop, step)
+                continue
+            col = self.cols[name]
+            result[name] = np.empty((n,) + col.shape[1:], dtype=col.dtype)
+            self._getslice(name, start, stop, step, result[name])
+        return result
+
     def __setitem__(self, key, value):
         """
         x.__setitem__(key, value) <==> x[key] = value
@@ -876,22 +1071,65 @@ class btable(object):
             # Convert key into a boolean array
             #key = self.eval(key)
             # The method below is faster (specially for large btables)
-            rowval = 0
-            for nrow in self.where(key, outcols=["nrow__"]):
-                nrow = nrow[0]
-                if len(value) == 1:
-                    for name in self.names:
-                        self.cols[name][nrow] = value[name]
-                else:
-                    for name in self.names:
-                        self.cols[name][nrow] = value[name][rowval]
-                    rowval += 1
+            nrows = [block['nrow__'] for block in
+                     self._where_blocks(key, outcols=["nrow__"], depth=4)]
+            nrows = np.concatenate([np.empty(0, dtype=np.int_)] + nrows)
+            if len(value) > 1:
+                value = value[:len(nrows)]
+            oldvalues = self._old_index_values(nrows)
+            # Update every column in one go
+            for name in self.names:
+                self.cols[name][nrows] = value[name]
+            self._update_indexes(nrows, oldvalues)
             return
         # Then, modify the rows
+        rows = self._key_rows(key)
+        oldvalues = self._old_index_values(rows)
         for name in self.names:
             self.cols[name][key] = value[name]
+        self._update_indexes(rows, oldvalues)
         return
 
+    def _key_rows(self, key):
+        """Return the sorted rows selected by `key` (None if unknown)."""
+        if isinstance(key, _inttypes):
+            if key < 0:
+                key += self.len
+            return np.array([key], dtype=np.int64)
+        if isinstance(key, slice):
+            return np.arange(*key.indices(self.len), dtype=np.int64)
+        if isinstance(key, (list, np.ndarray)):
+            key = np.asarray(key)
+            if key.dtype.kind == 'b' and key.ndim == 1:
+                return np.flatnonzero(key).astype(np.int64)
+            if key.dtype.kind in 'iu' and key.ndim == 1:
+                key = key.astype(np.int64)
+                key[key < 0] += self.len
+                return np.unique(key)
+        return None
+
+    def _old_index_values(self, rows):
+        """Return the values at `rows` of the indexed columns.
+
+        The indexes are brought up to date first, so that only `rows`
+        are to be updated after the modification.
+        """
+        oldvalues = {}
+        for colname, index in self.indexes.items():
+            index.refresh()
+            if rows is not None:
+                oldvalues[colname] = self.cols[colname][rows]
+        return oldvalues
+
+    def _update_indexes(self, rows, oldvalues):
+        """Update the indexes after a modification of `rows`."""
+        for colname, index in self.indexes.items():
+            if rows is None:
+                index.build()
+            else:
+                index.update(np.asarray(rows, dtype=np.int64),
+                             oldvalues[colname])
+
     def eval(self, expression, **kwargs):
         """
         eval(expression, **kwargs)
@@ -923,8 +1161,140 @@ class btable(object):
 
         # Get the desired frame depth
         depth = kwargs.pop('depth', 3)
+        user_dict = self.cols
+        if any(type(self.cols[name]) is dictarray for name in self.names):
+            # Comparisons of dictionary-encoded columns work on codes
+            expression, user_dict = pushdown(expression, self.cols)
         # Call top-level eval with cols as user_dict
-        return blz_eval(expression, user_dict=self.cols, depth=depth, **kwargs)
+        return blz_eval(expression, user_dict=user_dict, depth=depth, **kwargs)
+
+    def groupby(self, keys, aggs=None, memlimit=None, **kwargs):
+        """
+        groupby(keys, aggs=None, memlimit=None, **kwargs)
+
+        Group rows by the values in `keys` columns and aggregate them.
+
+        Parameters
+        ----------
+        keys : string or list of strings
+            The name(s) of the column(s) whose values define the groups.
+        aggs : list of tuples
+            The aggregations to compute for every group, as (column, op)
+            or (column, op, name) tuples.  `op` can be 'count', 'sum',
+            'min', 'max' or 'mean', and `column` can be None for
+            'count'.  The output column is called `name`, or
+            'column_op' if not given.  The default is ``[(None,
+            'count')]``, i.e. the number of rows in each group.
+        memlimit : int
+            The budget (in bytes) for the table of groups.  When it is
+            exceeded, partial results are moved to temporary on-disk
+            partitions that are merged at the end.  The default is 256 MB.
+        kwargs : list of parameters or dictionary
+            Any parameter supported by the btable constructor.
+
+        Returns
+        -------
+        out : btable object
+            A table with the `keys` columns followed by the aggregations.
+            Groups are sorted by key (within every partition, if the
+            table of groups was spilled to disk).
+
+        """
+
+        names, blocks = groupby(self, keys, aggs, memlimit)
+        # There is always a first block, even for an empty table
+        result = btable(next(blocks), names, **kwargs)
+        for cols in blocks:
+            result.append(cols)
+        result.flush()
+        return result
+
+    def create_index(self, colname, kind='sorted'):
+        """
+        create_index(colname, kind='sorted')
+
+        Create an index for the `colname` column.
+
+        The index is kept up to date when rows are appended or modified,
+        and it is used automatically by `where()`, `whereblocks()` and
+        `__getitem__()` with string expressions made of comparisons of
+        indexed columns with literals (or membership tests like ``x in
+        (1, 2)``), possibly combined with ``&`` and ``|``.
+
+        Parameters
+        ----------
+        colname : string
+            The name of the column to index.
+        kind : string
+            The kind of index.  It can be:
+
+              * 'sorted' for keeping the values of the column in sorted
+                order, together with the rows where they are.  It is
+                the best for range queries.
+              * 'bitmap' for keeping a boolean barray per distinct value
+                of the column.  It is the best for equality,
+                inequality and membership queries on columns with few
+                (up to 1024) distinct values.
+
+            Indexes are stored compressed, under the rootdir of the
+            btable for persistent tables.
+
+        See Also
+        --------
+        drop_index
+
+        """
+
+        if colname not in self.names:
+            raise ValueError("column '%s' not found" % colname)
+        if colname in self.indexes:
+            raise ValueError("column '%s' is indexed already" % colname)
+        if self.mode == 'r':
+            raise IOError("cannot create an index in read-only mode")
+        if self.cols[colname].ndim > 1:
+            raise ValueError("only unidimensional columns can be indexed")
+        self.indexes[colname] = create_index(self, colname, kind)
+
+    def drop_index(self, colname):
+        """
+        drop_index(colname)
+
+        Remove the index of the `colname` column.
+
+        See Also
+        --------
+        create_index
+
+        """
+
+        if colname not in self.indexes:
+            raise ValueError("column '%s' is not indexed" % colname)
+        self.indexes.pop(colname).remove()
+
+    def recompress(self, bparams):
+        """
+        recompress(bparams)
+
+        Recompress all the columns in-place with new compression parameters.
+
+        Columns are recompressed one after the other, a chunk at a time,
+        so that memory consumption stays low even for large on-disk
+        tables.
+
+        Parameters
+        ----------
+        bparams : instance of the `bparams` class
+            The new parameters for the internal Blosc compressor.
+
+        See Also
+        --------
+        barray.recompress
+
+        """
+
+        for name in self.names:
+            self.cols[name].recompress(bparams)
+        self._bparams = bparams
 
     def flush(self):
         """Flush data in internal buffers to disk.
@@ -11,8 +11,10 @@ from __future__ import absolute_import
 # Functions for an execution engine for BLZ
 
 import sys, math
+import ast, numbers
+import collections
 import numpy as np
-from . import numexpr_here
+from . import numexpr_here, utils
 from .blz_ext import barray
 
 if sys.version_info >= (3, 0):
@@ -28,6 +30,9 @@ if numexpr_here:
     import numexpr
     from numexpr.expressions import functions as numexpr_functions
 
+# The number of blocks per thread evaluated ahead of the consumer
+EVAL_WINDOW = 2
+
 
 class Defaults(object):
     """Class to taylor the setters and getters of default values."""
@@ -60,6 +65,16 @@ class Defaults(object):
                    "(minimum required version is probably not installed)")
         self.__eval_vm = value
 
+    @property
+    def nthreads(self):
+        return self.__nthreads
+
+    @nthreads.setter
+    def nthreads(self, value):
+        if not isinstance(value, int) or value < 1:
+            raise ValueError("`nthreads` must be a positive integer")
+        self.__nthreads = value
+
     @property
     def eval_out_flavor(self):
         return self.__eval_out_flavor
@@ -93,12 +108,21 @@ not, then the default is 'python'.
 
 """
 
+defaults.nthreads = 1
+"""
+The number of threads used for compressing chunks concurrently when
+appending large arrays to barrays, and for evaluating blocks
+concurrently in `eval()`.  Default is 1 (no parallelism).
+
+"""
+
 # Assign function `eval` to a variable because we are overriding it
 _eval = eval
 
-def eval(expression, vm=None, out_flavor=None, user_dict={}, **kwargs):
+def eval(expression, vm=None, out_flavor=None, user_dict={}, nthreads=None,
+         **kwargs):
     """
-    eval(expression, vm=None, out_flavor=None, user_dict=None, **kwargs)
+    eval(expression, vm=None, out_flavor=None, user_dict=None, nthreads=None, **kwargs)
 
     Evaluate an `expression` and return the result.
 
@@ -116,6 +140,10 @@ def eval(expression, vm=None, out_flavor=None, user_dict={}, **kwargs):
     user_dict : dict
         An user-provided dictionary where the variables in expression
         can be found by name.
+    nthreads : int
+        The number of threads for evaluating blocks concurrently.  Each
+        thread decompresses and evaluates its own blocks, and results
+        are assembled in order.  The default is `defaults.nthreads`.
     kwargs : list of parameters or dictionary
         Any parameter supported by the barray constructor.
 
@@ -138,9 +166,33 @@ def eval(expression, vm=None, out_flavor=None, user_dict={}, **kwargs):
     if out_flavor not in ("barray", "numpy"):
         raiseValue, "`out_flavor` must be either 'barray' or 'numpy'"
 
+    if nthreads is None:
+        nthreads = defaults.nthreads
+    if not isinstance(nthreads, int) or nthreads < 1:
+        raise ValueError("`nthreads` must be a positive integer")
+
     # Get variables and column names participating in expression
     depth = kwargs.pop('depth', 2)
-    vars = _getvars(expression, user_dict, depth, vm=vm)
+    expression, vars, typesize, vlen = _prepare(
+        expression, user_dict, depth, vm)
+
+    if typesize == 0 or vlen == 0:
+        # All scalars or zero-length objects
+        if vm == "python":
+            return _eval(expression, vars)
+        else:
+            return numexpr.evaluate(expression, local_dict=vars)
+
+    return _eval_blocks(expression, vars, vlen, typesize, vm, out_flavor,
+                        nthreads, **kwargs)
+
+def _prepare(expression, user_dict, depth, vm):
+    """Get the variables in `expression`, and their typesize and length.
+
+    The `expression` is returned with membership tests expanded.
+    """
+    expression = _expand_membership(expression)
+    vars = _getvars(expression, user_dict, depth+1, vm=vm)
 
     # Gather info about sizes and lengths
     typesize, vlen = 0, 1
@@ -155,22 +207,153 @@ def eval(expression, vm=None, out_flavor=None, user_dict={}, **kwargs):
                 typesize += var.dtype.itemsize * np.prod(var.shape[1:])
             elif isinstance(var, barray):  # barray array
                 typesize += var.dtype.itemsize
+            elif hasattr(var, "__getitem__"):
+                # Other containers (e.g. dictarrays) are sliced per block
+                typesize += var.dtype.itemsize
             else:
                 raise ValueError("only numpy/barray objects supported")
         if hasattr(var, "__len__"):
             if vlen > 1 and vlen != len(var):
                 raise ValueError("arrays must have the same length")
             vlen = len(var)
+    return expression, vars, typesize, vlen
+
+def _eval_iter(expression, vm=None, user_dict={}, nthreads=None, **kwargs):
+    """Evaluate `expression` in blocks and yield (start, block) pairs.
 
+    The parameters are the same than in `eval()`.  Variables are looked
+    up right away, but blocks are only evaluated as they are requested.
+    """
+
+    if vm is None:
+        vm = defaults.eval_vm
+    if vm not in ("numexpr", "python"):
+        raise ValueError("`vm` must be either 'numexpr' or 'python'")
+    if nthreads is None:
+        nthreads = defaults.nthreads
+    if not isinstance(nthreads, int) or nthreads < 1:
+        raise ValueError("`nthreads` must be a positive integer")
+
+    depth = kwargs.pop('depth', 2)
+    expression, vars, typesize, vlen = _prepare(
+        expression, user_dict, depth, vm)
     if typesize == 0 or vlen == 0:
-        # All scalars or zero-length objects
-        if vm == "python":
-            return _eval(expression, vars)
+        raise ValueError("`expression` must involve some non-empty arrays")
+    return _iter_blocks(expression, vars, vlen, typesize, vm, nthreads)
+
+# Source for the operators in expressions
+_operators = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+    ast.FloorDiv: '//', ast.Mod: '%', ast.Pow: '**', ast.LShift: '<<',
+    ast.RShift: '>>', ast.BitOr: '|', ast.BitXor: '^', ast.BitAnd: '&',
+    ast.Invert: '~', ast.Not: 'not ', ast.UAdd: '+', ast.USub: '-',
+    ast.And: ' and ', ast.Or: ' or ', ast.Eq: '==', ast.NotEq: '!=',
+    ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.Is: 'is',
+    ast.IsNot: 'is not', ast.In: 'in', ast.NotIn: 'not in',
+    }
+
+def _unparse(node):
+    """Return the source of the expression in `node`.
+
+    Every compound expression is put between parentheses, so that the
+    precedence of the tree is kept.  ValueError is raised for nodes
+    that cannot appear in `eval()` expressions.
+    """
+    nodetype = type(node).__name__
+    if nodetype == 'Expression':
+        return _unparse(node.body)
+    elif nodetype == 'Name':
+        return node.id
+    elif nodetype in ('Num', 'Str', 'Bytes', 'NameConstant', 'Constant'):
+        value = ast.literal_eval(node)
+        if isinstance(value, numbers.Number) and value < 0:
+            return "(%r)" % (value,)
+        return repr(value)
+    elif nodetype == 'BinOp':
+        return "(%s %s %s)" % (_unparse(node.left),
+                               _operators[type(node.op)],
+                               _unparse(node.right))
+    elif nodetype == 'UnaryOp':
+        return "(%s%s)" % (_operators[type(node.op)], _unparse(node.operand))
+    elif nodetype == 'BoolOp':
+        return "(%s)" % _operators[type(node.op)].join(
+            [_unparse(value) for value in node.values])
+    elif nodetype == 'Compare':
+        parts = [_unparse(node.left)]
+        for op, right in zip(node.ops, node.comparators):
+            parts += [_operators[type(op)], _unparse(right)]
+        return "(%s)" % " ".join(parts)
+    elif nodetype == 'Call':
+        if getattr(node, 'starargs', None) or getattr(node, 'kwargs', None):
+            raise ValueError("unsupported call in expression")
+        args = [_unparse(arg) for arg in node.args]
+        args += ["%s=%s" % (kw.arg, _unparse(kw.value))
+                 for kw in node.keywords]
+        return "%s(%s)" % (_unparse(node.func), ", ".join(args))
+    elif nodetype == 'Attribute':
+        return "%s.%s" % (_unparse(node.value), node.attr)
+    elif nodetype == 'Subscript':
+        return "%s[%s]" % (_unparse(node.value), _unparse(node.slice))
+    elif nodetype == 'Index':
+        return _unparse(node.value)
+    elif nodetype == 'Slice':
+        return ":".join(["" if part is None else _unparse(part)
+                         for part in (node.lower, node.upper, node.step)])
+    elif nodetype == 'Tuple':
+        return "(%s)" % "".join([_unparse(elt) + ", " for elt in node.elts])
+    elif nodetype == 'List':
+        return "[%s]" % ", ".join([_unparse(elt) for elt in node.elts])
+    raise ValueError("unsupported node in expression: %s" % nodetype)
+
+class _MembershipExpander(ast.NodeTransformer):
+    """Expand membership tests with literal tuples or lists of values."""
+
+    expanded = False
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if (len(node.ops) != 1 or
+            not isinstance(node.ops[0], (ast.In, ast.NotIn))):
+            return node
+        values = node.comparators[0]
+        try:
+            literal = ast.literal_eval(values)
+        except ValueError:
+            return node
+        if type(literal) not in (tuple, list) or len(literal) == 0:
+            return node
+        if isinstance(node.ops[0], ast.NotIn):
+            op, join = ast.NotEq, ast.BitAnd
         else:
-            return numexpr.evaluate(expression, local_dict=vars)
-
-    return _eval_blocks(expression, vars, vlen, typesize, vm, out_flavor,
-                        **kwargs)
+            op, join = ast.Eq, ast.BitOr
+        tests = [ast.Compare(left=node.left, ops=[op()], comparators=[value])
+                 for value in values.elts]
+        expanded = tests[0]
+        for test in tests[1:]:
+            expanded = ast.BinOp(left=expanded, op=join(), right=test)
+        self.expanded = True
+        return expanded
+
+def _expand_membership(expression):
+    """Expand the membership tests in `expression` into comparisons.
+
+    Neither numexpr nor NumPy support membership tests, so ``x in (1,
+    2)`` is turned into ``((x == 1) | (x == 2))`` and ``x not in (1,
+    2)`` into ``((x != 1) & (x != 2))``.  The left operand can be any
+    expression.
+    """
+    if " in" not in expression:
+        return expression
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+        expander = _MembershipExpander()
+        tree = expander.visit(tree)
+        if not expander.expanded:
+            return expression
+        return _unparse(tree)
+    except (SyntaxError, ValueError, KeyError):
+        # Let the evaluator report the problem
+        return expression
 
 def _getvars(expression, user_dict, depth, vm):
     """Get the variables in `expression`.
@@ -225,9 +408,199 @@ def _getvars(expression, user_dict, depth, vm):
             reqvars[var] = val
     return reqvars
 
-def _eval_blocks(expression, vars, vlen, typesize, vm, out_flavor,
-                 **kwargs):
-    """Perform the evaluation in blocks."""
+# Tri-state logic for zone map predicates (None means undecided)
+def _and3(a, b):
+    if a is False or b is False:
+        return False
+    if a is True and b is True:
+        return True
+    return None
+
+def _or3(a, b):
+    if a is True or b is True:
+        return True
+    if a is False and b is False:
+        return False
+    return None
+
+def _not3(a):
+    if a is None:
+        return None
+    return not a
+
+# The operator to use when the operands of a comparison are swapped
+_swapped_ops = {ast.Lt: ast.Gt, ast.LtE: ast.GtE,
+                ast.Gt: ast.Lt, ast.GtE: ast.LtE,
+                ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+
+def _constant(node):
+    """Return the value of a numeric constant `node` (or None)."""
+    if (isinstance(node, ast.UnaryOp) and
+        isinstance(node.op, (ast.USub, ast.UAdd))):
+        value = _constant(node.operand)
+        if value is not None and isinstance(node.op, ast.USub):
+            value = -value
+        return value
+    nodetype = type(node).__name__
+    if nodetype == 'Num':
+        value = node.n
+    elif nodetype in ('Constant', 'NameConstant'):
+        value = node.value
+    elif nodetype == 'Name' and node.id in ('True', 'False'):
+        value = (node.id == 'True')
+    else:
+        return None
+    if not isinstance(value, numbers.Real):
+        return None
+    return value
+
+def _compare_zonemap(op, zmap, value):
+    """Decide `x op value` for every x described by the `zmap` zone map."""
+    vmin, vmax, nnans = zmap
+    if vmin is None:
+        # Only NaNs here, which compare as unequal to everything
+        return op is ast.NotEq
+    nonans = (nnans == 0)
+    if op is ast.Lt:
+        if vmin >= value:
+            return False
+        if vmax < value and nonans:
+            return True
+    elif op is ast.LtE:
+        if vmin > value:
+            return False
+        if vmax <= value and nonans:
+            return True
+    elif op is ast.Gt:
+        if vmax <= value:
+            return False
+        if vmin > value and nonans:
+            return True
+    elif op is ast.GtE:
+        if vmax < value:
+            return False
+        if vmin >= value and nonans:
+            return True
+    elif op is ast.Eq:
+        if value < vmin or value > vmax:
+            return False
+        if vmin == vmax == value and nonans:
+            return True
+    elif op is ast.NotEq:
+        if value < vmin or value > vmax:
+            return True
+        if vmin == vmax == value and nonans:
+            return False
+    return None
+
+def _compare_column(op, zmap, dtype, value):
+    """Decide `x op value` for a column of `dtype` out of its `zmap`.
+
+    NumPy and numexpr may round `value` to the column type first (e.g.
+    to float32), so the outcome is only given when it does not depend
+    on that rounding.
+    """
+    outcome = _compare_zonemap(op, zmap, value)
+    if outcome is not None and dtype.kind == 'f':
+        with np.errstate(over='ignore'):
+            rounded = dtype.type(value)
+        if rounded != value and _compare_zonemap(
+            op, zmap, float(rounded)) != outcome:
+            return None
+    return outcome
+
+def _eval_zonemap(node, zmaps, dtypes):
+    """Evaluate the predicate in `node` for a block, out of its `zmaps`."""
+    if isinstance(node, ast.Compare):
+        outcome = True
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            op = type(op)
+            lvalue, rvalue = _constant(left), _constant(right)
+            pair = None
+            if (op in _swapped_ops and isinstance(left, ast.Name) and
+                rvalue is not None and zmaps.get(left.id) is not None):
+                pair = _compare_column(op, zmaps[left.id], dtypes[left.id],
+                                       rvalue)
+            elif (op in _swapped_ops and isinstance(right, ast.Name) and
+                  lvalue is not None and zmaps.get(right.id) is not None):
+                pair = _compare_column(_swapped_ops[op], zmaps[right.id],
+                                       dtypes[right.id], lvalue)
+            outcome = _and3(outcome, pair)
+            left = right
+        return outcome
+    elif isinstance(node, ast.BoolOp):
+        combine = _and3 if isinstance(node.op, ast.And) else _or3
+        outcome = _eval_zonemap(node.values[0], zmaps, dtypes)
+        for value in node.values[1:]:
+            outcome = combine(outcome, _eval_zonemap(value, zmaps, dtypes))
+        return outcome
+    elif isinstance(node, ast.BinOp):
+        combine = _and3 if isinstance(node.op, ast.BitAnd) else _or3
+        return combine(_eval_zonemap(node.left, zmaps, dtypes),
+                       _eval_zonemap(node.right, zmaps, dtypes))
+    elif isinstance(node, ast.UnaryOp):
+        return _not3(_eval_zonemap(node.operand, zmaps, dtypes))
+    elif isinstance(node, ast.Name):
+        # A boolean operand
+        zmap = zmaps.get(node.id)
+        if zmap is None or zmap[0] is None:
+            return None
+        if not zmap[1]:
+            return False
+        if zmap[0]:
+            return True
+    return None
+
+def _is_predicate(node, vars):
+    """Check whether `node` always evaluates to a boolean."""
+    if isinstance(node, ast.Compare):
+        return True
+    elif isinstance(node, ast.BoolOp):
+        return all(_is_predicate(value, vars) for value in node.values)
+    elif isinstance(node, ast.BinOp):
+        return (isinstance(node.op, (ast.BitAnd, ast.BitOr)) and
+                _is_predicate(node.left, vars) and
+                _is_predicate(node.right, vars))
+    elif isinstance(node, ast.UnaryOp):
+        return (isinstance(node.op, (ast.Not, ast.Invert)) and
+                _is_predicate(node.operand, vars))
+    elif isinstance(node, ast.Name):
+        var = vars.get(node.id)
+        return hasattr(var, "dtype") and var.dtype.type == np.bool_
+    return False
+
+def _zonemap_pruner(expression, vars):
+    """Get a function that decides `expression` in blocks via zone maps.
+
+    The returned function takes a (start, stop) range of rows and returns
+    True if the expression is true for all the rows in the range, False
+    if it is false for all of them, or None when this cannot be decided
+    out of the zone maps of the barray operands.  If `expression` is not a
+    boolean predicate, None is returned instead of a function.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+    if not _is_predicate(tree, vars):
+        return None
+    names = [name for name in dict_viewkeys(vars)
+             if hasattr(vars[name], "_getstats")]
+    if len(names) == 0:
+        return None
+    dtypes = dict((name, vars[name].dtype) for name in names)
+
+    def prune(start, stop):
+        zmaps = {}
+        for name in names:
+            zmaps[name] = vars[name]._getstats(start, stop)
+        return _eval_zonemap(tree, zmaps, dtypes)
+
+    return prune
+
+def _iter_blocks(expression, vars, vlen, typesize, vm, nthreads):
+    """Perform the evaluation in blocks and yield (start, block) pairs."""
 
     # Compute the optimal block size (in elements)
     # The next is based on experiments with bench/ctable-query.py
@@ -262,30 +635,83 @@ def _eval_blocks(expression, vars, vlen, typesize, vm, out_flavor,
             if len(var) > bsize and hasattr(var, "_getrange"):
                 vars_[name] = np.empty(bsize, dtype=var.dtype)
 
-    for i in xrange(0, vlen, bsize):
+    # Chunks whose outcome is decided by the zone maps are not decompressed
+    prune = None
+    if maxndims == 1:
+        prune = _zonemap_pruner(expression, vars)
+
+    # With several threads, blocks are evaluated concurrently
+    parallel = nthreads > 1 and vlen > bsize
+
+    def eval_block(i):
+        """Evaluate `expression` for the block starting at row `i`."""
+        if prune is not None:
+            outcome = prune(i, i+bsize)
+            if outcome is not None:
+                res_block = np.empty(min(bsize, vlen - i), dtype=np.bool_)
+                res_block[:] = outcome
+                return res_block
+
+        if parallel:
+            # Every block needs temporaries of its own
+            bufs = dict((name, np.empty_like(vars_[name]))
+                        for name in dict_viewkeys(vars_))
+        else:
+            bufs = vars_
         # Get buffers for vars
         for name in dict_viewkeys(vars):
             var = vars[name]
             if hasattr(var, "__len__") and len(var) > bsize:
                 if hasattr(var, "_getrange"):
                     if i+bsize < vlen:
-                        var._getrange(i, bsize, vars_[name])
+                        var._getrange(i, bsize, bufs[name])
                     else:
-                        vars_[name] = var[i:]
+                        bufs[name] = var[i:]
                 else:
-                    vars_[name] = var[i:i+bsize]
+                    bufs[name] = var[i:i+bsize]
             else:
                 if hasattr(var, "__getitem__"):
-                    vars_[name] = var[:]
+                    bufs[name] = var[:]
                 else:
-                    vars_[name] = var
+                    bufs[name] = var
 
         # Perform the evaluation for this block
         if vm == "python":
-            res_block = _eval(expression, vars_)
+            return _eval(expression, bufs)
         else:
-            res_block = numexpr.evaluate(expression, local_dict=vars_)
+            return numexpr.evaluate(expression, local_dict=bufs)
+
+    starts = xrange(0, vlen, bsize)
+    if not parallel:
+        for i in starts:
+            yield i, eval_block(i)
+        return
+    # Only a few blocks are in flight, so that results do not pile up
+    # in memory, and in a pool of their own, so that the consumer can
+    # compress them meanwhile
+    pool = utils.thread_pool(nthreads, 'eval')
+    pending = collections.deque()
+    for i in starts:
+        pending.append((i, pool.apply_async(eval_block, (i,))))
+        if len(pending) >= EVAL_WINDOW * nthreads:
+            i, res_block = pending.popleft()
+            yield i, res_block.get()
+    while pending:
+        i, res_block = pending.popleft()
+        yield i, res_block.get()
+
+def _eval_blocks(expression, vars, vlen, typesize, vm, out_flavor, nthreads,
+                 **kwargs):
+    """Perform the evaluation in blocks."""
+
+    maxndims = 0
+    for name in dict_viewkeys(vars):
+        var = vars[name]
+        if hasattr(var, "__len__"):
+            maxndims = max(maxndims, len(var.shape) + len(var.dtype.shape))
 
+    blocks = _iter_blocks(expression, vars, vlen, typesize, vm, nthreads)
+    for i, res_block in blocks:
         if i == 0:
             # Detection of reduction operations
             scalar = False
@@ -306,14 +732,14 @@ def _eval_blocks(expression, vars, vlen, typesize, vm, out_flavor,
                 out_shape = list(res_block.shape)
                 out_shape[0] = vlen
                 result = np.empty(out_shape, dtype=res_block.dtype)
-                result[:bsize] = res_block
+                result[:len(res_block)] = res_block
         else:
             if scalar or dim_reduction:
                 result += res_block
             elif out_flavor == "barray":
                 result.append(res_block)
             else:
-                result[i:i+bsize] = res_block
+                result[i:i+len(res_block)] = res_block
 
     if isinstance(result, barray):
         result.flush()
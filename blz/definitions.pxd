@@ -28,6 +28,7 @@ cdef extern from "string.h":
   char *strdup(char *s)
   void *memcpy(void *dest, void *src, size_t n)
   void *memset(void *s, int c, size_t n)
+  int memcmp(void *s1, void *s2, size_t n)
 
 cdef extern from "time.h":
   ctypedef int time_t
@@ -89,6 +90,7 @@ cdef extern from "PythonHelper.h":
 
   # Functions for buffers
   object PyBuffer_FromMemory(void *ptr, Py_ssize_t size)
+  object PyBuffer_FromObject(object base, Py_ssize_t offset, Py_ssize_t size)
 
   ctypedef unsigned int Py_uintptr_t
 
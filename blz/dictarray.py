@@ -0,0 +1,550 @@
+########################################################################
+#
+#       License: BSD
+#       Created: October 17, 2026
+#       Author:  Francesc Alted - francesc@continuum.io
+#
+########################################################################
+
+from __future__ import absolute_import
+
+# Dictionary-encoded containers for strings
+
+import os, os.path
+import ast
+import json
+import shutil
+import numpy as np
+
+from .blz_ext import barray
+from .chunked_eval import _MembershipExpander, _operators, _unparse
+from .py2help import _strtypes, imap, xrange
+from . import utils, arrayprint
+
+# The file marking the rootdir of a dictarray
+DICTARRAY_META = '__dictarray__'
+
+# The dtype of the codes
+CODES_DTYPE = np.dtype(np.int32)
+
+# Ordering comparisons are pushed down as a disjunction of equalities
+# on the codes when they match (or miss) at most this many values
+MAXEXPAND = 32
+
+
+class dictarray(object):
+    """
+    dictarray(array=None, dtype=None, rootdir=None, mode='a', **kwargs)
+
+    A dictionary-encoded, compressed and enlargeable container for strings.
+
+    Every distinct string is stored only once in a dictionary, and the
+    container itself keeps the (integer) codes of the strings in a
+    barray.  Codes compress much better than fixed-width strings, and
+    comparisons with literals in `btable.eval()` and friends are done
+    on the codes.  Values are decoded transparently when read.
+
+    Parameters
+    ----------
+    array : a NumPy-like object of strings
+        This is taken as the input to create the dictarray.  It can be
+        any Python object that can be converted into a NumPy array of
+        strings (including barray and dictarray objects).
+    dtype : NumPy dtype
+        Force this `dtype` (which must be 'S' or 'U') for the values.
+    rootdir : str, optional
+        The directory where all the data and metadata will be stored.
+        If specified, then the dictarray object will be disk-based and
+        persistent.
+    mode : str, optional
+        The mode that a *persistent* dictarray should be created/opened.
+        The values can be 'r', 'w' or 'a', as for barray objects.
+    kwargs : list of parameters or dictionary
+        Any parameter supported by the barray constructor (`bparams`,
+        `expectedlen`, `chunklen`...), which is used for the codes.
+
+    """
+
+    # Properties
+    # ``````````
+
+    @property
+    def bparams(self):
+        "The compression parameters for this object."
+        return self.codes.bparams
+
+    @property
+    def cbytes(self):
+        "The compressed size of this object (in bytes)."
+        return self.codes.cbytes + self._dict.cbytes
+
+    @property
+    def chunklen(self):
+        "The chunklen of this object (in rows)."
+        return self.codes.chunklen
+
+    @property
+    def dtype(self):
+        "The dtype of the values of this object."
+        return self._dict.dtype
+
+    @property
+    def len(self):
+        "The length of this object."
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        "The original (uncompressed) size of this object (in bytes)."
+        return self.len * self.dtype.itemsize
+
+    @property
+    def ndim(self):
+        "The number of dimensions of this object."
+        return 1
+
+    @property
+    def shape(self):
+        "The shape of this object."
+        return (self.len,)
+
+    @property
+    def size(self):
+        "The size of this object."
+        return self.len
+
+    @property
+    def values(self):
+        "The distinct values of this object, in the order of their codes."
+        return self._values
+
+
+    def __init__(self, array=None, dtype=None, rootdir=None, mode='a',
+                 **kwargs):
+        self.rootdir = rootdir
+        "The directory where this object is saved."
+        self.mode = mode
+        "The mode in which the object is created/opened."
+        if array is not None:
+            self._create(array, dtype, **kwargs)
+        else:
+            self._open()
+
+    def _subdir(self, name):
+        if self.rootdir is None:
+            return None
+        return os.path.join(self.rootdir, name)
+
+    def _create(self, array, dtype, **kwargs):
+        """Create a dictarray anew out of `array`."""
+        if not isinstance(array, (barray, dictarray)):
+            array = np.asarray(array, dtype=dtype)
+        if dtype is None:
+            dtype = array.dtype
+        dtype = np.dtype(dtype)
+        if dtype.kind not in ('S', 'U'):
+            raise TypeError("only string dtypes can be dictionary-encoded")
+        if array.ndim != 1:
+            raise ValueError("only unidimensional arrays are supported")
+
+        if self.rootdir:
+            if os.path.exists(self.rootdir):
+                if self.mode != "w":
+                    raise IOError(
+                        "specified rootdir path '%s' already exists "
+                        "and creation mode is '%s'" % (self.rootdir, self.mode))
+                shutil.rmtree(self.rootdir)
+            os.mkdir(self.rootdir)
+            with open(os.path.join(self.rootdir, DICTARRAY_META),
+                      'wb') as metafile:
+                metafile.write(json.dumps({'dtype': dtype.str}).encode('ascii'))
+                metafile.write(b"\n")
+
+        kwargs.setdefault('expectedlen', len(array))
+        kwargs.pop('dflt', None)
+        self.codes = barray(np.empty(0, dtype=CODES_DTYPE),
+                            rootdir=self._subdir('codes'), **kwargs)
+        "The barray with the codes of the values."
+        self._dict = barray(np.empty(0, dtype=dtype),
+                            bparams=self.codes.bparams,
+                            rootdir=self._subdir('dict'))
+        self._values = np.empty(0, dtype=dtype)
+        self._ids = {}
+        self.append(array)
+        self.flush()
+
+    def _open(self):
+        """Open an existing dictarray on-disk."""
+        if self.rootdir is None:
+            raise ValueError(
+                "you need to pass either an `array` or a `rootdir` param")
+        if not os.path.exists(os.path.join(self.rootdir, DICTARRAY_META)):
+            raise IOError("'%s' is not a dictarray" % self.rootdir)
+        self.codes = barray(rootdir=self._subdir('codes'), mode=self.mode)
+        self._dict = barray(rootdir=self._subdir('dict'), mode=self.mode)
+        self._values = self._dict[:]
+        self._ids = dict((value, code) for code, value
+                         in enumerate(self._values.tolist()))
+
+    def _lookup(self, value):
+        """Return the code of the `value` string (-1 if not present)."""
+        kind = self.dtype.kind
+        if kind == 'S' and not isinstance(value, bytes):
+            try:
+                value = value.encode('ascii')
+            except (AttributeError, UnicodeError):
+                return -1
+        elif kind == 'U' and isinstance(value, bytes):
+            value = value.decode('ascii')
+        return self._ids.get(value, -1)
+
+    def encode(self, array):
+        """
+        encode(array)
+
+        Return the codes for the strings in `array`.
+
+        New strings are added to the dictionary.
+
+        Parameters
+        ----------
+        array : a NumPy-like object of strings (or a scalar string)
+            The values to encode.
+
+        Returns
+        -------
+        out : NumPy array (or scalar)
+            The codes of the values.
+
+        """
+
+        array = np.asarray(array, dtype=self.dtype)
+        uniq, inv = np.unique(array, return_inverse=True)
+        nvalues = len(self._ids)
+        ucodes = np.fromiter((self._ids.setdefault(value, len(self._ids))
+                              for value in uniq.tolist()),
+                             dtype=CODES_DTYPE, count=len(uniq))
+        if len(self._ids) > nvalues:
+            new = uniq[ucodes >= nvalues]
+            if self.mode == 'r':
+                raise IOError("cannot add new values in read-only mode")
+            self._dict.append(new)
+            self._dict.flush()
+            self._values = np.concatenate((self._values, new))
+        codes = ucodes[inv]
+        if array.ndim == 0:
+            return codes[0]
+        return codes.reshape(array.shape)
+
+    def decode(self, codes):
+        """
+        decode(codes)
+
+        Return the strings for the `codes`.
+
+        Parameters
+        ----------
+        codes : NumPy array (or scalar) of integers
+            The codes to decode.
+
+        Returns
+        -------
+        out : NumPy array (or scalar)
+            The values for the codes.
+
+        """
+
+        return self._values[codes]
+
+    def append(self, array):
+        """
+        append(array)
+
+        Append a numpy `array` of strings to this instance.
+
+        Parameters
+        ----------
+        array : NumPy-like object
+            The array of strings to be appended.  Must be compatible with
+            shape and type of the dictarray.
+
+        """
+
+        if isinstance(array, (barray, dictarray)):
+            # Encode by blocks in order to save memory
+            for i in xrange(0, len(array), array.chunklen):
+                self.codes.append(self.encode(array[i:i+array.chunklen]))
+            return
+        codes = self.encode(array)
+        self.codes.append(np.atleast_1d(codes))
+
+    def trim(self, nitems):
+        """
+        trim(nitems)
+
+        Remove the trailing `nitems` from this instance.
+
+        Parameters
+        ----------
+        nitems : int
+            The number of trailing items to be trimmed.
+
+        """
+
+        self.codes.trim(nitems)
+
+    def resize(self, nitems):
+        """
+        resize(nitems)
+
+        Resize the instance to have `nitems`.
+
+        Parameters
+        ----------
+        nitems : int
+            The final length of the object.  If `nitems` is larger than
+            the actual length, new items will be empty strings.
+
+        """
+
+        if nitems > self.len:
+            code = self.encode(np.zeros((), dtype=self.dtype))
+            filler = np.ndarray(nitems-self.len, dtype=CODES_DTYPE,
+                                buffer=np.array(code, dtype=CODES_DTYPE),
+                                strides=(0,))
+            self.codes.append(filler)
+            self.codes.flush()
+        else:
+            self.codes.resize(nitems)
+
+    def copy(self, **kwargs):
+        """
+        copy(**kwargs)
+
+        Return a copy of this object.
+
+        Parameters
+        ----------
+        kwargs : list of parameters or dictionary
+            Any parameter supported by the dictarray constructor.
+
+        Returns
+        -------
+        out : dictarray object
+            The copy of this object.
+
+        """
+
+        kwargs.setdefault('bparams', self.bparams)
+        return dictarray(self, dtype=self.dtype, **kwargs)
+
+    def recompress(self, bparams):
+        """
+        recompress(bparams)
+
+        Recompress this object in-place with new compression parameters.
+
+        Parameters
+        ----------
+        bparams : instance of the `bparams` class
+            The new parameters for the internal Blosc compressor.
+
+        See Also
+        --------
+        barray.recompress
+
+        """
+
+        self.codes.recompress(bparams)
+        self._dict.recompress(bparams)
+
+    def flush(self):
+        """Flush data in internal buffers to disk."""
+        self.codes.flush()
+        self._dict.flush()
+
+    def free_cachemem(self):
+        """Get rid of internal caches to free memory."""
+        self.codes.free_cachemem()
+        self._dict.free_cachemem()
+
+    def __len__(self):
+        return self.len
+
+    def __sizeof__(self):
+        return self.cbytes
+
+    def __getitem__(self, key):
+        """
+        x.__getitem__(key) <==> x[key]
+
+        Returns values based on `key`.  All the functionality of
+        ``barray.__getitem__()`` is supported, and the values are
+        decoded.
+        """
+        return self.decode(self.codes[key])
+
+    def __setitem__(self, key, value):
+        """
+        x.__setitem__(key, value) <==> x[key] = value
+
+        Sets values based on `key`.  All the functionality of
+        ``barray.__setitem__()`` is supported.
+        """
+        self.codes[key] = self.encode(value)
+
+    def __iter__(self):
+        return self.iter()
+
+    def iter(self, start=0, stop=None, step=1, limit=None, skip=0):
+        """
+        iter(start=0, stop=None, step=1, limit=None, skip=0)
+
+        Iterator with `start`, `stop` and `step` bounds.  See
+        `barray.iter()` for details.
+        """
+        values = self._values.tolist()
+        return imap(values.__getitem__,
+                    self.codes.iter(start, stop, step, limit, skip))
+
+    def where(self, boolarr, limit=None, skip=0):
+        """
+        where(boolarr, limit=None, skip=0)
+
+        Iterator that returns values of this object where `boolarr` is
+        true.  See `barray.where()` for details.
+        """
+        values = self._values.tolist()
+        return imap(values.__getitem__,
+                    self.codes.where(boolarr, limit, skip))
+
+    def __str__(self):
+        return arrayprint.array2string(self)
+
+    def __repr__(self):
+        snbytes = utils.human_readable_size(self.nbytes)
+        scbytes = utils.human_readable_size(self.cbytes)
+        cratio = self.nbytes / float(self.cbytes)
+        header = "dictarray(%s, %s)\n" % (self.shape, self.dtype)
+        header += "  nbytes: %s; cbytes: %s; ratio: %.2f\n" % (
+            snbytes, scbytes, cratio)
+        header += "  nvalues: %d\n" % len(self._values)
+        header += "  bparams := %r\n" % self.bparams
+        if self.rootdir:
+            header += "  rootdir := '%s'\n" % self.rootdir
+        return header + str(self)
+
+
+# The machinery for pushing comparisons down onto the codes follows
+
+_swapped = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}
+
+def _compare(values, op, literal):
+    """Return the boolean mask of `values` fulfilling `values op literal`."""
+    if op == '==':
+        return values == literal
+    elif op == '!=':
+        return values != literal
+    elif op == '<':
+        return values < literal
+    elif op == '<=':
+        return values <= literal
+    elif op == '>':
+        return values > literal
+    return values >= literal
+
+def _codes_expr(name, darr, op, literal):
+    """Return an expression on the codes of `darr` for `name op literal`.
+
+    None is returned if the comparison cannot be pushed down.
+    """
+    if op in ('==', '!='):
+        return "(%s %s %d)" % (name, op, darr._lookup(literal))
+    kind = darr.dtype.kind
+    if kind == 'S' and not isinstance(literal, bytes):
+        literal = literal.encode('ascii')
+    elif kind == 'U' and isinstance(literal, bytes):
+        literal = literal.decode('ascii')
+    mask = _compare(darr.values, op, literal)
+    hits, misses = np.flatnonzero(mask), np.flatnonzero(~mask)
+    if len(hits) == 0:
+        return "(%s < 0)" % name
+    elif len(misses) == 0:
+        return "(%s >= 0)" % name
+    elif len(hits) <= MAXEXPAND:
+        return "(%s)" % " | ".join(["(%s == %d)" % (name, code)
+                                    for code in hits])
+    elif len(misses) <= MAXEXPAND:
+        return "(%s)" % " & ".join(["(%s != %d)" % (name, code)
+                                    for code in misses])
+    return None
+
+class _CodesPushdown(ast.NodeTransformer):
+    """Turn comparisons of dictarrays with string literals into ones on
+    their codes."""
+
+    def __init__(self, darrs):
+        self.darrs = darrs
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) != 1:
+            return node
+        op = _operators[type(node.ops[0])]
+        left, right = node.left, node.comparators[0]
+        if op not in _swapped:
+            return node
+        if isinstance(left, ast.Name) and left.id in self.darrs:
+            name, literal = left.id, right
+        elif isinstance(right, ast.Name) and right.id in self.darrs:
+            name, literal, op = right.id, left, _swapped[op]
+        else:
+            return node
+        try:
+            literal = ast.literal_eval(literal)
+        except ValueError:
+            return node
+        if not isinstance(literal, _strtypes + (bytes,)):
+            return node
+        newexpr = _codes_expr("%s__codes" % name, self.darrs[name], op,
+                              literal)
+        if newexpr is None:
+            return node
+        return ast.parse(newexpr, mode='eval').body
+
+def pushdown(expression, cols):
+    """Rewrite `expression` so as to compare codes of dictarrays in `cols`.
+
+    Returns the new expression and a dictionary with the variables for
+    it.  The comparisons of dictarray columns with string literals are
+    done on the codes (named `name__codes`), and the rest of the uses of
+    dictarray columns get the dictarray itself, which the evaluator
+    decodes a block at a time.
+    """
+    user_dict = dict((name, cols[name]) for name in cols.names)
+    darrs = dict((name, cols[name]) for name in cols.names
+                 if isinstance(cols[name], dictarray))
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+        tree = _MembershipExpander().visit(tree)
+        tree = _CodesPushdown(darrs).visit(tree)
+        expression = _unparse(tree)
+    except (SyntaxError, ValueError, KeyError):
+        # Let the evaluator report the problem
+        return expression, user_dict
+    names = set(node.id for node in ast.walk(tree)
+                if isinstance(node, ast.Name))
+    for name, darr in darrs.items():
+        if "%s__codes" % name in names:
+            user_dict["%s__codes" % name] = darr.codes
+        if name not in names:
+            del user_dict[name]
+    return expression, user_dict
+
+
+## Local Variables:
+## mode: python
+## py-indent-offset: 4
+## tab-width: 4
+## fill-column: 78
+## End:
@@ -0,0 +1,307 @@
+########################################################################
+#
+#       License: BSD
+#       Created: October 17, 2026
+#       Author:  Francesc Alted - francesc@continuum.io
+#
+########################################################################
+
+from __future__ import absolute_import
+
+# Functions for grouping and aggregating the rows of btables
+
+import os, os.path
+import shutil
+import tempfile
+import numpy as np
+
+from .blz_ext import barray
+from .py2help import _strtypes, xrange
+
+# The aggregations supported by `btable.groupby()`
+AGGREGATIONS = ('count', 'sum', 'min', 'max', 'mean')
+
+# The default budget (in bytes) for the table of groups in memory
+MEMLIMIT = 256 * 2**20
+
+# The number of on-disk partitions used when the table of groups spills
+NPARTITIONS = 16
+
+# Approximate overhead of every group in the dictionary of keys
+_KEY_OVERHEAD = 100
+
+# The ufuncs that reduce each kind of state (both for rows and for
+# partial states coming from spilled partitions)
+_ufuncs = {'count': np.add, 'sum': np.add,
+           'min': np.minimum, 'max': np.maximum}
+
+
+class _state(object):
+    """A partial aggregation kept for every group."""
+
+    def __init__(self, kind, colname, dtype):
+        self.kind = kind
+        self.colname = colname
+        self.dtype = dtype
+        self.ufunc = _ufuncs[kind]
+
+
+class _grouptable(object):
+    """Hash table with the groups seen so far and their partial states."""
+
+    def __init__(self, keydtype, states):
+        self.keydtype = keydtype
+        self.states = states
+        self.ids = {}
+        self.keys = np.empty(16, dtype=keydtype)
+        self.arrays = [np.empty(16, dtype=s.dtype) for s in states]
+        rowsize = keydtype.itemsize + sum(s.dtype.itemsize for s in states)
+        self.rowsize = rowsize + _KEY_OVERHEAD
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return len(self.ids) * self.rowsize
+
+    def _grow(self, ngroups):
+        """Make room for `ngroups` groups in the arrays of states."""
+        size = len(self.keys)
+        if ngroups <= size:
+            return
+        while size < ngroups:
+            size *= 2
+        self.keys = np.resize(self.keys, size)
+        self.arrays = [np.resize(arr, size) for arr in self.arrays]
+
+    def update(self, keys, values):
+        """Fold a block of `keys` and its `values` (one per state) in.
+
+        A value of None for a 'count' state means counting the rows.
+        """
+        uniq, inv = np.unique(keys, return_inverse=True)
+        # Rows of every distinct key are made contiguous for reduceat
+        order = np.argsort(inv, kind='mergesort')
+        counts = np.bincount(inv)
+        starts = np.zeros(len(uniq), dtype=np.intp)
+        np.cumsum(counts[:-1], out=starts[1:])
+
+        ids = self.ids
+        ngroups = len(ids)
+        gids = np.fromiter((ids.setdefault(key, len(ids))
+                            for key in uniq.tolist()),
+                           dtype=np.intp, count=len(uniq))
+        self._grow(len(ids))
+        new = gids >= ngroups
+        old = ~new
+        newids, oldids = gids[new], gids[old]
+        self.keys[newids] = uniq[new]
+        for state, arr, vals in zip(self.states, self.arrays, values):
+            if vals is None:
+                part = counts
+            else:
+                vals = vals[order].astype(state.dtype)
+                part = state.ufunc.reduceat(vals, starts)
+            arr[newids] = part[new]
+            arr[oldids] = state.ufunc(arr[oldids], part[old])
+
+    def result(self):
+        """Return the keys and the states of the groups, sorted by key."""
+        n = len(self.ids)
+        keys = self.keys[:n]
+        order = np.argsort(keys, kind='mergesort')
+        return keys[order], [arr[:n][order] for arr in self.arrays]
+
+
+class _spill(object):
+    """On-disk partitions of the partial states of groups."""
+
+    def __init__(self, keydtype, states):
+        self.keydtype = keydtype
+        self.states = states
+        self.tmpdir = tempfile.mkdtemp(prefix='blz-groupby-')
+        self.partitions = [None] * NPARTITIONS
+
+    def _fields(self, keys):
+        """Split `keys` in plain arrays (one per key column)."""
+        if self.keydtype.names is None:
+            return [keys]
+        return [keys[name] for name in self.keydtype.names]
+
+    def dump(self, table):
+        """Append the contents of the group `table` to the partitions."""
+        n = len(table)
+        keys = table.keys[:n]
+        arrays = self._fields(keys) + [arr[:n] for arr in table.arrays]
+        # Equal keys always end in the same partition
+        nparts = NPARTITIONS
+        parts = np.fromiter((hash(key) % nparts for key in keys.tolist()),
+                            dtype=np.intp, count=n)
+        for p in xrange(nparts):
+            sel = np.flatnonzero(parts == p)
+            if len(sel) == 0:
+                continue
+            if self.partitions[p] is None:
+                self.partitions[p] = [
+                    barray(arr[sel], mode='w', rootdir=os.path.join(
+                        self.tmpdir, "p%d_%d" % (p, i)))
+                    for i, arr in enumerate(arrays)]
+            else:
+                for barr, arr in zip(self.partitions[p], arrays):
+                    barr.append(arr[sel])
+
+    def merge(self, bsize):
+        """Merge the partial states in each partition, one at a time."""
+        nfields = len(self._fields(np.empty(0, self.keydtype)))
+        for partition in self.partitions:
+            if partition is None:
+                continue
+            for barr in partition:
+                barr.flush()
+            table = _grouptable(self.keydtype, self.states)
+            for start in xrange(0, len(partition[0]), bsize):
+                stop = start + bsize
+                if self.keydtype.names is None:
+                    keys = partition[0][start:stop]
+                else:
+                    fields = [barr[start:stop] for barr in partition[:nfields]]
+                    keys = np.empty(len(fields[0]), dtype=self.keydtype)
+                    for name, field in zip(self.keydtype.names, fields):
+                        keys[name] = field
+                table.update(keys, [barr[start:stop]
+                                    for barr in partition[nfields:]])
+            yield table.result()
+
+    def remove(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def _parse_aggs(table, aggs):
+    """Return the (colname, op, outname) triplets for `aggs`."""
+    if aggs is None:
+        aggs = [(None, 'count')]
+    if type(aggs) not in (list, tuple):
+        raise ValueError("`aggs` must be a list of (column, op) tuples")
+    triplets = []
+    for agg in aggs:
+        if type(agg) not in (list, tuple) or len(agg) not in (2, 3):
+            raise ValueError("`aggs` must be a list of (column, op) tuples")
+        colname, op = agg[:2]
+        if op not in AGGREGATIONS:
+            raise ValueError("aggregation '%s' is not supported" % op)
+        if colname is None:
+            if op != 'count':
+                raise ValueError("only 'count' can be used without a column")
+        elif colname not in table.names:
+            raise ValueError("column '%s' not found" % colname)
+        if len(agg) == 3:
+            outname = agg[2]
+        elif colname is None:
+            outname = op
+        else:
+            outname = "%s_%s" % (colname, op)
+        triplets.append((colname, op, outname))
+    return triplets
+
+def groupby(table, keys, aggs=None, memlimit=None):
+    """Group the rows of `table` by the `keys` columns.
+
+    Returns the names of the output columns and an iterator over blocks
+    of output columns, which always yields at least one (possibly empty)
+    block.  See `btable.groupby()` for details.
+    """
+    if isinstance(keys, _strtypes):
+        keys = [keys]
+    keys = list(keys)
+    if len(keys) == 0:
+        raise ValueError("at least one key column is needed")
+    for name in keys:
+        if name not in table.names:
+            raise ValueError("column '%s' not found" % name)
+    aggs = _parse_aggs(table, aggs)
+    if memlimit is None:
+        memlimit = MEMLIMIT
+    for name in keys + [agg[0] for agg in aggs if agg[0] is not None]:
+        if table.cols[name].ndim > 1:
+            raise ValueError("column '%s' is not unidimensional" % name)
+
+    # The states needed for the aggregations ('count' is always there)
+    states, lookup = [_state('count', None, np.dtype(np.int64))], {}
+    for colname, op, outname in aggs:
+        kinds = ('sum', 'count') if op == 'mean' else (op,)
+        for kind in kinds:
+            if kind == 'count':
+                continue
+            if (kind, colname) not in lookup:
+                dtype = table.cols[colname].dtype
+                if kind == 'sum':
+                    dtype = np.sum(np.zeros(1, dtype=dtype)).dtype
+                lookup[kind, colname] = len(states)
+                states.append(_state(kind, colname, dtype))
+
+    if len(keys) == 1:
+        keydtype = table.cols[keys[0]].dtype
+    else:
+        keydtype = np.dtype([(name, table.cols[name].dtype) for name in keys])
+
+    def outcols(keyarr, arrays):
+        """Build the output columns out of keys and states."""
+        if len(keys) == 1:
+            cols = [keyarr]
+        else:
+            cols = [keyarr[name] for name in keys]
+        counts = arrays[0]
+        for colname, op, outname in aggs:
+            if op == 'count':
+                cols.append(counts)
+            elif op == 'mean':
+                sums = arrays[lookup['sum', colname]]
+                cols.append(np.true_divide(sums, counts))
+            else:
+                cols.append(arrays[lookup[op, colname]])
+        return cols
+
+    names = keys + [agg[2] for agg in aggs]
+    bsize = max(table.cols[name].chunklen
+                for name in set(keys) | set(s.colname for s in states[1:]))
+
+    def blocks():
+        gtable = _grouptable(keydtype, states)
+        spill = None
+        try:
+            for start in xrange(0, len(table), bsize):
+                stop = start + bsize
+                if len(keys) == 1:
+                    keyarr = table.cols[keys[0]][start:stop]
+                else:
+                    keyarr = np.empty(min(bsize, len(table) - start),
+                                      dtype=keydtype)
+                    for name in keys:
+                        keyarr[name] = table.cols[name][start:stop]
+                values = [None] + [table.cols[s.colname][start:stop]
+                                   for s in states[1:]]
+                gtable.update(keyarr, values)
+                if gtable.nbytes > memlimit:
+                    # Move the partial states to disk and start afresh
+                    if spill is None:
+                        spill = _spill(keydtype, states)
+                    spill.dump(gtable)
+                    gtable = _grouptable(keydtype, states)
+            if spill is None:
+                yield outcols(*gtable.result())
+                return
+            if len(gtable) > 0:
+                spill.dump(gtable)
+            empty = True
+            for keyarr, arrays in spill.merge(bsize):
+                empty = False
+                yield outcols(keyarr, arrays)
+            if empty:
+                # Still let the caller know the dtypes of the columns
+                yield outcols(*_grouptable(keydtype, states).result())
+        finally:
+            if spill is not None:
+                spill.remove()
+
+    return names, blocks()
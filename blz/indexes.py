@@ -0,0 +1,671 @@
+########################################################################
+#
+#       License: BSD
+#       Created: October 17, 2026
+#       Author:  Francesc Alted - francesc@continuum.io
+#
+########################################################################
+
+from __future__ import absolute_import
+
+# Secondary indexes for btable columns
+
+import os, os.path
+import ast
+import json
+import shutil
+import numpy as np
+
+from .blz_ext import barray, _chunk_count_nonzero
+from .chunked_eval import _constant, _swapped_ops
+from .py2help import xrange
+
+# The directory (under the btable rootdir) keeping the indexes
+INDEXES_DIR = '__indexes__'
+# The file with the metadata of every index
+INDEX_META = '__meta__'
+# Rows appended are indexed in runs of their own until there are this many
+MAXRUNS = 8
+# The maximum number of distinct values for creating a bitmap index
+MAXCARDINALITY = 1024
+# The file with the rows past which a run of a sorted index is stale
+RUN_META = '__run__'
+
+
+def _nupdates(col):
+    """Return the number of in-place updates of the `col` column."""
+    # The codes of dictarrays are the ones being updated
+    return getattr(getattr(col, 'codes', col), '_nupdates', 0)
+
+
+class _index(object):
+    """Base class for indexes, which can tell whether they are stale.
+
+    Modifications done through the btable update the indexes, but the
+    columns can be modified directly too.  An index remembers how many
+    in-place updates its column had when it was last brought up to
+    date, and it is rebuilt by `refresh()` if they differ.
+    """
+
+    def _synced(self):
+        """Mark the index as up to date with its column."""
+        self.nupdates = _nupdates(self.table.cols[self.colname])
+
+    def refresh(self):
+        """Rebuild the index if its column was modified directly.
+
+        Return whether the index was rebuilt.
+        """
+        if _nupdates(self.table.cols[self.colname]) == self.nupdates:
+            return False
+        self.build()
+        return True
+
+    def resize(self, oldlen):
+        """Adapt the index to a table resized from `oldlen` rows."""
+        nrows = len(self.table)
+        if nrows < oldlen:
+            self.trim(nrows)
+        else:
+            self.append(oldlen)
+
+
+class sortedindex(_index):
+    """Sorted (value, row) index for a btable column.
+
+    The index is made of runs, each one being a pair of barrays: the
+    values of the column in sorted order and the rows where they live.
+    Rows appended or modified in the table are indexed in a new run,
+    and the index is rebuilt as a single run when there are too many of
+    them.  The rows that were modified later (or trimmed) are masked in
+    the older runs.
+
+    The first value of every chunk of the sorted values is kept in
+    memory, so that a lookup only decompresses the chunks at the
+    boundaries of the range.
+    """
+
+    kind = 'sorted'
+
+    def __init__(self, table, colname, rootdir=None, _new=False):
+        self.table = table
+        self.colname = colname
+        self.rootdir = rootdir
+        self.runs = []
+        # For every run, the rows masked and the first row trimmed
+        self.masks = []
+        self.cutoffs = []
+        if _new:
+            self.build()
+        else:
+            self.open()
+        self._synced()
+
+    def _rundir(self, nrun):
+        return os.path.join(self.rootdir, "run%d" % nrun)
+
+    def _add_run(self, values, rows):
+        """Add a run made of sorted `values` and their `rows`."""
+        kwargs = {'bparams': self.table.bparams}
+        vdir = rdir = None
+        if self.rootdir:
+            rundir = self._rundir(len(self.runs))
+            os.makedirs(rundir)
+            vdir = os.path.join(rundir, 'values')
+            rdir = os.path.join(rundir, 'rows')
+        bvalues = barray(values, rootdir=vdir, **kwargs)
+        brows = barray(rows, rootdir=rdir, **kwargs)
+        bvalues.flush()
+        brows.flush()
+        fences = values[::bvalues.chunklen].copy()
+        self.runs.append((bvalues, brows, fences))
+        self.masks.append(np.empty(0, dtype=np.int64))
+        self.cutoffs.append(None)
+
+    def _save_run(self, nrun):
+        """Save the mask and cutoff of the `nrun` run on-disk."""
+        if not self.rootdir:
+            return
+        rundir = self._rundir(nrun)
+        with open(os.path.join(rundir, RUN_META), 'wb') as metafh:
+            metafh.write(json.dumps({'cutoff': self.cutoffs[nrun]})
+                         .encode('ascii'))
+            metafh.write(b"\n")
+        maskdir = os.path.join(rundir, 'masked')
+        barray(self.masks[nrun], rootdir=maskdir, mode='w').flush()
+
+    def _sort(self, start, stop):
+        """Return the sorted values and rows for column rows in range."""
+        values = self.table.cols[self.colname][start:stop]
+        order = np.argsort(values, kind='mergesort')
+        return values[order], order.astype(np.int64) + start
+
+    def open(self):
+        """Open the runs of an existing index on-disk."""
+        mode = self.table.mode
+        while os.path.isdir(self._rundir(len(self.runs))):
+            rundir = self._rundir(len(self.runs))
+            bvalues = barray(rootdir=os.path.join(rundir, 'values'), mode=mode)
+            brows = barray(rootdir=os.path.join(rundir, 'rows'), mode=mode)
+            fences = bvalues[::bvalues.chunklen]
+            self.runs.append((bvalues, brows, fences))
+            mask, cutoff = np.empty(0, dtype=np.int64), None
+            if os.path.exists(os.path.join(rundir, RUN_META)):
+                with open(os.path.join(rundir, RUN_META), 'rb') as metafh:
+                    cutoff = json.loads(metafh.read().decode('ascii'))['cutoff']
+                mask = barray(rootdir=os.path.join(rundir, 'masked'))[:]
+            self.masks.append(mask)
+            self.cutoffs.append(cutoff)
+
+    def build(self):
+        """(Re)build the index out of the whole column."""
+        self.clear()
+        self._add_run(*self._sort(0, len(self.table)))
+        self._synced()
+
+    def append(self, start):
+        """Index the rows appended to the table from `start` on."""
+        if self.refresh() or start >= len(self.table):
+            return
+        if len(self.runs) >= MAXRUNS:
+            self.build()
+        else:
+            self._add_run(*self._sort(start, len(self.table)))
+
+    def update(self, rows, oldvalues):
+        """Index the new values of the sorted `rows` (formerly `oldvalues`).
+
+        The new values go to a run of their own, and the `rows` are
+        masked in the older runs.
+        """
+        self._synced()
+        if len(rows) == 0:
+            return
+        nmasked = sum(len(mask) for mask in self.masks) + len(rows)
+        if len(self.runs) >= MAXRUNS or nmasked > len(self.table) // MAXRUNS:
+            self.build()
+            return
+        for nrun in range(len(self.runs)):
+            self.masks[nrun] = np.union1d(self.masks[nrun], rows)
+            self._save_run(nrun)
+        values = self.table.cols[self.colname][rows]
+        order = np.argsort(values, kind='mergesort')
+        self._add_run(values[order], rows[order])
+
+    def trim(self, nrows):
+        """Forget the rows of the table from `nrows` on."""
+        if self.refresh():
+            return
+        for nrun, cutoff in enumerate(self.cutoffs):
+            if cutoff is None or nrows < cutoff:
+                self.cutoffs[nrun] = nrows
+                self._save_run(nrun)
+
+    def clear(self):
+        """Remove all the runs."""
+        if self.rootdir:
+            for nrun in range(len(self.runs)):
+                shutil.rmtree(self._rundir(nrun))
+        self.runs = []
+        self.masks = []
+        self.cutoffs = []
+
+    def _search(self, run, value, side):
+        """Find where `value` is in the sorted values of `run`."""
+        values, rows, fences = run
+        pos = np.searchsorted(fences, value, side=side)
+        if pos == 0:
+            return 0
+        start = (pos - 1) * values.chunklen
+        block = values[start:start+values.chunklen]
+        return start + np.searchsorted(block, value, side=side)
+
+    def lookup(self, op, args):
+        """Return the sorted rows fulfilling the `op` condition.
+
+        Only 'range' and 'isin' conditions are supported (None is
+        returned for the rest).  For ranges, `args` is a (lo, loinc, hi,
+        hiinc) tuple, where None means an open end.  For 'isin', `args`
+        is a sequence of values.
+        """
+        if op == 'isin':
+            parts = [self.lookup('range', (value, True, value, True))
+                     for value in args]
+            return np.unique(np.concatenate(parts))
+        if op != 'range':
+            return None
+        lo, loinc, hi, hiinc = args
+        if hi is None and self.table.cols[self.colname].dtype.kind == 'f':
+            # NaNs are sorted last, and they never fulfill comparisons
+            hi, hiinc = np.inf, True
+        parts = []
+        for run, mask, cutoff in zip(self.runs, self.masks, self.cutoffs):
+            start, stop = 0, len(run[0])
+            if lo is not None:
+                start = self._search(run, lo, 'left' if loinc else 'right')
+            if hi is not None:
+                stop = self._search(run, hi, 'right' if hiinc else 'left')
+            if start < stop:
+                rows = run[1][start:stop]
+                if cutoff is not None:
+                    rows = rows[rows < cutoff]
+                if len(mask):
+                    rows = rows[~np.in1d(rows, mask)]
+                parts.append(rows)
+        if len(parts) == 0:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate(parts)
+        rows.sort()
+        return rows
+
+    def remove(self):
+        """Remove the index completely."""
+        self.clear()
+        if self.rootdir:
+            shutil.rmtree(self.rootdir)
+
+
+class bitmapindex(_index):
+    """Bitmap index for a btable column with few distinct values.
+
+    There is a boolean barray (a bitmap) for every distinct value of the
+    column, telling the rows where the value is.  Bitmaps are made of
+    zeros mostly, so they compress very well, and lookups skip the
+    chunks without true values by looking at their true counts, i.e.
+    without decompressing them.  NaNs are not in any bitmap.
+    """
+
+    kind = 'bitmap'
+
+    def __init__(self, table, colname, rootdir=None, _new=False):
+        self.table = table
+        self.colname = colname
+        self.rootdir = rootdir
+        self.ids = {}
+        self.bitmaps = []
+        self.values = None
+        if _new:
+            try:
+                self.build(MAXCARDINALITY)
+            except ValueError:
+                self.remove()
+                raise
+        else:
+            self.open()
+        self._synced()
+
+    def _bitmapdir(self, nbitmap):
+        return os.path.join(self.rootdir, "bitmap%d" % nbitmap)
+
+    def _add_bitmap(self, value, nrows):
+        """Add a bitmap for `value`, initially false for `nrows` rows."""
+        kwargs = {'bparams': self.table.bparams}
+        if self.bitmaps:
+            kwargs['chunklen'] = self.bitmaps[0].chunklen
+        else:
+            kwargs['expectedlen'] = len(self.table)
+        vdir = bdir = None
+        if self.rootdir:
+            vdir = os.path.join(self.rootdir, 'values')
+            bdir = self._bitmapdir(len(self.bitmaps))
+        if self.values is None:
+            dtype = self.table.cols[self.colname].dtype
+            self.values = barray(np.empty(0, dtype=dtype), rootdir=vdir,
+                                 bparams=self.table.bparams)
+        bitmap = barray(np.empty(0, dtype=np.bool_), rootdir=bdir, **kwargs)
+        bitmap.resize(nrows)
+        self.ids[value] = len(self.bitmaps)
+        self.bitmaps.append(bitmap)
+        self.values.append([value])
+
+    def open(self):
+        """Open the bitmaps of an existing index on-disk."""
+        mode = self.table.mode
+        vdir = os.path.join(self.rootdir, 'values')
+        if not os.path.isdir(vdir):
+            return
+        self.values = barray(rootdir=vdir, mode=mode)
+        for nbitmap, value in enumerate(self.values[:].tolist()):
+            bitmap = barray(rootdir=self._bitmapdir(nbitmap), mode=mode)
+            self.ids[value] = nbitmap
+            self.bitmaps.append(bitmap)
+
+    def build(self, maxcardinality=None):
+        """(Re)build the index out of the whole column.
+
+        ValueError is raised as soon as the column has more than
+        `maxcardinality` distinct values (if not None).
+        """
+        self.clear()
+        self._synced()
+        self.append(0, maxcardinality)
+
+    def append(self, start, maxcardinality=None):
+        """Index the rows appended to the table from `start` on.
+
+        ValueError is raised before adding bitmaps that would exceed
+        `maxcardinality` (if not None).
+        """
+        if self.refresh():
+            return
+        col = self.table.cols[self.colname]
+        nrows = len(self.table)
+        bsize = col.chunklen
+        for bstart in xrange(start, nrows, bsize):
+            block = col[bstart:bstart+bsize]
+            uniq, inv = np.unique(block, return_inverse=True)
+            if maxcardinality is not None:
+                nnew = sum(1 for value in uniq.tolist()
+                           if value == value and value not in self.ids)
+                if len(self.bitmaps) + nnew > maxcardinality:
+                    raise ValueError(
+                        "column '%s' has too many distinct values for a "
+                        "bitmap index (more than %d)" %
+                        (self.colname, maxcardinality))
+            codes = np.empty(len(uniq), dtype=np.intp)
+            for i, value in enumerate(uniq.tolist()):
+                if value != value:
+                    # NaNs never fulfill comparisons
+                    codes[i] = -1
+                    continue
+                if value not in self.ids:
+                    self._add_bitmap(value, bstart)
+                codes[i] = self.ids[value]
+            present = set(codes.tolist())
+            codes = codes[inv]
+            falses = np.zeros(len(block), dtype=np.bool_)
+            for nbitmap, bitmap in enumerate(self.bitmaps):
+                if nbitmap in present:
+                    bitmap.append(codes == nbitmap)
+                else:
+                    bitmap.append(falses)
+        for bitmap in self.bitmaps:
+            bitmap.flush()
+        if self.values is not None:
+            self.values.flush()
+
+    def update(self, rows, oldvalues):
+        """Index the new values of the sorted `rows` (formerly `oldvalues`).
+
+        Only the bitmaps of the old and the new values are modified.
+        """
+        self._synced()
+        if len(rows) == 0:
+            return
+        newvalues = self.table.cols[self.colname][rows]
+        nrows = len(self.table)
+        modified = set()
+        for values, flag in ((oldvalues, False), (newvalues, True)):
+            uniq, inv = np.unique(values, return_inverse=True)
+            for i, value in enumerate(uniq.tolist()):
+                if value != value:
+                    # NaNs are not in any bitmap
+                    continue
+                if value not in self.ids:
+                    if not flag:
+                        continue
+                    self._add_bitmap(value, nrows)
+                nbitmap = self.ids[value]
+                self.bitmaps[nbitmap][rows[inv == i]] = flag
+                modified.add(nbitmap)
+        for nbitmap in modified:
+            self.bitmaps[nbitmap].flush()
+        if self.values is not None:
+            self.values.flush()
+
+    def trim(self, nrows):
+        """Forget the rows of the table from `nrows` on."""
+        if self.refresh():
+            return
+        for bitmap in self.bitmaps:
+            bitmap.trim(len(bitmap) - nrows)
+            bitmap.flush()
+
+    def clear(self):
+        """Remove all the bitmaps."""
+        if self.rootdir:
+            for nbitmap in range(len(self.bitmaps)):
+                shutil.rmtree(self._bitmapdir(nbitmap))
+            if self.values is not None:
+                shutil.rmtree(os.path.join(self.rootdir, 'values'))
+        self.ids = {}
+        self.bitmaps = []
+        self.values = None
+
+    def _rows(self, nbitmaps, negate=False):
+        """Return the sorted rows set in any of the `nbitmaps` bitmaps.
+
+        If `negate` is true, the rows not set in any of them are
+        returned instead.
+        """
+        nrows = len(self.table)
+        bitmaps = [self.bitmaps[nbitmap] for nbitmap in nbitmaps]
+        if len(bitmaps) == 0:
+            if negate:
+                return np.arange(nrows, dtype=np.int64)
+            return np.empty(0, dtype=np.int64)
+        chunklen = bitmaps[0].chunklen
+        parts = []
+        for start in xrange(0, nrows, chunklen):
+            nchunk = start // chunklen
+            mask = None
+            for bitmap in bitmaps:
+                if nchunk < len(bitmap.chunks):
+                    chunk_ = bitmap.chunks[nchunk]
+                    ntrues, nelems = _chunk_count_nonzero(chunk_)
+                    if ntrues == 0:
+                        continue
+                    block = chunk_[:]
+                else:
+                    # The leftover rows
+                    block = bitmap[start:start+chunklen]
+                if mask is None:
+                    mask = block.copy()
+                else:
+                    mask |= block
+            if mask is None:
+                if negate:
+                    parts.append(np.arange(start, min(start+chunklen, nrows)))
+                continue
+            if negate:
+                mask = ~mask
+            parts.append(np.flatnonzero(mask) + start)
+        if len(parts) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts).astype(np.int64)
+
+    def _select(self, values):
+        """Return the bitmaps for the `values` that are in the column."""
+        if self.values is None:
+            return []
+        return np.flatnonzero(np.in1d(self.values[:], values))
+
+    def lookup(self, op, args):
+        """Return the sorted rows fulfilling the `op` condition.
+
+        The 'range', 'ne', 'isin' and 'notin' conditions are supported.
+        For ranges, `args` is a (lo, loinc, hi, hiinc) tuple, where None
+        means an open end.  For 'ne', `args` is a value and for 'isin'
+        and 'notin', a sequence of values.
+        """
+        if op == 'range':
+            if self.values is None:
+                return self._rows([])
+            lo, loinc, hi, hiinc = args
+            values = self.values[:]
+            sel = np.ones(len(values), dtype=np.bool_)
+            if lo is not None:
+                sel &= (values >= lo) if loinc else (values > lo)
+            if hi is not None:
+                sel &= (values <= hi) if hiinc else (values < hi)
+            return self._rows(np.flatnonzero(sel))
+        elif op == 'ne':
+            return self._rows(self._select([args]), negate=True)
+        elif op == 'isin':
+            return self._rows(self._select(args))
+        elif op == 'notin':
+            return self._rows(self._select(args), negate=True)
+        return None
+
+    def remove(self):
+        """Remove the index completely."""
+        self.clear()
+        if self.rootdir:
+            shutil.rmtree(self.rootdir)
+
+
+# The classes for every kind of index
+index_kinds = {'sorted': sortedindex, 'bitmap': bitmapindex}
+
+def _indexdir(table, colname):
+    if table.rootdir is None:
+        return None
+    return os.path.join(table.rootdir, INDEXES_DIR, colname)
+
+def create_index(table, colname, kind):
+    """Create an index of `kind` for the `colname` column of `table`."""
+    if kind not in index_kinds:
+        raise ValueError("index kind '%s' is not supported" % kind)
+    rootdir = _indexdir(table, colname)
+    if rootdir:
+        os.makedirs(rootdir)
+        with open(os.path.join(rootdir, INDEX_META), 'wb') as metafile:
+            metafile.write(json.dumps({'kind': kind}).encode('ascii'))
+            metafile.write(b"\n")
+    return index_kinds[kind](table, colname, rootdir, _new=True)
+
+def open_indexes(table):
+    """Return a dictionary with the indexes on-disk for `table`."""
+    indexes = {}
+    if table.rootdir is None:
+        return indexes
+    for colname in table.names:
+        rootdir = _indexdir(table, colname)
+        metafile = os.path.join(rootdir, INDEX_META)
+        if not os.path.exists(metafile):
+            continue
+        with open(metafile, 'rb') as metafh:
+            meta = json.loads(metafh.read().decode('ascii'))
+        indexes[colname] = index_kinds[meta['kind']](table, colname, rootdir)
+    return indexes
+
+
+# The machinery for answering expressions with indexes follows
+
+def _literal(node):
+    """Return the value of a literal `node` (or None)."""
+    value = _constant(node)
+    if value is not None:
+        return value
+    nodetype = type(node).__name__
+    if nodetype in ('Str', 'Bytes'):
+        return node.s
+    if nodetype == 'Constant' and isinstance(node.value, (bytes, str)):
+        return node.value
+    return None
+
+def _range(op, value):
+    """Return the (lo, loinc, hi, hiinc) range for `x op value`."""
+    if op is ast.Lt:
+        return (None, False, value, False)
+    elif op is ast.LtE:
+        return (None, False, value, True)
+    elif op is ast.Gt:
+        return (value, False, None, False)
+    elif op is ast.GtE:
+        return (value, True, None, False)
+    elif op is ast.Eq:
+        return (value, True, value, True)
+    return None
+
+def _condition(node):
+    """Return the (colname, op, args) condition in `node` (or None)."""
+    if type(node).__name__ != 'Compare':
+        return None
+    operands = [node.left] + list(node.comparators)
+    ops = [type(op) for op in node.ops]
+    if len(ops) != 1:
+        # Chained comparisons are not supported by numexpr either
+        return None
+    left, right = operands
+    op = ops[0]
+    if op in (ast.In, ast.NotIn):
+        # Membership in a sequence of literals
+        if (type(left).__name__ != 'Name' or
+            type(right).__name__ not in ('Tuple', 'List')):
+            return None
+        values = [_literal(elt) for elt in right.elts]
+        if len(values) == 0 or None in values:
+            return None
+        colname, value = left.id, values
+    elif type(left).__name__ == 'Name':
+        colname, value = left.id, _literal(right)
+    elif type(right).__name__ == 'Name' and op in _swapped_ops:
+        colname, value, op = right.id, _literal(left), _swapped_ops[op]
+    else:
+        return None
+    if value is None:
+        return None
+    if op in (ast.In, ast.NotIn):
+        return (colname, 'isin' if op is ast.In else 'notin', value)
+    if op is ast.NotEq:
+        return (colname, 'ne', value)
+    args = _range(op, value)
+    if args is None:
+        return None
+    return (colname, 'range', args)
+
+def _intersect_ranges(r1, r2):
+    """Return the intersection of the (lo, loinc, hi, hiinc) ranges."""
+    lo1, loinc1, hi1, hiinc1 = r1
+    lo2, loinc2, hi2, hiinc2 = r2
+    if lo1 is None or (lo2 is not None and
+                       (lo2 > lo1 or (lo2 == lo1 and not loinc2))):
+        lo1, loinc1 = lo2, loinc2
+    if hi1 is None or (hi2 is not None and
+                       (hi2 < hi1 or (hi2 == hi1 and not hiinc2))):
+        hi1, hiinc1 = hi2, hiinc2
+    return (lo1, loinc1, hi1, hiinc1)
+
+def _rows(indexes, node):
+    """Return the sorted rows where `node` is true (or None)."""
+    nodetype = type(node).__name__
+    if nodetype == 'BinOp' and type(node.op) in (ast.BitAnd, ast.BitOr):
+        if type(node.op) is ast.BitAnd:
+            # A range on a single column needs a single lookup
+            cond1, cond2 = _condition(node.left), _condition(node.right)
+            if (cond1 is not None and cond2 is not None and
+                cond1[0] == cond2[0] and cond1[0] in indexes and
+                cond1[1] == cond2[1] == 'range'):
+                args = _intersect_ranges(cond1[2], cond2[2])
+                return indexes[cond1[0]].lookup('range', args)
+        left = _rows(indexes, node.left)
+        if left is None:
+            return None
+        right = _rows(indexes, node.right)
+        if right is None:
+            return None
+        if type(node.op) is ast.BitAnd:
+            return np.intersect1d(left, right, assume_unique=True)
+        return np.union1d(left, right)
+    cond = _condition(node)
+    if cond is None or cond[0] not in indexes:
+        return None
+    colname, op, args = cond
+    return indexes[colname].lookup(op, args)
+
+def index_rows(table, expression):
+    """Return the sorted rows of `table` where `expression` is true.
+
+    The `expression` is answered with the indexes of `table` only, and
+    None is returned if this is not possible.
+    """
+    if not table.indexes:
+        return None
+    for index in table.indexes.values():
+        index.refresh()
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        return None
+    return _rows(table.indexes, tree.body)
@@ -4,7 +4,9 @@ from __future__ import absolute_import
 
 import sys
 import struct
+import json
 import os, os.path
+import threading
 if sys.version < "2.7":
     import unittest2 as unittest
     from unittest2 import TestCase, skipUnless
@@ -556,9 +558,75 @@ class copyTest(MayBeDiskTest, TestCase):
         #print "b.cbytes, c.cbytes:", b.cbytes, c.cbytes
         self.assert_(b.cbytes < c.cbytes, "shuffle not changed")
 
+    def test04(self):
+        """Testing copy() of compressed chunks (memory and disk)"""
+        a = np.linspace(-1., 1., 10007)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        b[5] = 0   # make sure that chunks are not in the original state
+        a[5] = 0
+        rootdir = None if self.rootdir is None else self.rootdir + '_copy'
+        for kwargs in ({}, {'rootdir': rootdir},
+                       {'rootdir': rootdir, 'mode': 'w',
+                        'storage': 'packed'}):
+            c = b.copy(**kwargs)
+            self.assertEqual(c.chunklen, b.chunklen)
+            self.assertEqual(c.nchunks, b.nchunks)
+            assert_array_equal(c[:], a, "incorrect values after copy()")
+            c.append([2.])
+            assert_array_equal(c[-2:], [a[-1], 2.])
+        # Creating a barray out of another one follows the same path
+        c = blz.barray(b, chunklen=1000)
+        assert_array_equal(c[:], a)
+        c = blz.barray(b, chunklen=300, dtype='f4')
+        assert_array_equal(c[:], a.astype('f4'))
+
+    def test05(self):
+        """Testing copy() of compressed constant chunks"""
+        a = np.zeros(1000, dtype='i4')
+        a[-10:] = 1
+        b = blz.barray(a, chunklen=100)
+        rootdir = None if self.rootdir is None else self.rootdir + '_copy'
+        c = b.copy(rootdir=rootdir)
+        assert_array_equal(c[:], a)
+        self.assertEqual(c.sum(), 10)
+
+    def test06(self):
+        """Testing recompress()"""
+        a = np.linspace(-1., 1., 1e4 + 7)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        cbytes = b.cbytes
+        b.recompress(blz.bparams(clevel=1))
+        self.assert_(b.cbytes > cbytes, "clevel not changed")
+        b.recompress(blz.bparams(clevel=9, cname='lz4'))
+        self.assertEqual(b.bparams.cname, b'lz4')
+        assert_array_equal(b[:], a)
+        b.append([2.])
+        assert_array_equal(b[-2:], [a[-1], 2.])
+        self.assertRaises(ValueError, b.recompress, 9)
+
 class copyDiskTest(copyTest):
     disk = True
 
+    def test07(self):
+        """Testing that the full bparams are persisted"""
+        a = np.linspace(-1., 1., 1e4 + 7)
+        bparams = blz.bparams(clevel=3, shuffle=False, cname='lz4',
+                              blocksize=4096)
+        b = blz.barray(a, chunklen=1000, bparams=bparams,
+                       rootdir=self.rootdir)
+        b = blz.open(rootdir=self.rootdir)
+        for attr in ('clevel', 'shuffle', 'cname', 'blocksize'):
+            self.assertEqual(getattr(b.bparams, attr),
+                             getattr(bparams, attr))
+        b.append(a)
+        self.assertEqual(b.chunks[b.nchunks-1].blocksize, 4096)
+        b.trim(len(a))
+        b.recompress(blz.bparams(clevel=9, cname='blosclz'))
+        b = blz.open(rootdir=self.rootdir)
+        self.assertEqual((b.bparams.clevel, b.bparams.cname),
+                         (9, b'blosclz'))
+        assert_array_equal(b[:], a)
+
 
 class iterTest(MayBeDiskTest, TestCase):
 
@@ -921,6 +989,65 @@ class fancy_indexing_getitemTest(TestCase):
         #print "where ->", b[blz.barray((a<5)|(a>9))]
         assert_array_equal(wt, cwt, "where() does not work correctly")
 
+    def test07(self):
+        """Testing fancy indexing (unsorted, repeated and negative indices)"""
+        a = np.arange(1, 1e4 + 33)
+        b = blz.barray(a, chunklen=100)
+        idx = np.random.randint(-len(a), len(a), size=3000)
+        idx[:3] = (-1, len(a) - 1, 0)
+        assert_array_equal(b[idx], a[idx],
+                           "fancy indexing does not work correctly")
+
+    def test08(self):
+        """Testing fancy indexing (out of range indices)"""
+        a = np.arange(1, 101)
+        b = blz.barray(a, chunklen=10)
+        self.assertRaises(IndexError, b.__getitem__, [1, 100])
+        self.assertRaises(IndexError, b.__getitem__, [-101, 1])
+
+    def test09(self):
+        """Testing fancy indexing (multidimensional)"""
+        a = np.arange(3000).reshape(1000, 3)
+        b = blz.barray(a, chunklen=64)
+        idx = [999, 3, 500, 3, 64]
+        assert_array_equal(b[idx], a[idx],
+                           "fancy indexing does not work correctly")
+
+    def test10(self):
+        """Testing bool fancy indexing (sparse masks and leftovers)"""
+        a = np.arange(1, 1e4 + 33)
+        b = blz.barray(a, chunklen=100)
+        mask = np.zeros(len(a), dtype=np.bool_)
+        mask[[0, 99, 100, 5050, 5051, len(a) - 1]] = True
+        assert_array_equal(b[mask], a[mask])
+        # barray masks, with the same and with different chunklens
+        assert_array_equal(b[blz.barray(mask, chunklen=100)], a[mask])
+        assert_array_equal(b[blz.barray(mask, chunklen=33)], a[mask])
+        assert_array_equal(b[~mask], a[~mask])
+        assert_array_equal(b[np.zeros(len(a), dtype=np.bool_)], a[:0])
+
+    def test11(self):
+        """Testing bool fancy indexing (multidimensional and objects)"""
+        a = np.arange(3000).reshape(1000, 3)
+        b = blz.barray(a, chunklen=64)
+        mask = a[:, 0] % 7 == 0
+        assert_array_equal(b[mask], a[mask])
+        o = np.empty(300, dtype=object)
+        o[:] = [str(i) for i in range(300)]
+        bo = blz.barray(o, chunklen=64)
+        assert_array_equal(bo[mask[:300]], o[mask[:300]])
+
+class fancy_indexing_getitemDiskTest(MayBeDiskTest, TestCase):
+    disk = True
+
+    def test00(self):
+        """Testing fancy indexing (on-disk)"""
+        a = np.arange(1e4 + 33)
+        b = blz.barray(a, chunklen=100, rootdir=self.rootdir)
+        idx = np.random.randint(len(a), size=1000)
+        assert_array_equal(b[idx], a[idx],
+                           "fancy indexing does not work correctly")
+
 
 class fancy_indexing_setitemTest(TestCase):
 
@@ -986,6 +1113,27 @@ class fancy_indexing_setitemTest(TestCase):
         #print "b[%s] -> %r" % (sl, b)
         assert_array_equal(b[:], a, "fancy indexing does not work correctly")
 
+    def test06(self):
+        """Testing fancy indexing with __setitem__ (scattered indices)"""
+        a = np.arange(1, 1e4 + 33)
+        b = blz.barray(a, chunklen=100)
+        idx = np.random.randint(-len(a), len(a), size=3000)
+        value = np.random.rand(len(idx))
+        b[idx] = value
+        a[idx] = value
+        assert_array_equal(b[:], a, "fancy indexing does not work correctly")
+        self.assertRaises(IndexError, b.__setitem__, [len(a)], 0)
+
+    def test07(self):
+        """Testing fancy indexing with __setitem__ (repeated indices)"""
+        a = np.arange(1, 1e3)
+        b = blz.barray(a, chunklen=10)
+        sl = [55, 3, 55, 998, 3, 55]
+        b[sl] = range(6)
+        a[sl] = range(6)
+        assert_array_equal(b[:], a, "fancy indexing does not work correctly")
+        self.assertEqual(b[55], 5)
+
 
 class fromiterTest(TestCase):
 
@@ -1585,6 +1733,107 @@ class evalDiskBigNE(evalTest, TestCase):
     disk = True
 
 
+class evalParallelTest(MayBeDiskTest):
+
+    vm = "python"
+    N = 1e5 + 7
+
+    def setUp(self):
+        self.prev_vm = blz.defaults.eval_vm
+        blz.defaults.eval_vm = self.vm
+        MayBeDiskTest.setUp(self)
+
+    def tearDown(self):
+        blz.defaults.eval_vm = self.prev_vm
+        MayBeDiskTest.tearDown(self)
+
+    def test00(self):
+        """Testing eval() with several threads (barray output)"""
+        a, b = np.arange(self.N), np.arange(1, self.N+1)
+        c, d = blz.barray(a, rootdir=self.rootdir), blz.barray(b)
+        cr = blz.eval("c * d + 1", nthreads=4)
+        nr = a * b + 1
+        self.assert_(isinstance(cr, blz.barray))
+        assert_array_equal(cr[:], nr, "eval does not work correctly")
+
+    def test01(self):
+        """Testing eval() with several threads (numpy output)"""
+        a = np.arange(self.N)
+        c = blz.barray(a, rootdir=self.rootdir)
+        cr = blz.eval("c", out_flavor='numpy', nthreads=4)
+        assert_array_equal(cr, a, "eval does not work correctly")
+
+    def test02(self):
+        """Testing eval() with several threads and pruned blocks"""
+        a = np.arange(self.N)
+        c = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        cr = blz.eval("(c > 5000) & (c < 60000)", nthreads=4)
+        nr = (a > 5000) & (a < 60000)
+        assert_array_equal(cr[:], nr, "eval does not work correctly")
+
+    def test03(self):
+        """Testing eval() with a number of threads from defaults"""
+        a = np.arange(self.N)
+        c = blz.barray(a, rootdir=self.rootdir)
+        nthreads = blz.defaults.nthreads
+        blz.defaults.nthreads = 3
+        try:
+            cr = blz.eval("c * 2")
+        finally:
+            blz.defaults.nthreads = nthreads
+        assert_array_equal(cr[:], a * 2, "eval does not work correctly")
+
+    def test04(self):
+        """Testing eval() with a bad number of threads"""
+        c = blz.arange(10)
+        self.assertRaises(ValueError, blz.eval, "c * 2", nthreads=0)
+
+    def test05(self):
+        """Testing that only a few blocks are evaluated ahead"""
+        a = np.arange(self.N)
+        class slices(object):
+            # Records the blocks requested by the evaluator
+            dtype, shape = a.dtype, a.shape
+            requested = []
+            def __len__(self):
+                return len(a)
+            def __getitem__(self, key):
+                self.requested.append(key)
+                return a[key]
+        c = slices()
+        blocks = blz.chunked_eval._eval_iter("c + 1", user_dict={'c': c},
+                                             nthreads=4)
+        i, block = next(blocks)
+        self.assertTrue(len(c.requested) <=
+                        blz.chunked_eval.EVAL_WINDOW * 4 + 1)
+        self.assertTrue(len(c.requested) < self.N // len(block))
+        nr = [block] + [block for i, block in blocks]
+        assert_array_equal(np.concatenate(nr), a + 1)
+        self.assertTrue(blz.utils.thread_pool(4, 'eval') is not
+                        blz.utils.thread_pool(4))
+
+class evalParallel(evalParallelTest, TestCase):
+    pass
+
+class evalDiskParallel(evalParallelTest, TestCase):
+    disk = True
+
+@skipUnless(blz.numexpr_here, "numexpr is not here")
+class evalParallelNE(evalParallelTest, TestCase):
+    vm = "numexpr"
+
+    def test05(self):
+        """Testing reductions in eval() with several threads"""
+        a = np.arange(self.N)
+        c = blz.barray(a, rootdir=self.rootdir)
+        cr = blz.eval("sum(c)", nthreads=4)
+        self.assertEqual(cr, a.sum())
+
+@skipUnless(blz.numexpr_here, "numexpr is not here")
+class evalDiskParallelNE(evalParallelNE):
+    disk = True
+
+
 class computeMethodsTest(unittest.TestCase):
 
     def test00(self):
@@ -1615,6 +1864,99 @@ class computeMethodsTest(unittest.TestCase):
         self.assertRaises(TypeError, ac.sum)
 
 
+class reductionsTest(MayBeDiskTest):
+
+    def reopen(self, b):
+        """Reopen `b` so that chunks are read from disk again."""
+        if self.rootdir:
+            b.flush()
+            b = blz.open(rootdir=self.rootdir)
+        return b
+
+    def check(self, a):
+        b = self.reopen(blz.barray(a, chunklen=1000, rootdir=self.rootdir,
+                                   mode='w'))
+        for name in ('min', 'max', 'argmin', 'argmax', 'mean', 'var',
+                     'std', 'count_nonzero', 'any', 'all'):
+            r = getattr(b, name)()
+            nr = getattr(np, name)(a)
+            assert_allclose(r, nr, err_msg="%s() is not correct" % name)
+            if name in ('min', 'max'):
+                self.assertEqual(np.asarray(r).dtype, a.dtype)
+
+    def test00(self):
+        """Testing reductions with floats"""
+        self.check(np.random.rand(10003) - .5)
+
+    def test01(self):
+        """Testing reductions with integers"""
+        self.check(np.arange(10003, dtype='i4') % 17 - 5)
+
+    def test02(self):
+        """Testing reductions with booleans"""
+        self.check(np.arange(10003) % 3 == 0)
+        self.check(np.zeros(10003, dtype='b1'))
+
+    def test03(self):
+        """Testing reductions with constant chunks"""
+        a = np.zeros(10003)
+        a[5000:] = 1
+        self.check(a)
+
+    def test04(self):
+        """Testing reductions with NaNs"""
+        a = np.arange(10003.)
+        a[7777] = np.nan
+        b = self.reopen(blz.barray(a, chunklen=1000, rootdir=self.rootdir))
+        self.assertTrue(np.isnan(b.min()))
+        self.assertTrue(np.isnan(b.max()))
+        self.assertEqual(b.argmin(), 7777)
+        self.assertEqual(b.argmax(), 7777)
+        self.assertEqual(b.count_nonzero(), 10002)
+
+    def test05(self):
+        """Testing reductions with multidimensional barrays"""
+        self.check(np.random.rand(3001, 3))
+
+    def test06(self):
+        """Testing sum() of booleans read from disk"""
+        a = np.arange(10003) % 3 == 0
+        b = self.reopen(blz.barray(a, chunklen=1000, rootdir=self.rootdir))
+        self.assertEqual(b.sum(), a.sum())
+
+    def test07(self):
+        """Testing reductions with empty barrays"""
+        b = blz.barray(np.empty(0), rootdir=self.rootdir)
+        self.assertRaises(ValueError, b.min)
+        self.assertRaises(ValueError, b.argmax)
+        self.assertTrue(np.isnan(b.mean()))
+        self.assertFalse(b.any())
+        self.assertTrue(b.all())
+        self.assertEqual(b.count_nonzero(), 0)
+
+    def test08(self):
+        """Testing reductions with strings (TypeError)"""
+        b = blz.zeros(10, 'S3', rootdir=self.rootdir)
+        self.assertRaises(TypeError, b.min)
+        self.assertRaises(TypeError, b.var)
+        self.assertEqual(b.count_nonzero(), 0)
+
+    def test09(self):
+        """Testing reductions with several threads"""
+        nthreads = blz.defaults.nthreads
+        blz.defaults.nthreads = 4
+        try:
+            self.check(np.random.rand(3001, 3))
+        finally:
+            blz.defaults.nthreads = nthreads
+
+class reductions_memoryTest(reductionsTest, TestCase):
+    pass
+
+class reductions_diskTest(reductionsTest, TestCase):
+    disk = True
+
+
 class arangeTest(object):
 
     def test00(self):
@@ -1996,6 +2338,455 @@ class bloscCompressorsTest(MayBeDiskTest, TestCase):
             # Remove the array on disk before trying with the next one
             common.remove_tree(self.rootdir)
 
+    def test02(self):
+        """Testing the 'auto' compressor with different objectives"""
+        # A constant run followed by noise
+        a = np.concatenate((np.ones(20000), np.random.rand(20000)))
+        for objective in ('ratio', 'speed', 1.5):
+            bparams = blz.bparams(cname='auto', objective=objective)
+            b = blz.barray(a, chunklen=5000, bparams=bparams,
+                           rootdir=self.rootdir, mode='w')
+            self.assertEqual(b.bparams.cname, b'auto')
+            assert_array_equal(a, b[:], "Arrays are not equal")
+            complibs = set(b.chunks[i].complib for i in range(b.nchunks))
+            self.assertTrue(None not in complibs or not self.disk)
+        # The best ratio is never worse than any single compressor
+        b = blz.barray(a, chunklen=5000, bparams=blz.bparams(cname='auto'))
+        for cname in blz.blosc_compressor_list():
+            c = blz.barray(a, chunklen=5000, bparams=blz.bparams(cname=cname))
+            self.assertTrue(b.cbytes <= c.cbytes * 1.05, cname)
+        self.assertRaises(ValueError, blz.bparams, objective='fast')
+        self.assertRaises(ValueError, blz.bparams, objective=0.5)
+
+    def test03(self):
+        """Testing compressed splits as large as the original ones"""
+        # zlib used to give splits of the same size than the input here
+        a = np.linspace(-1., 1., 1e4 + 7)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir,
+                       bparams=blz.bparams(clevel=9, cname='zlib'))
+        assert_array_equal(a, b[:], "Arrays are not equal")
+
+
+class prefilterTest(MayBeDiskTest, TestCase):
+
+    def test00(self):
+        """Testing that prefilters are reversible"""
+        for dtype in ('i1', 'i2', 'u4', 'i8', 'M8[s]', 'f4', 'f8', 'S3'):
+            a = ((np.arange(1e4 + 7) * 7) % 1000 - 500).astype(dtype)
+            for prefilter in ('delta', 'for', 'xor'):
+                b = blz.barray(a, chunklen=1000, rootdir=self.rootdir,
+                               mode='w',
+                               bparams=blz.bparams(prefilter=prefilter))
+                msg = "%s, %s" % (dtype, prefilter)
+                self.assertEqual(b.bparams.prefilter, prefilter)
+                assert_array_equal(a, b[:], msg)
+                self.assertEqual(a[5555], b[5555], msg)
+                assert_array_equal(a[1234:3456], b[1234:3456], msg)
+                assert_array_equal(a[3:9000:7], b[3:9000:7], msg)
+                assert_array_equal(a[[3, 8001, 1000]], b[[3, 8001, 1000]],
+                                   msg)
+                self.assertEqual(a[-1], b[-1], msg)
+        self.assertRaises(ValueError, blz.bparams, prefilter='rle')
+
+    def test01(self):
+        """Testing modifications of prefiltered barrays"""
+        a = np.cumsum(np.arange(1e4, dtype='i8') % 13)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir,
+                       bparams=blz.bparams(prefilter='delta'))
+        c = blz.barray(a, chunklen=1000)
+        # Small steps between items compress better as deltas
+        self.assertTrue(b.cbytes < c.cbytes)
+        b[2000:2010] = -1
+        a[2000:2010] = -1
+        b.append(a[:2500])
+        a = np.concatenate((a, a[:2500]))
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        b.trim(300)
+        assert_array_equal(a[:-300], b[:], "Arrays are not equal")
+        d = b.copy(bparams=blz.bparams(prefilter='for'))
+        self.assertEqual(d.bparams.prefilter, 'for')
+        assert_array_equal(a[:-300], d[:], "Arrays are not equal")
+
+    def test03(self):
+        """Testing prefilters on multidimensional barrays"""
+        a = np.arange(3000, dtype='i8').reshape(1000, 3) * 7 % 1000
+        for dtype in ('i8', 'f8'):
+            a = a.astype(dtype)
+            for prefilter in ('delta', 'for', 'xor'):
+                b = blz.barray(a, chunklen=100, rootdir=self.rootdir,
+                               mode='w',
+                               bparams=blz.bparams(prefilter=prefilter))
+                msg = "%s, %s" % (dtype, prefilter)
+                assert_array_equal(a, b[:], msg)
+                assert_array_equal(a[555], b[555], msg)
+                assert_array_equal(a[123:345], b[123:345], msg)
+                assert_array_equal(a[-5:], b[-5:], msg)
+
+class prefilterDiskTest(prefilterTest):
+    disk = True
+
+    def test02(self):
+        """Testing that prefilters are persistent"""
+        a = np.linspace(0, 1, 10007)
+        for storage in ('files', 'packed'):
+            b = blz.barray(a, chunklen=1000, rootdir=self.rootdir,
+                           mode='w', storage=storage,
+                           bparams=blz.bparams(prefilter='xor'))
+            b.flush()
+            b = blz.open(rootdir=self.rootdir)
+            self.assertEqual(b.bparams.prefilter, 'xor')
+            assert_array_equal(a, b[:], "Arrays are not equal")
+            assert_array_equal(a[9995:], b[9995:], "Arrays are not equal")
+            b.append([2.])
+            self.assertEqual(b[-1], 2.)
+
+
+class constantTest(MayBeDiskTest, TestCase):
+
+    def test00(self):
+        """Testing chunks made of a repeated value"""
+        a = np.zeros(10007, dtype='i4')
+        a[3000:5000] = 7
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        # Constant chunks keep a single item (and a trailer on disk)
+        for nchunk in (0, 3, 9):
+            self.assertTrue(b.chunks[nchunk].cdbytes <= 64)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        assert_array_equal(a[2990:3010], b[2990:3010])
+        self.assertEqual(b.sum(), a.sum())
+        self.assertEqual(b.count_nonzero(), 2000)
+        c = blz.eval("b == 7", rootdir=self.rootdir + '_eval'
+                     if self.disk else None)
+        assert_array_equal(np.flatnonzero(a == 7), list(c.wheretrue()))
+        assert_array_equal(a[a == 7], list(b.where(c)))
+        if self.disk:
+            common.remove_tree(self.rootdir + '_eval')
+
+    def test01(self):
+        """Testing modifications of constant chunks"""
+        a = np.ones(5000, dtype='f8')
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        b[1500] = 2.
+        a[1500] = 2.
+        b.append(np.ones(600))
+        a = np.concatenate((a, np.ones(600)))
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assertEqual(b.sum(), a.sum())
+        self.assertTrue(b.chunks[1].cdbytes > 64)
+
+class constantDiskTest(constantTest):
+    disk = True
+
+    def test02(self):
+        """Testing that constant chunks are persistent"""
+        a = np.array([b'abc'] * 2500 + [b'xyz'] * 2555, dtype='S3')
+        for storage in ('files', 'packed'):
+            b = blz.barray(a, chunklen=500, rootdir=self.rootdir,
+                           mode='w', storage=storage)
+            b.flush()
+            b = blz.open(rootdir=self.rootdir)
+            self.assertTrue(b.chunks[2].cdbytes <= 64)
+            assert_array_equal(a, b[:], "Arrays are not equal")
+            self.assertEqual(b[-1], b'xyz')
+            c = b.copy(rootdir=self.rootdir + '_copy', mode='w')
+            assert_array_equal(a, c[:], "Arrays are not equal")
+            common.remove_tree(self.rootdir + '_copy')
+
+    def test03(self):
+        """Testing that newer format versions are rejected"""
+        b = blz.barray(np.arange(10), rootdir=self.rootdir)
+        storagef = os.path.join(self.rootdir, 'meta', 'storage')
+        with open(storagef, 'rb') as storagefh:
+            meta = json.loads(storagefh.read().decode('ascii'))
+        self.assertEqual(meta['format'], blz.blz_ext.STORAGE_FORMAT)
+        # Containers without a format version are readable
+        del meta['format']
+        with open(storagef, 'wb') as storagefh:
+            storagefh.write(json.dumps(meta).encode('ascii'))
+        assert_array_equal(blz.open(rootdir=self.rootdir)[:], np.arange(10))
+        meta['format'] = blz.blz_ext.STORAGE_FORMAT + 1
+        with open(storagef, 'wb') as storagefh:
+            storagefh.write(json.dumps(meta).encode('ascii'))
+        self.assertRaises(IOError, blz.open, rootdir=self.rootdir)
+
+
+class packedTest(MayBeDiskTest, TestCase):
+    disk = True
+
+    def test00(self):
+        """Testing that packed storage keeps a handful of files"""
+        a = np.arange(1e4)
+        b = blz.barray(a, chunklen=100, rootdir=self.rootdir,
+                       storage='packed')
+        self.assertEqual(b.storage, 'packed')
+        datafiles = os.listdir(os.path.join(self.rootdir, 'data'))
+        self.assertTrue(len(datafiles) <= 3, datafiles)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+
+    def test01(self):
+        """Testing reopening a packed barray"""
+        a = np.arange(1e3 + 33)
+        b = blz.barray(a, chunklen=100, rootdir=self.rootdir,
+                       storage='packed')
+        b = blz.open(rootdir=self.rootdir, mode='r')
+        self.assertEqual(b.storage, 'packed')
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assertEqual(a[555], b[555])
+
+    def test02(self):
+        """Testing appending, setting and trimming a packed barray"""
+        a = np.arange(1e3)
+        b = blz.barray(a, chunklen=100, rootdir=self.rootdir,
+                       storage='packed')
+        b.append(np.arange(50))
+        b[250:260] = -1
+        b[1005] = 12345.
+        b.trim(120)
+        b.flush()
+        a = np.concatenate((a, np.arange(50)))
+        a[250:260] = -1
+        a[1005] = 12345.
+        a = a[:-120]
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        b = blz.open(rootdir=self.rootdir)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        b.append(np.arange(1000))
+        b.flush()
+        a = np.concatenate((a, np.arange(1000)))
+        b = blz.open(rootdir=self.rootdir)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+
+    def test03(self):
+        """Testing that copies keep the packed storage"""
+        a = np.arange(1e3)
+        b = blz.barray(a, chunklen=100, rootdir=self.rootdir,
+                       storage='packed')
+        c = b.copy(rootdir=self.rootdir + '-copy')
+        self.assertEqual(c.storage, 'packed')
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test04(self):
+        """Testing a bad value for storage"""
+        self.assertRaises(ValueError, blz.barray, [1, 2, 3],
+                          rootdir=self.rootdir, storage='foo')
+
+    def test05(self):
+        """Testing that recompress() gives back the space of packed chunks"""
+        a = np.arange(2e5 + 7) % 1000
+        sizes = {}
+        for storage in ('files', 'packed'):
+            rootdir = self.rootdir + '-' + storage
+            b = blz.barray(a, chunklen=1000, rootdir=rootdir,
+                           bparams=blz.bparams(9, cname='zlib'),
+                           storage=storage)
+            b.attrs['note'] = 'kept'
+            b.recompress(blz.bparams(0))
+            b.recompress(blz.bparams(9, cname='zlib'))
+            assert_array_equal(a, b[:], "Arrays are not equal")
+            b.append([1., 2.])
+            b.flush()
+            datadir = os.path.join(rootdir, 'data')
+            sizes[storage] = sum(os.path.getsize(os.path.join(datadir, f))
+                                 for f in os.listdir(datadir))
+            b = blz.open(rootdir=rootdir)
+            self.assertEqual(b.storage, storage)
+            self.assertEqual(b.bparams.cname, b'zlib')
+            self.assertEqual(b.attrs['note'], 'kept')
+            assert_array_equal(np.concatenate((a, [1., 2.])), b[:])
+            common.remove_tree(rootdir)
+        self.assertTrue(sizes['packed'] < 1.1 * sizes['files'], sizes)
+
+
+class mmapTest(MayBeDiskTest, TestCase):
+    disk = True
+    storage = 'files'
+
+    def test00(self):
+        """Testing reads of a barray opened in 'r' mode"""
+        a = np.arange(1e4 + 17)
+        blz.barray(a, chunklen=1000, rootdir=self.rootdir,
+                   storage=self.storage)
+        b = blz.open(rootdir=self.rootdir, mode='r')
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        assert_array_equal(a[999:3001:7], b[999:3001:7],
+                           "Arrays are not equal")
+        self.assertEqual(a[5555], b[5555])
+        self.assertEqual(sum(a), sum(b))
+        blocks = list(blz.iterblocks(b, blen=700))
+        assert_array_equal(a, np.concatenate(blocks), "Arrays are not equal")
+
+    def test01(self):
+        """Testing that chunks outlive their read-only barray"""
+        a = np.arange(1e3)
+        blz.barray(a, chunklen=100, rootdir=self.rootdir,
+                   storage=self.storage)
+        b = blz.open(rootdir=self.rootdir, mode='r')
+        chunk_ = b.chunks[3]
+        del b
+        assert_array_equal(a[300:400], chunk_[:], "Arrays are not equal")
+
+    def test02(self):
+        """Testing that 'r' mode still forbids modifications"""
+        a = np.arange(1e3)
+        blz.barray(a, chunklen=100, rootdir=self.rootdir,
+                   storage=self.storage)
+        b = blz.open(rootdir=self.rootdir, mode='r')
+        self.assertRaises(IOError, b.__setitem__, 1, 0)
+        self.assertRaises(IOError, b.append, [1, 2])
+
+class mmapPackedTest(mmapTest):
+    storage = 'packed'
+
+
+class cacheTest(MayBeDiskTest, TestCase):
+
+    def setUp(self):
+        MayBeDiskTest.setUp(self)
+        self.oldsize = blz.set_cache_size(8*2**20)
+
+    def tearDown(self):
+        blz.set_cache_size(self.oldsize)
+        MayBeDiskTest.tearDown(self)
+
+    def test00(self):
+        """Testing that random accesses hit the cache"""
+        a = np.arange(1e5)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        idx = np.random.randint(0, len(a), 1000)
+        [b[i] for i in idx]
+        info = blz.cache_info()
+        for i in idx:
+            self.assertEqual(a[i], b[i])
+        info2 = blz.cache_info()
+        self.assertTrue(info2['hits'] - info['hits'] >= len(idx))
+        self.assertTrue(0 < info2['size'] <= info2['maxsize'])
+
+    def test01(self):
+        """Testing that modifications invalidate the cache"""
+        a = np.arange(1e4)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        self.assertEqual(b[1234], a[1234])
+        b[1234] = -1
+        self.assertEqual(b[1234], -1)
+        b[1000:2000] = 3
+        self.assertEqual(b[1234], 3)
+        b.trim(9000)
+        b.append(np.arange(1000, 2000))
+        self.assertEqual(b[1234], 1234)
+
+    def test02(self):
+        """Testing a disabled cache"""
+        a = np.arange(1e4)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        blz.set_cache_size(0)
+        self.assertEqual(blz.cache_info()['size'], 0)
+        self.assertEqual(b[4321], a[4321])
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assertEqual(blz.cache_info()['entries'], 0)
+        self.assertRaises(ValueError, blz.set_cache_size, -1)
+
+    def test03(self):
+        """Testing that the cache keeps within its size"""
+        a = np.arange(1e5)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        blz.set_cache_size(10000)
+        for i in range(0, len(a), 997):
+            self.assertEqual(a[i], b[i])
+        self.assertTrue(blz.cache_info()['size'] <= 10000)
+        b.free_cachemem()
+
+    def test04(self):
+        """Testing that modifications give back the cache of stale blocks"""
+        a = np.arange(1e4)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        for modify in (lambda: b.__setitem__(5, -1), lambda: b.trim(1500)):
+            for i in range(0, len(b), 1000):
+                self.assertEqual(b[i], a[i])
+            entries = blz.cache_info()['entries']
+            modify()
+            self.assertTrue(blz.cache_info()['entries'] <= entries - 5)
+        b.free_cachemem()
+
+class cacheDiskTest(cacheTest):
+    disk = True
+
+
+class parallelTest(MayBeDiskTest, TestCase):
+
+    def setUp(self):
+        MayBeDiskTest.setUp(self)
+        self.nthreads = blz.defaults.nthreads
+        blz.defaults.nthreads = 4
+
+    def tearDown(self):
+        blz.defaults.nthreads = self.nthreads
+        MayBeDiskTest.tearDown(self)
+
+    def test00(self):
+        """Testing creation with several threads"""
+        a = np.arange(1e5 + 7)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assertEqual(b.nchunks, 100)
+
+    def test01(self):
+        """Testing appends with several threads"""
+        a = np.arange(1e5 + 7)
+        b = blz.barray(a[:333], chunklen=1000, rootdir=self.rootdir)
+        b.append(a[333:50000])
+        b.append(a[50000:])
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assertEqual(b.sum(), a.sum())
+
+    def test02(self):
+        """Testing a bad number of threads"""
+        def setnthreads(value):
+            blz.defaults.nthreads = value
+        self.assertRaises(ValueError, setnthreads, 0)
+
+    def test03(self):
+        """Testing that changing the number of threads replaces the pool"""
+        a = np.arange(1e5 + 7)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        pool = blz.utils.thread_pool(4)
+        blz.defaults.nthreads = 3
+        b.append(a)
+        self.assertTrue(blz.utils.thread_pool(3) is not pool)
+        self.assertEqual(blz.utils._pools['chunks'][0], 3)
+        # The old pool has been closed, so its threads can be joined
+        pool.join()
+        assert_array_equal(np.concatenate((a, a)), b[:],
+                           "Arrays are not equal")
+
+class parallelDiskTest(parallelTest):
+    disk = True
+
+class compressorThreadsTest(TestCase):
+
+    def compress(self, cname, chunks):
+        a = np.arange(1e4)
+        for i in range(50):
+            chunks.append(chunk(a, atom=a.dtype,
+                                bparams=blz.bparams(cname=cname)))
+
+    def test00(self):
+        """Testing compressors selected concurrently from several threads"""
+        # The compressor format lives in the upper bits of the flags
+        formats = {'blosclz': 0, 'zlib': 3}
+        results = dict((cname, []) for cname in formats)
+        threads = [threading.Thread(target=self.compress,
+                                    args=(cname, results[cname]))
+                   for cname in formats]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for cname, chunks in results.items():
+            self.assertEqual(len(chunks), 50)
+            for b in chunks:
+                flags = ord(b.getdata()[2:3])
+                self.assertEqual(flags >> 5, formats[cname])
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
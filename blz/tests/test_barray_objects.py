@@ -13,6 +13,9 @@ Notes on object handling:
 """
 
 from unittest import TestCase
+import os.path
+import pickle
+import json
 
 import numpy as np
 import blz
@@ -118,9 +121,113 @@ class ObjectBarrayTest(MayBeDiskTest, TestCase):
             self.assertEqual(carr[i][1], src_data[i][1])
 
 
+    def test_barray_batched(self):
+        """Testing that objects are pickled many per chunk"""
+        src_data = [{'n': i, 's': 's'*(i % 7)} for i in range(1000)]
+        carr = blz.barray(src_data, dtype=np.dtype('O'), chunklen=64,
+                          rootdir=self.rootdir)
+        self.assertEqual(len(carr), 1000)
+        self.assertEqual(carr.nchunks, 1000 // 64)
+        self.assertEqual(list(carr[60:200:3]), src_data[60:200:3])
+        self.assertEqual(carr[-1], src_data[-1])
+        self.assertEqual(list(carr[[999, 3, 640, 3]]),
+                         [src_data[i] for i in (999, 3, 640, 3)])
+        self.assertEqual(list(carr.iter(5, 700, 9)), src_data[5:700:9])
+        mask = np.arange(1000) % 5 == 0
+        self.assertEqual(list(carr[mask]), src_data[::5])
+
+    def test_barray_append(self):
+        """Testing appends, modifications and trims of objects"""
+        src_data = np.empty(100, dtype=np.object_)
+        src_data[:] = [(i, 's'*i) for i in range(100)]
+        carr = blz.barray(src_data[:10], chunklen=16, rootdir=self.rootdir)
+        carr.append(src_data[10:])
+        # Anything but an array of objects is appended as one object
+        carr.append((100, 'last'))
+        self.assertEqual(len(carr), 101)
+        self.assertEqual(carr[100], (100, 'last'))
+        self.assertEqual(list(carr[:100]), list(src_data))
+        carr[50] = 'fifty'
+        carr[[20, 99]] = ['twenty', 'ninety-nine']
+        self.assertEqual(list(carr[[20, 50, 99]]),
+                         ['twenty', 'fifty', 'ninety-nine'])
+        carr.trim(30)
+        self.assertEqual(len(carr), 71)
+        self.assertEqual(carr[-1], src_data[70])
+        carr.resize(75)
+        self.assertEqual(list(carr[-4:]), [0] * 4)
+        ccopy = carr.copy(chunklen=10)
+        self.assertEqual(ccopy.nchunks, 7)
+        self.assertEqual(ccopy[50], 'fifty')
+
+
 class ObjectBarrayDiskTest(ObjectBarrayTest):
     disk = True
 
+    def test_barray_reopen(self):
+        """Testing that batched objects are persistent"""
+        src_data = ['s'*i for i in range(100)]
+        carr = blz.barray(src_data, dtype=np.dtype('O'), chunklen=16,
+                          rootdir=self.rootdir)
+        carr.append('last')
+        carr.flush()
+        datadir = os.path.join(self.rootdir, 'data')
+        self.assertEqual(len(os.listdir(datadir)), 7)
+        carr = blz.open(rootdir=self.rootdir)
+        self.assertEqual(list(carr), src_data + ['last'])
+        carr.append('more')
+        self.assertEqual(list(carr[-3:]), src_data[-1:] + ['last', 'more'])
+
+    def test_barray_oneobj(self):
+        """Testing barrays with an object per chunk (BLZ <= 0.6.2)"""
+        src_data = [(i, 's'*i) for i in range(10)]
+        carr = blz.barray(src_data, dtype=np.dtype('O'), chunklen=1,
+                          rootdir=self.rootdir)
+        # Rewrite the chunks and the metadata in the old layout
+        datadir = os.path.join(self.rootdir, 'data')
+        for i, obj in enumerate(src_data):
+            chunkfile = os.path.join(datadir, '__%d.blp' % i)
+            with open(chunkfile, 'rb') as chunkfh:
+                header = chunkfh.read(16)
+            data = np.frombuffer(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL),
+                                 dtype=np.uint8)
+            chunk_ = blz.blz_ext.chunk(data, data.dtype, blz.bparams(),
+                                       _memory=False)
+            with open(chunkfile, 'wb') as chunkfh:
+                chunkfh.write(header + chunk_.getdata())
+        storagef = os.path.join(self.rootdir, 'meta', 'storage')
+        with open(storagef, 'rb') as storagefh:
+            meta = json.loads(storagefh.read().decode('ascii'))
+        del meta['objbatch']
+        meta['chunklen'] = 4
+        with open(storagef, 'wb') as storagefh:
+            storagefh.write(json.dumps(meta).encode('ascii'))
+        # The old layout is kept, whatever the mode
+        for mode in ('r', 'a'):
+            carr = blz.open(rootdir=self.rootdir, mode=mode)
+            self.assertEqual(carr.chunklen, 1)
+            self.assertEqual(list(carr), src_data)
+        self.assertEqual(len(os.listdir(datadir)), 10)
+        # ... and modifications keep it too
+        carr.append('more')
+        carr[3] = 'three'
+        src_data += ['more']
+        src_data[3] = 'three'
+        carr.flush()
+        carr = blz.open(rootdir=self.rootdir, mode='r')
+        self.assertEqual(list(carr), src_data)
+        self.assertEqual(len(os.listdir(datadir)), 11)
+        # Objects are batched only on request
+        carr = blz.open(rootdir=self.rootdir, mode='a')
+        carr.attrs['note'] = 'kept'
+        carr.batch_objects()
+        self.assertEqual(carr.chunklen, 4)
+        self.assertEqual(list(carr), src_data)
+        self.assertEqual(len(os.listdir(datadir)), 3)
+        carr = blz.open(rootdir=self.rootdir, mode='r')
+        self.assertEqual(list(carr[2:9]), src_data[2:9])
+        self.assertEqual(carr.attrs['note'], 'kept')
+
 
 
 ## Local Variables:
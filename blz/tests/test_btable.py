@@ -9,6 +9,7 @@
 from __future__ import absolute_import
 
 import sys
+import os, os.path
 
 import numpy as np
 from numpy.testing import (
@@ -212,6 +213,26 @@ class persistentTest(MayBeDiskTest, TestCase):
         self.assertRaises(IOError, blz.btable, (a, b), ('f0', 'f1'),
                           rootdir=self.rootdir, mode='a')
 
+    def test02(self):
+        """Testing btable with packed storage"""
+        N = 1000
+        a = blz.barray(np.arange(N, dtype='i4'))
+        b = blz.barray(np.arange(N, dtype='f8')+1)
+        t = blz.btable((a, b), ('f0', 'f1'), rootdir=self.rootdir,
+                       storage='packed', chunklen=64)
+        t.append((N, N+1.))
+        t.flush()
+        self.assertEqual(t.cols['f0'].storage, 'packed')
+        # Open t
+        t = blz.open(rootdir=self.rootdir, mode='r')
+        self.assertEqual(t.cols['f1'].storage, 'packed')
+        ra = np.rec.fromarrays([np.arange(N+1, dtype='i4'),
+                                np.arange(N+1, dtype='f8')+1])
+        assert_array_equal(t[:], ra.view(np.ndarray),
+                           "btable values are not correct")
+        self.assertEqual(sum(r.f1 for r in t.where('f0 > 990')),
+                         sum(range(992, N+2)))
+
 
 class add_del_colTest(MayBeDiskTest, TestCase):
 
@@ -438,6 +459,38 @@ class getitemTest(MayBeDiskTest, TestCase):
         assert_array_equal(t[colnames][:], ra2,
                            "btable values are not correct")
 
+    def test05(self):
+        """Testing __getitem__ with slices spanning several chunks"""
+        N = 1000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)), dtype='i4,f8,i8')
+        t = blz.btable(ra, chunklen=64, rootdir=self.rootdir)
+        for start, stop, step in ((0, N, 1), (10, 900, 1), (63, 65, 1),
+                                  (3, 999, 7), (950, N, 100), (5, 5, 1)):
+            assert_array_equal(t[start:stop:step], ra[start:stop:step],
+                               "btable values are not correct")
+        # String columns
+        s = np.array(['s%d' % i for i in xrange(N)], dtype='S8')
+        t2 = blz.btable((s, ra['f0']), ('s', 'n'), chunklen=64,
+                        rootdir=self.rootdir, mode='w')
+        r = t2[10:900:3]
+        assert_array_equal(r['s'], s[10:900:3])
+        assert_array_equal(r['n'], ra['f0'][10:900:3])
+
+    def test06(self):
+        """Testing todict()"""
+        N = 1000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)), dtype='i4,f8,i8')
+        t = blz.btable(ra, chunklen=64, rootdir=self.rootdir)
+        d = t.todict()
+        self.assertEqual(sorted(d), ['f0', 'f1', 'f2'])
+        for name in t.names:
+            assert_array_equal(d[name], ra[name])
+            self.assertTrue(d[name].flags.c_contiguous)
+        d = t.todict(3, 999, 7, outcols='f2, nrow__')
+        self.assertEqual(sorted(d), ['f2', 'nrow__'])
+        assert_array_equal(d['f2'], ra['f2'][3:999:7])
+        assert_array_equal(d['nrow__'], np.arange(3, 999, 7))
+
 class getitemDiskTest(getitemTest, TestCase):
     disk = True
 
@@ -685,6 +738,22 @@ class copyTest(MayBeDiskTest, TestCase):
         #print "cbytes in f1, f2:", t['f1'].cbytes, t2['f1'].cbytes
         self.assert_(t['f1'].cbytes < t2['f1'].cbytes, "clevel not changed")
 
+    def test04(self):
+        """Testing recompress()"""
+        N = 10*1000
+        ra = np.fromiter(((i, i**2.2) for i in xrange(N)), dtype='i4,f8')
+        t = blz.btable(ra, rootdir=self.rootdir)
+        cbytes = t['f1'].cbytes
+        t.recompress(blz.bparams(clevel=1))
+        self.assertEqual(t.bparams.clevel, 1)
+        self.assertEqual(t['f0'].bparams.clevel, 1)
+        self.assert_(t['f1'].cbytes > cbytes, "clevel not changed")
+        assert_array_equal(t[:], ra, "btable values are not correct")
+        if self.disk:
+            t = blz.open(rootdir=self.rootdir)
+            self.assertEqual(t['f1'].bparams.clevel, 1)
+            assert_array_equal(t[:], ra, "btable values are not correct")
+
 class copyDiskTest(copyTest, TestCase):
     disk = True
 
@@ -772,6 +841,16 @@ class fancy_indexing_getitemTest(TestCase):
         idx = np.array([1.1, 3.3], dtype='f8')
         self.assertRaises(IndexError, b.__getitem__, idx)
 
+    def test05(self):
+        """Testing fancy indexing (unsorted and repeated indices)"""
+        N = 1000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)), dtype='i4,f8,i8')
+        t = blz.btable(ra, chunklen=64)
+        idx = np.random.randint(N, size=500)
+        assert_array_equal(t[idx], ra[idx], "btable values are not correct")
+        assert_array_equal(t[list(idx)], ra[idx],
+                           "btable values are not correct")
+
 
 class fancy_indexing_setitemTest(TestCase):
 
@@ -859,6 +938,25 @@ class fancy_indexing_setitemTest(TestCase):
         #print "ra[%s] -> %r" % (sl, ra)
         assert_array_equal(t[:], ra, "btable values are not correct")
 
+    def test04(self):
+        """Testing fancy indexing (setitem) with scattered indices"""
+        N = 1000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)), dtype='i4,f8,i8')
+        t = blz.btable(ra, chunklen=10)
+        sl = np.random.randint(N, size=300)
+        t[sl] = (-1, -2, -3)
+        ra[sl] = (-1, -2, -3)
+        assert_array_equal(t[:], ra, "btable values are not correct")
+
+    def test05(self):
+        """Testing setitem with a condition"""
+        N = 1000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)), dtype='i4,f8,i8')
+        t = blz.btable(ra, chunklen=10)
+        t["f0 % 7 == 3"] = (-1, -2, -3)
+        ra[ra['f0'] % 7 == 3] = (-1, -2, -3)
+        assert_array_equal(t[:], ra, "btable values are not correct")
+
 class iterTest(MayBeDiskTest, TestCase):
 
     def test00(self):
@@ -949,6 +1047,32 @@ class iterTest(MayBeDiskTest, TestCase):
         #print "nl ->", nl
         self.assert_(cl == nl, "iter not working correctily")
 
+    def test08(self):
+        """Testing btable.iter() with as_blocks"""
+        N = 1000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)), dtype='i4,f8,i8')
+        t = blz.btable(ra, chunklen=64, rootdir=self.rootdir)
+        blocks = list(t.iter(as_blocks=True))
+        self.assertEqual([len(b) for b in blocks[:2]], [64, 64])
+        assert_array_equal(np.concatenate(blocks), ra)
+        blocks = list(t.iter(10, 900, 7, outcols='nrow__, f1', limit=100,
+                             skip=3, as_blocks=True))
+        r = np.concatenate(blocks)
+        self.assertEqual(r.dtype.names, ('nrow__', 'f1'))
+        assert_array_equal(r['nrow__'], np.arange(10, 900, 7)[3:103])
+        assert_array_equal(r['f1'], ra['f1'][10:900:7][3:103])
+        self.assertEqual(list(t.iter(5, 3, as_blocks=True)), [])
+
+    def test09(self):
+        """Testing btable.iter() across chunks (large steps)"""
+        N = 1000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)), dtype='i4,f8,i8')
+        t = blz.btable(ra, chunklen=16, rootdir=self.rootdir)
+        for start, stop, step in ((0, N, 1), (3, N, 5), (1, N - 1, 100)):
+            cl = [tuple(r) for r in t.iter(start, stop, step)]
+            nl = [tuple(r) for r in ra[start:stop:step]]
+            self.assertEqual(cl, nl)
+
 class iterDiskTest(iterTest, TestCase):
     disk = True
 
@@ -1324,6 +1448,357 @@ class where_largeDiskTest(whereTest, TestCase):
 
 
 # This test goes here until we would have a better place for it
+class groupbyTest(MayBeDiskTest, TestCase):
+
+    N = 10000
+
+    def setUp(self):
+        MayBeDiskTest.setUp(self)
+        N = self.N
+        ra = np.fromiter(((i % 7, i % 3, i * 0.5) for i in xrange(N)),
+                         dtype='i4,i8,f8')
+        self.ra = ra
+        self.t = blz.btable(ra, rootdir=self.rootdir)
+
+    def reference(self, keys, colname, op):
+        """Compute the aggregation per group with plain NumPy."""
+        res = {}
+        for key in set(self.ra[keys].tolist()):
+            vals = self.ra[colname][self.ra[keys] == key]
+            res[key] = getattr(np, op)(vals)
+        return res
+
+    def test00(self):
+        """Testing groupby() with a single key"""
+        r = self.t.groupby('f0', [('f2', 'sum'), ('f2', 'mean'),
+                                  ('f1', 'min'), ('f1', 'max')])
+        self.assertEqual(r.names,
+                         ['f0', 'f2_sum', 'f2_mean', 'f1_min', 'f1_max'])
+        self.assertEqual(len(r), 7)
+        assert_array_equal(r['f0'][:], np.arange(7))
+        for colname, op in (('f2', 'sum'), ('f2', 'mean'),
+                            ('f1', 'min'), ('f1', 'max')):
+            ref = self.reference('f0', colname, op)
+            assert_allclose(r['%s_%s' % (colname, op)][:],
+                            [ref[k] for k in range(7)])
+
+    def test01(self):
+        """Testing groupby() with the default aggregation (count)"""
+        r = self.t.groupby('f1')
+        self.assertEqual(r.names, ['f1', 'count'])
+        assert_array_equal(r['f1'][:], [0, 1, 2])
+        assert_array_equal(r['count'][:], np.bincount(self.ra['f1']))
+        self.assertEqual(r['count'].dtype, np.int64)
+
+    def test02(self):
+        """Testing groupby() with several keys"""
+        r = self.t.groupby(['f0', 'f1'], [('f2', 'sum', 'total')])
+        self.assertEqual(r.names, ['f0', 'f1', 'total'])
+        self.assertEqual(len(r), 21)
+        for row in r:
+            sel = (self.ra['f0'] == row.f0) & (self.ra['f1'] == row.f1)
+            self.assertEqual(row.total, self.ra['f2'][sel].sum())
+
+    def test03(self):
+        """Testing groupby() spilling groups to disk"""
+        t = blz.btable(self.ra, chunklen=100)
+        r = t.groupby(['f0', 'f1'], [('f2', 'max'), (None, 'count')],
+                      memlimit=500)
+        r2 = t.groupby(['f0', 'f1'], [('f2', 'max'), (None, 'count')])
+        self.assertEqual(len(r), 21)
+        self.assertEqual(sorted(r[:].tolist()), r2[:].tolist())
+        self.assertEqual(r['count'].sum(), self.N)
+
+    def test04(self):
+        """Testing groupby() on an empty table"""
+        t = blz.btable(self.ra[:0])
+        for memlimit in (None, 0):
+            r = t.groupby('f0', [('f2', 'sum')], memlimit=memlimit)
+            self.assertEqual(len(r), 0)
+            self.assertEqual(r.names, ['f0', 'f2_sum'])
+            self.assertEqual(r['f2_sum'].dtype, np.float64)
+        names, blocks = blz.groupby.groupby(t, ['f0', 'f1'], memlimit=0)
+        self.assertEqual([len(cols[0]) for cols in blocks], [0])
+
+    def test05(self):
+        """Testing groupby() with bad arguments"""
+        self.assertRaises(ValueError, self.t.groupby, 'x')
+        self.assertRaises(ValueError, self.t.groupby, 'f0', [('x', 'sum')])
+        self.assertRaises(ValueError, self.t.groupby, 'f0', [('f1', 'std')])
+        self.assertRaises(ValueError, self.t.groupby, 'f0', [(None, 'sum')])
+
+    def test06(self):
+        """Testing groupby() with string keys"""
+        t = blz.btable([np.array(['a', 'b', 'a', 'c', 'b'] * 100),
+                        np.arange(500)], names=['k', 'v'])
+        r = t.groupby('k', [('v', 'sum')])
+        self.assertEqual(r['k'][:].tolist(), [b'a', b'b', b'c'])
+        assert_array_equal(r['v_sum'][:], [
+            np.arange(500)[t['k'][:] == k].sum() for k in (b'a', b'b', b'c')])
+
+class groupbyDiskTest(groupbyTest):
+    disk = True
+
+
+class indexTest(MayBeDiskTest, TestCase):
+
+    N = 10000
+
+    def setUp(self):
+        MayBeDiskTest.setUp(self)
+        N = self.N
+        self.ra = np.fromiter(((i * 7 % N, i * 0.5) for i in xrange(N)),
+                              dtype='i8,f8')
+        self.t = blz.btable(self.ra, chunklen=1000, rootdir=self.rootdir)
+        self.t.create_index('f0')
+
+    def check(self, expr, t=None):
+        """Check that `expr` gives the same results with the index."""
+        t = self.t if t is None else t
+        noindex = blz.btable(t[:])
+        assert_array_equal(t[expr], noindex[expr])
+        self.assertEqual(list(t.where(expr, outcols='nrow__, f1', skip=2,
+                                      limit=5)),
+                         list(noindex.where(expr, outcols='nrow__, f1',
+                                            skip=2, limit=5)))
+
+    def test00(self):
+        """Testing point and range lookups with a sorted index"""
+        for expr in ('f0 == 1234', 'f0 < 10', '5 >= f0', 'f0 > 9990',
+                     '(10 <= f0) & (f0 < 20)', '(f0 > 20) & (f0 < 10)',
+                     '(f0 > 100) & (f0 <= 110) & (f0 >= 105)',
+                     'f0 == -1', '(f0 < 3) | (f0 > 9996)'):
+            self.check(expr)
+
+    def test01(self):
+        """Testing that the index is used"""
+        rows = blz.indexes.index_rows(self.t, 'f0 == 1234')
+        assert_array_equal(rows, np.where(self.ra['f0'] == 1234)[0])
+        self.assertTrue(blz.indexes.index_rows(self.t, 'f0 != 3') is None)
+        self.assertTrue(blz.indexes.index_rows(self.t, 'f1 < 3') is None)
+        self.assertTrue(
+            blz.indexes.index_rows(self.t, '(f0 < 3) & (f1 < 3)') is None)
+
+    def test02(self):
+        """Testing index maintenance on append"""
+        t = self.t
+        for i in range(blz.indexes.MAXRUNS + 2):
+            t.append(self.ra[:100])
+            self.check('f0 < 20')
+        self.assertTrue(len(t.indexes['f0'].runs) <= blz.indexes.MAXRUNS)
+
+    def test03(self):
+        """Testing index maintenance on modifications"""
+        t = self.t
+        t[3] = (-5, 0.)
+        self.check('f0 < 0')
+        t.trim(10)
+        self.check('f0 < 10')
+        t['f0 == 1234'] = (-7, 1.)
+        self.check('f0 < 0')
+
+    def test04(self):
+        """Testing indexes with NaNs"""
+        ra = self.ra.copy()
+        ra['f1'][::3] = np.nan
+        t = blz.btable(ra, rootdir=self.rootdir, mode='w')
+        t.create_index('f1')
+        self.check('f1 > 4000.2', t)
+        self.check('f1 <= 7.5', t)
+
+    def test05(self):
+        """Testing whereblocks() with an index"""
+        blocks = list(blz.whereblocks(self.t, 'f0 < 50', blen=7))
+        self.assertEqual(sum(len(b) for b in blocks), 50)
+
+    def test06(self):
+        """Testing errors and removal of indexes"""
+        t = self.t
+        self.assertRaises(ValueError, t.create_index, 'f0')
+        self.assertRaises(ValueError, t.create_index, 'x')
+        self.assertRaises(ValueError, t.create_index, 'f1', kind='x')
+        t.drop_index('f0')
+        self.assertEqual(t.indexes, {})
+        self.assertRaises(ValueError, t.drop_index, 'f0')
+        t.create_index('f1')
+        t.delcol('f1')
+        self.assertEqual(t.indexes, {})
+
+    def test08(self):
+        """Testing incremental index updates"""
+        t = self.t
+        index = t.indexes['f0']
+        t[[5, 1, 5]] = (-3, 0.)
+        t[7:10] = (-4, 0.)
+        t[np.arange(self.N) == 20] = (-5, 0.)
+        # The modified rows went to new runs, no rebuilds
+        self.assertEqual(len(index.runs), 4)
+        self.check('f0 < 0')
+        self.check('(f0 >= 0) & (f0 < 30)')
+        t.resize(self.N - 5)
+        self.check('f0 > 9980')
+        t.resize(self.N + 5)
+        self.check('f0 == 0')
+        t.trim(3)
+        self.check('f0 < 10')
+
+    def test09(self):
+        """Testing that direct column writes do not leave indexes stale"""
+        t = self.t
+        t.cols['f0'][3] = 999999
+        self.assertEqual(len(list(t.where('f0 == 999999'))), 1)
+        self.check('f0 == 999999')
+        self.check('f0 == 21')
+
+class indexDiskTest(indexTest):
+    disk = True
+
+    def test07(self):
+        """Testing that indexes are persistent"""
+        self.t.flush()
+        t = blz.open(rootdir=self.rootdir)
+        self.assertEqual(list(t.indexes.keys()), ['f0'])
+        self.check('f0 == 1234', t)
+
+    def test10(self):
+        """Testing that index updates are persistent"""
+        self.t[3:6] = (-1, 0.)
+        self.t.trim(5)
+        self.t.flush()
+        t = blz.open(rootdir=self.rootdir)
+        self.check('f0 < 10', t)
+        self.check('f0 > 9990', t)
+
+
+class bitmapIndexTest(MayBeDiskTest, TestCase):
+
+    N = 10000
+
+    def setUp(self):
+        MayBeDiskTest.setUp(self)
+        N = self.N
+        self.ra = np.fromiter(((i % 13, i * 0.5, b'abcde'[i % 5:i % 5 + 1])
+                               for i in xrange(N)), dtype='i4,f8,S1')
+        self.t = blz.btable(self.ra, chunklen=1000, rootdir=self.rootdir)
+        self.t.create_index('f0', kind='bitmap')
+        self.t.create_index('f2', kind='bitmap')
+
+    def check(self, expr, t=None):
+        """Check that `expr` gives the same results with the index."""
+        t = self.t if t is None else t
+        self.assertTrue(blz.indexes.index_rows(t, expr) is not None)
+        noindex = blz.btable(t[:])
+        result, expected = t[expr], noindex[expr]
+        for name in t.names:
+            # Compare column-wise, where NaNs compare equal
+            assert_array_equal(result[name], expected[name])
+        self.assertEqual(list(t.where(expr, outcols='nrow__, f0', skip=2,
+                                      limit=5)),
+                         list(noindex.where(expr, outcols='nrow__, f0',
+                                            skip=2, limit=5)))
+
+    def test00(self):
+        """Testing equality, inequality and membership with bitmaps"""
+        for expr in ('f0 == 3', 'f0 != 3', '3 != f0', 'f0 == 20',
+                     'f0 != 20', 'f0 in (1, 5, 20)', 'f0 not in [1, 5]',
+                     'f0 < 4', '(f0 >= 4) & (f0 <= 6)', "f2 == 'c'",
+                     "f2 in ('a', 'e')", "(f0 == 3) & (f2 != 'c')",
+                     "(f0 in (0, 1)) | (f2 == 'b')"):
+            self.check(expr)
+
+    def test01(self):
+        """Testing that membership tests work without indexes"""
+        t = blz.btable(self.ra)
+        assert_array_equal(t['f0 in (1, 5)'],
+                           self.ra[np.in1d(self.ra['f0'], [1, 5])])
+        assert_array_equal(t['(f0 not in (1, 5)) & (f1 < 100)'],
+                           self.ra[~np.in1d(self.ra['f0'], [1, 5]) &
+                                   (self.ra['f1'] < 100)])
+        # The left operand can be any expression
+        f0, f1 = self.ra['f0'], self.ra['f1']
+        for vm in ('python', 'numexpr'):
+            r = t.eval('f0 + f1 in (2, 4)', vm=vm)
+            self.assertEqual(r.dtype, np.bool_)
+            assert_array_equal(r, np.in1d(f0 + f1, [2, 4]))
+            r = t.eval('(-f0 * 2 not in (-2, -4)) & (f0 < 3)', vm=vm)
+            assert_array_equal(r, ~np.in1d(-f0 * 2, [-2, -4]) & (f0 < 3))
+        # Membership tests in string literals are left alone
+        assert_array_equal(t["f2 == 'f0 in (1, 2)'"], self.ra[:0])
+        assert_array_equal(t["(f2 == 'b') | (f0 in (1,))"],
+                           self.ra[(self.ra['f2'] == b'b') | (f0 == 1)])
+
+    def test02(self):
+        """Testing bitmap maintenance on appends and modifications"""
+        t = self.t
+        ra = self.ra[:2500].copy()
+        ra['f0'] += 10
+        t.append(ra)
+        self.check('f0 == 15')
+        self.check('f0 != 3')
+        t['f0 == 15'] = (-1, 0., b'z')
+        self.check('f0 in (-1, 15)')
+        self.check("f2 != 'z'")
+        t.trim(100)
+        self.check('f0 == -1')
+
+    def test03(self):
+        """Testing bitmap indexes with NaNs"""
+        ra = self.ra.copy()
+        ra['f1'] = ra['f0']
+        ra['f1'][::3] = np.nan
+        t = blz.btable(ra, rootdir=self.rootdir, mode='w')
+        t.create_index('f1', kind='bitmap')
+        self.assertEqual(len(t.indexes['f1'].bitmaps), 13)
+        self.check('f1 == 2', t)
+        self.check('f1 != 2', t)
+        self.check('f1 not in (2, 3)', t)
+
+    def test04(self):
+        """Testing that bitmaps are not built for many distinct values"""
+        # The limit is checked before adding the bitmaps of every block
+        added = []
+        add_bitmap = blz.indexes.bitmapindex._add_bitmap
+        def counting_add_bitmap(index, value, nrows):
+            added.append(value)
+            return add_bitmap(index, value, nrows)
+        blz.indexes.bitmapindex._add_bitmap = counting_add_bitmap
+        try:
+            self.assertRaises(ValueError, self.t.create_index, 'f1',
+                              kind='bitmap')
+        finally:
+            blz.indexes.bitmapindex._add_bitmap = add_bitmap
+        self.assertTrue(len(added) <= blz.indexes.MAXCARDINALITY)
+        self.assertEqual(sorted(self.t.indexes.keys()), ['f0', 'f2'])
+        if self.rootdir:
+            self.assertFalse(os.path.exists(
+                os.path.join(self.rootdir, '__indexes__', 'f1')))
+
+    def test06(self):
+        """Testing incremental bitmap updates and direct column writes"""
+        t = self.t
+        t[[1, 2]] = (42, 0., b'a')
+        self.assertEqual(len(t.indexes['f0'].bitmaps), 14)
+        self.check('f0 in (1, 2, 42)')
+        t.resize(self.N + 10)
+        self.check('f0 == 0')
+        t.resize(100)
+        self.check('f0 != 5')
+        t.cols['f0'][3] = 999999
+        self.assertEqual(len(list(t.where('f0 == 999999'))), 1)
+        self.check('f0 == 999999')
+
+class bitmapIndexDiskTest(bitmapIndexTest):
+    disk = True
+
+    def test05(self):
+        """Testing that bitmap indexes are persistent"""
+        self.t.flush()
+        t = blz.open(rootdir=self.rootdir)
+        self.assertEqual(t.indexes['f0'].kind, 'bitmap')
+        self.check('f0 in (2, 3)', t)
+        self.check("f2 != 'a'", t)
+
+
 class walkTest(MayBeDiskTest, TestCase):
     disk = True
     ncas = 3  # the number of barrays per level
@@ -0,0 +1,168 @@
+########################################################################
+#
+#       License: BSD
+#       Created: October 17, 2026
+#       Author:  Francesc Alted - francesc@continuum.io
+#
+########################################################################
+
+from __future__ import absolute_import
+
+import sys
+import os.path
+
+import numpy as np
+from numpy.testing import assert_array_equal
+import unittest
+from unittest import TestCase
+
+import blz
+from blz.dictarray import pushdown
+from blz.tests.common import MayBeDiskTest
+
+if sys.version_info >= (3, 0):
+    xrange = range
+
+
+class dictarrayTest(MayBeDiskTest, TestCase):
+
+    N = 10000
+
+    def setUp(self):
+        MayBeDiskTest.setUp(self)
+        words = np.array(['spam', 'eggs', 'ham', 'bacon', 'sausage'],
+                         dtype='S16')
+        self.a = words[(np.arange(self.N) * 7 // 3) % len(words)]
+
+    def test00(self):
+        """Testing dictarray creation and decoding"""
+        d = blz.dictarray(self.a, rootdir=self.rootdir)
+        self.assertEqual(len(d), self.N)
+        self.assertEqual(d.dtype, self.a.dtype)
+        self.assertEqual(len(d.values), 5)
+        self.assertEqual(d.codes.dtype, np.int32)
+        assert_array_equal(d[:], self.a)
+        assert_array_equal(d[10:100:7], self.a[10:100:7])
+        assert_array_equal(d[[3, 1, 2000]], self.a[[3, 1, 2000]])
+        self.assertEqual(d[-1], self.a[-1])
+        self.assertEqual(list(d.iter(3, 30, 4)), list(self.a[3:30:4]))
+        self.assertTrue(d.cbytes < self.a.nbytes / 4.)
+
+    def test01(self):
+        """Testing append(), __setitem__(), trim() and resize()"""
+        d = blz.dictarray(self.a, rootdir=self.rootdir)
+        a = self.a.copy()
+        d.append(['spam', 'toast'])
+        a = np.concatenate((a, np.array(['spam', 'toast'], dtype='S16')))
+        d[3:6] = 'beans'
+        a[3:6] = 'beans'
+        d[[7, 9]] = ['ham', 'jam']
+        a[[7, 9]] = ['ham', 'jam']
+        assert_array_equal(d[:], a)
+        self.assertEqual(len(d.values), 8)
+        d.trim(10)
+        d.resize(len(d) + 3)
+        a = np.concatenate((a[:-10], np.zeros(3, dtype='S16')))
+        assert_array_equal(d[:], a)
+
+    def test02(self):
+        """Testing copies and errors"""
+        d = blz.dictarray(self.a, rootdir=self.rootdir)
+        d2 = d.copy(chunklen=100)
+        self.assertEqual(d2.chunklen, 100)
+        assert_array_equal(d2[:], self.a)
+        self.assertRaises(TypeError, blz.dictarray, np.arange(10))
+
+    def test03(self):
+        """Testing dictarray columns in btables"""
+        d = blz.dictarray(self.a)
+        b = np.arange(self.N)
+        t = blz.btable((d, b), ('w', 'n'), rootdir=self.rootdir)
+        self.assertTrue(isinstance(t.cols['w'], blz.dictarray))
+        ra = np.rec.fromarrays((self.a, b), names='w,n')
+        assert_array_equal(t[:], ra)
+        assert_array_equal(t[5], ra[5])
+        t.append((np.array(['toast'], dtype='S16'), np.array([-1])))
+        self.assertEqual(tuple(t[-1]), (b'toast', -1))
+        self.assertEqual([r.n for r in t.where("w == 'toast'")], [-1])
+
+    def test04(self):
+        """Testing that comparisons are pushed down onto the codes"""
+        d = blz.dictarray(self.a)
+        t = blz.btable((d, np.arange(self.N)), ('w', 'n'),
+                       rootdir=self.rootdir)
+        ra = t[:]
+        for expr, expected in (
+            ("w == 'ham'", ra['w'] == b'ham'),
+            ("'ham' != w", ra['w'] != b'ham'),
+            ("w == 'toast'", ra['w'] == b'toast'),
+            ("w < 'f'", ra['w'] < b'f'),
+            ("'f' <= w", ra['w'] >= b'f'),
+            ("(w == 'ham') & (n < 100)", (ra['w'] == b'ham') &
+             (ra['n'] < 100)),
+            ("w in ('spam', 'eggs')", (ra['w'] == b'spam') |
+             (ra['w'] == b'eggs')),
+            ):
+            assert_array_equal(t.eval(expr)[:], expected, expr)
+            assert_array_equal(t[expr], ra[expected], expr)
+        expr, user_dict = pushdown("w == 'ham'", t.cols)
+        code = t.cols['w']._lookup('ham')
+        self.assertEqual(expr, "(w__codes == %d)" % code)
+        self.assertTrue(user_dict['w__codes'] is t.cols['w'].codes)
+        self.assertTrue('w' not in user_dict)
+
+    def test07(self):
+        """Testing comparisons that cannot be pushed down"""
+        d = blz.dictarray(self.a)
+        t = blz.btable((d, np.arange(self.N)), ('w', 'n'),
+                       rootdir=self.rootdir)
+        ra = t[:]
+        dictarray_module = sys.modules['blz.dictarray']
+        maxexpand = dictarray_module.MAXEXPAND
+        dictarray_module.MAXEXPAND = 0
+        try:
+            expr, user_dict = pushdown("(w == 'ham') | (w > 'r')", t.cols)
+            # The values are decoded by the evaluator, a block at a time
+            self.assertTrue(user_dict['w'] is t.cols['w'])
+            self.assertTrue('w__codes' in user_dict)
+            for expr, expected in (
+                ("(w == 'ham') | (w > 'r')", (ra['w'] == b'ham') |
+                 (ra['w'] > b'r')),
+                ("w == 'w == 1'", ra['w'] == b'w == 1'),
+                ("w < 'f'", ra['w'] < b'f'),
+                ):
+                for vm in ('python', 'numexpr'):
+                    assert_array_equal(t.eval(expr, vm=vm)[:], expected,
+                                       expr)
+                assert_array_equal(t[expr], ra[expected], expr)
+        finally:
+            dictarray_module.MAXEXPAND = maxexpand
+
+class dictarrayDiskTest(dictarrayTest):
+    disk = True
+
+    def test05(self):
+        """Testing that dictarrays are persistent"""
+        d = blz.dictarray(self.a, rootdir=self.rootdir)
+        d.append(['toast'])
+        d.flush()
+        d2 = blz.open(rootdir=self.rootdir)
+        self.assertTrue(isinstance(d2, blz.dictarray))
+        assert_array_equal(d2[:-1], self.a)
+        self.assertEqual(d2[-1], b'toast')
+        self.assertEqual(len(d2.values), 6)
+
+    def test06(self):
+        """Testing btables with persistent dictarray columns"""
+        t = blz.btable((blz.dictarray(self.a), np.arange(self.N)),
+                       ('w', 'n'), rootdir=self.rootdir)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.rootdir, 'w', '__dictarray__')))
+        t2 = blz.open(rootdir=self.rootdir)
+        self.assertTrue(isinstance(t2.cols['w'], blz.dictarray))
+        assert_array_equal(t2['w == "bacon"']['n'],
+                           np.flatnonzero(self.a == b'bacon'))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
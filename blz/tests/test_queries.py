@@ -10,6 +10,7 @@
 from __future__ import absolute_import
 
 import sys
+import os, os.path
 import unittest
 from unittest import TestCase
 
@@ -17,6 +18,8 @@ import numpy as np
 from numpy.testing import assert_array_equal, assert_allclose
 
 import blz
+from blz.blz_ext import chunk
+from blz.tests.common import MayBeDiskTest
 
 if sys.version_info >= (3, 0):
     xrange = range
@@ -177,6 +180,150 @@ class wherechunksTest(TestCase):
         self.assert_(l == N - M - 2)
         self.assert_(s == np.arange(M+1, N-1).sum())
 
+    def test08(self):
+        """Testing `whereblocks` with local variables and boolean arrays"""
+        N, M = int(1e4), 1234
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)), dtype='i4,f8,i8')
+        t = blz.btable(ra, chunklen=1000)
+        blocks = list(blz.whereblocks(t, 'f0 % 3 == M % 3', blen=1000,
+                                      outfields=['nrow__', 'f2']))
+        self.assert_([len(b) for b in blocks] == [1000, 1000, 1000, 333])
+        block = np.concatenate(blocks)
+        assert_array_equal(block['nrow__'], np.arange(1, N, 3))
+        assert_array_equal(block['f2'], ra['f2'][1::3])
+        mask = blz.barray(ra['f0'] > N - 5)
+        blocks = list(blz.whereblocks(t, mask, outfields=['f0']))
+        assert_array_equal(np.concatenate(blocks)['f0'], np.arange(N-4, N))
+        blocks = list(blz.whereblocks(t, 'f0 < 0'))
+        self.assert_(len(blocks) == 1 and len(blocks[0]) == 0)
+        self.assert_(blocks[0].dtype == t.dtype)
+
+
+class zonemapsTest(MayBeDiskTest, TestCase):
+
+    def test00(self):
+        """Testing zone maps in chunks"""
+        a = np.arange(10, 20, dtype='f8')
+        a[3] = np.nan
+        b = chunk(a, atom=a.dtype, bparams=blz.bparams(), _memory=False)
+        self.assert_(b.stats == (10., 19., 1))
+        a = np.array([np.nan]*10)
+        b = chunk(a, atom=a.dtype, bparams=blz.bparams(), _memory=False)
+        self.assert_(b.stats == (None, None, 10))
+        a = np.array(["a", "b"])
+        b = chunk(a, atom=a.dtype, bparams=blz.bparams(), _memory=False)
+        self.assert_(b.stats is None)
+
+    def test01(self):
+        """Testing zone maps for ranges in barrays"""
+        a = np.arange(1000, dtype='i4')
+        b = blz.barray(a, chunklen=100, rootdir=self.rootdir)
+        self.assert_(b._getstats(0, 100) == (0, 99, 0))
+        self.assert_(b._getstats(150, 320) == (100, 399, 0))
+        # The leftover
+        b.append(np.array([-1, 2000], dtype='i4'))
+        self.assert_(b._getstats(950, 1002) == (-1, 2000, 0))
+        if self.rootdir:
+            b.flush()
+            b = blz.open(rootdir=self.rootdir)
+            self.assert_(b._getstats(150, 320) == (100, 399, 0))
+            self.assert_(b._getstats(950, 1002) == (-1, 2000, 0))
+
+    def test02(self):
+        """Testing zone maps after modifying a barray"""
+        a = np.arange(1000, dtype='f8')
+        b = blz.barray(a, chunklen=100, rootdir=self.rootdir)
+        b[150] = np.nan
+        b[160] = 1e4
+        self.assert_(b._getstats(100, 200) == (100., 1e4, 1))
+        b.trim(850)
+        b.append(np.arange(5))
+        self.assert_(b._getstats(0, 155) == (0., 149., 0))
+        if self.rootdir:
+            b.flush()
+            b = blz.open(rootdir=self.rootdir)
+            self.assert_(b._getstats(100, 200) == (0., 149., 0))
+
+    def test03(self):
+        """Testing queries pruned by zone maps"""
+        N = 100*1000
+        a = np.arange(N, dtype='f8')
+        a[::1000] = np.nan
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        c = blz.barray(a > N/2, chunklen=1000)
+        for expr in ('b > 90000', 'b <= 1000', '(b >= 10) & (b < 20)',
+                     '(b < 10) | (b > 99990)', 'b != 3', 'b == 50001',
+                     '~(b > 5000)', '(1000 < b) & c', '-1 < b'):
+            r = blz.eval(expr, out_flavor="numpy")
+            ra = eval(expr.replace('b', 'a').replace('c', '(a > N/2)'))
+            assert_array_equal(r, ra, "eval() does not work correctly")
+            for vm in ("python", "numexpr"):
+                r = blz.eval(expr, vm=vm)
+                assert_array_equal(r[:], ra, "eval() does not work correctly")
+
+    def test04(self):
+        """Testing that pruned chunks are not read"""
+        if not self.rootdir:
+            return
+        N = 100*1000
+        t = blz.btable((np.arange(N), np.arange(N)*2.), ('a', 'b'),
+                       chunklen=1000, rootdir=self.rootdir)
+        # Remove the first data chunk of both columns
+        for name in t.names:
+            os.remove(os.path.join(self.rootdir, name, 'data', '__0.blp'))
+        t = blz.open(rootdir=self.rootdir)
+        self.assert_([r.a for r in t.where('a > 99997')] == [N-2, N-1])
+        self.assert_(len(t['(a > 99997) & (b < 50)']) == 0)
+
+    def test05(self):
+        """Testing that queries stop reading chunks after the limit"""
+        if not self.rootdir:
+            return
+        N = 100*1000
+        t = blz.btable((np.arange(N), np.arange(N)*2.), ('a', 'b'),
+                       chunklen=1000, rootdir=self.rootdir)
+        # Remove the last data chunks of both columns
+        for name in t.names:
+            os.remove(os.path.join(self.rootdir, name, 'data', '__99.blp'))
+        t = blz.open(rootdir=self.rootdir)
+        self.assert_([r.a for r in t.where('b > 9', limit=3)] == [5, 6, 7])
+        blocks = list(blz.whereblocks(t, 'b > 9', blen=10, limit=20))
+        self.assert_(len(blocks) == 3)
+        assert_array_equal(np.concatenate(blocks)['a'], np.arange(5, 25))
+
+    def test06(self):
+        """Testing queries pruned by zone maps of float32 columns"""
+        # NumPy rounds the constants to float32 before comparing, while
+        # numexpr compares in double precision: pruning must not change
+        # the outcome of either
+        a = np.empty(100*1000, dtype='f4')
+        a[:] = np.float32(0.1)
+        b = blz.barray(a, chunklen=1000, rootdir=self.rootdir)
+        for expr in ('b > 0.1', 'b <= 0.1', 'b == 0.1', 'b != 0.1',
+                     '0.1 < b', 'b < 0.2'):
+            r = blz.eval(expr, vm="python")
+            assert_array_equal(r[:], eval(expr.replace('b', 'a')), expr)
+            if blz.numexpr_here:
+                r = blz.eval(expr, vm="numexpr")
+                ra = blz.numexpr.evaluate(expr.replace('b', 'a'))
+                assert_array_equal(r[:], ra, expr)
+
+class zonemapsDiskTest(zonemapsTest):
+    disk = True
+
+    def test07(self):
+        """Testing that zone maps are persisted after batched updates"""
+        a = np.arange(10000, dtype='i8')
+        b = blz.barray(a, chunklen=100, rootdir=self.rootdir)
+        b[np.arange(50, 10000, 100)] = -1
+        b[b[:] == 5] = 10**6
+        b[200:300] = 7
+        b = blz.open(rootdir=self.rootdir)
+        self.assert_(b._getstats(0, 100) == (-1, 10**6, 0))
+        self.assert_(b._getstats(200, 300) == (7, 7, 0))
+        self.assert_(b._getstats(9900, 10000) == (-1, 9999, 0))
+        self.assert_(len(blz.eval('b > 999999')[:].nonzero()[0]) == 1)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,137 @@
+########################################################################
+#
+#       License: BSD
+#       Created: October 17, 2026
+#       Author:  Francesc Alted - francesc@continuum.io
+#
+########################################################################
+
+from __future__ import absolute_import
+
+import sys
+
+import numpy as np
+from numpy.testing import assert_array_equal
+import unittest
+from unittest import TestCase
+
+import blz
+from blz.tests.common import MayBeDiskTest
+
+if sys.version_info >= (3, 0):
+    xrange = range
+    unicode = str
+
+
+class vlarrayTest(MayBeDiskTest, TestCase):
+
+    N = 10000
+
+    def setUp(self):
+        MayBeDiskTest.setUp(self)
+        self.values = [(b"x" * (i % 17)) + str(i).encode('ascii')
+                       for i in xrange(self.N)]
+
+    def test00(self):
+        """Testing vlarray creation, indexing and slicing"""
+        v = blz.vlarray(self.values, chunklen=1000, rootdir=self.rootdir)
+        values = self.values
+        self.assertEqual(len(v), self.N)
+        self.assertEqual(v.kind, 'bytes')
+        self.assertEqual(v[0], values[0])
+        self.assertEqual(v[-1], values[-1])
+        self.assertEqual(v[1234], values[1234])
+        self.assertEqual(list(v[990:1010]), values[990:1010])
+        self.assertEqual(list(v[3:5000:7]), values[3:5000:7])
+        self.assertEqual(list(v[:]), values)
+        self.assertEqual(list(v[[5, 3001, 2, 3001, -1]]),
+                         [values[i] for i in (5, 3001, 2, 3001, -1)])
+        mask = np.arange(self.N) % 3 == 0
+        self.assertEqual(list(v[mask]), values[::3])
+        self.assertRaises(IndexError, v.__getitem__, self.N)
+        self.assertRaises(NotImplementedError, v.__setitem__, 0, b"a")
+
+    def test01(self):
+        """Testing iter() and where()"""
+        v = blz.vlarray(self.values, chunklen=1000, rootdir=self.rootdir)
+        values = self.values
+        self.assertEqual(list(v), values)
+        self.assertEqual(list(v.iter(10, 3000, 3)), values[10:3000:3])
+        self.assertEqual(list(v.iter(10, 3000, 3, limit=5, skip=2)),
+                         values[16:31:3])
+        mask = blz.barray(np.arange(self.N) % 7 == 0)
+        self.assertEqual(list(v.where(mask)), values[::7])
+        self.assertEqual(list(v.where(mask, limit=3, skip=1)),
+                         values[7:28:7])
+
+    def test02(self):
+        """Testing append(), trim() and resize()"""
+        v = blz.vlarray(self.values[:100], rootdir=self.rootdir)
+        v.append(self.values[100:])
+        v.append(b"last")
+        self.assertEqual(list(v), self.values + [b"last"])
+        v.trim(101)
+        self.assertEqual(list(v), self.values[:-100])
+        v.resize(len(v) + 2)
+        self.assertEqual(list(v[-3:]), [self.values[-101], b"", b""])
+        v.append([b"abc"])
+        self.assertEqual(v[-1], b"abc")
+        v.resize(10)
+        self.assertEqual(list(v), self.values[:10])
+
+    def test03(self):
+        """Testing unicode strings"""
+        values = [u"\u00e9t\u00e9 %d" % i for i in xrange(1000)]
+        v = blz.vlarray(values, rootdir=self.rootdir)
+        self.assertEqual(v.kind, 'str')
+        self.assertEqual(list(v), values)
+        self.assertTrue(isinstance(v[3], unicode))
+        self.assertRaises(TypeError, v.append, [1])
+        b = blz.vlarray([b"a"], rootdir=self.rootdir, mode='w')
+        self.assertRaises(TypeError, b.append, [u"a"])
+
+    def test04(self):
+        """Testing copies and compression"""
+        v = blz.vlarray(self.values, rootdir=self.rootdir)
+        v2 = v.copy(bparams=blz.bparams(clevel=9))
+        self.assertEqual(v2.bparams.clevel, 9)
+        self.assertEqual(list(v2), self.values)
+        self.assertTrue(v.cbytes < v.nbytes)
+
+    def test05(self):
+        """Testing vlarray columns in btables"""
+        v = blz.vlarray(self.values)
+        t = blz.btable((v, np.arange(self.N)), ('v', 'n'),
+                       rootdir=self.rootdir)
+        self.assertTrue(isinstance(t.cols['v'], blz.vlarray))
+        self.assertEqual(t[3]['v'], self.values[3])
+        self.assertEqual(list(t[10:20]['v']), self.values[10:20])
+        self.assertEqual([r.v for r in t.where('n < 5')], self.values[:5])
+        t.append(([b"new"], [-1]))
+        self.assertEqual(t[-1]['v'], b"new")
+
+class vlarrayDiskTest(vlarrayTest):
+    disk = True
+
+    def test06(self):
+        """Testing that vlarrays are persistent"""
+        v = blz.vlarray(self.values, rootdir=self.rootdir)
+        v.append(b"last")
+        v.flush()
+        v2 = blz.open(rootdir=self.rootdir)
+        self.assertTrue(isinstance(v2, blz.vlarray))
+        self.assertEqual(list(v2), self.values + [b"last"])
+        v2.append(b"more")
+        self.assertEqual(v2[-2:].tolist(), [b"last", b"more"])
+
+    def test07(self):
+        """Testing btables with persistent vlarray columns"""
+        t = blz.btable((blz.vlarray(self.values), np.arange(self.N)),
+                       ('v', 'n'), rootdir=self.rootdir)
+        t2 = blz.open(rootdir=self.rootdir)
+        self.assertTrue(isinstance(t2.cols['v'], blz.vlarray))
+        self.assertEqual(list(t2.cols['v']), self.values)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
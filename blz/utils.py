@@ -87,6 +87,36 @@ def set_nthreads(nthreads):
     nthreads_old = blz_set_nthreads(nthreads)
     return nthreads_old
 
+# The pools handed out by `thread_pool()`, keyed by purpose, along with
+# their number of threads
+_pools = {}
+
+def thread_pool(nthreads, purpose='chunks'):
+    """Return a pool of `nthreads` threads for chunk-level parallelism.
+
+    A pool is kept between calls for every `purpose`, and replaced when
+    a different number of threads is asked for.  The replaced pool is
+    only closed, so that the tasks already handed to it (e.g. by a
+    running `eval()`) still complete.  Tasks of different purposes that
+    feed each other (like evaluating blocks and compressing the results)
+    must use different pools, or they would wait behind each other.
+    """
+    from multiprocessing.pool import ThreadPool
+    nthreads_, pool = _pools.get(purpose, (None, None))
+    if nthreads_ != nthreads:
+        if pool is not None:
+            pool.close()
+        pool = ThreadPool(nthreads)
+        _pools[purpose] = (nthreads, pool)
+    return pool
+
+def _close_pools():
+    """Close the pools of `thread_pool()` and wait for their threads."""
+    for nthreads, pool in _pools.values():
+        pool.close()
+        pool.join()
+    _pools.clear()
+
 ##### Code for computing optimum chunksize follows  #####
 
 def csformula(expectedsizeinMB):
@@ -0,0 +1,486 @@
+########################################################################
+#
+#       License: BSD
+#       Created: October 17, 2026
+#       Author:  Francesc Alted - francesc@continuum.io
+#
+########################################################################
+
+from __future__ import absolute_import
+
+# Containers for variable length strings and bytes
+
+import os, os.path
+import json
+import shutil
+import numpy as np
+
+from .blz_ext import barray
+from .py2help import _inttypes, unicode, xrange
+from . import utils, arrayprint
+
+_inttypes += (np.integer,)
+
+# The file marking the rootdir of a vlarray
+VLARRAY_META = '__vlarray__'
+
+# The kinds of values supported and the encoding for 'str'
+KINDS = ('bytes', 'str')
+ENCODING = 'utf-8'
+
+
+class vlarray(object):
+    """
+    vlarray(array=None, kind=None, rootdir=None, mode='a', **kwargs)
+
+    A compressed and enlargeable container for variable length values.
+
+    Values (bytes or strings) are packed one after the other in a
+    `data` barray of bytes, and the end of every value is kept in an
+    `offsets` barray, so that every chunk holds many values and
+    reading a slice only decompresses the chunks where it lives.
+
+    Parameters
+    ----------
+    array : an iterable of bytes or strings
+        This is taken as the input to create the vlarray.
+    kind : string
+        The kind of the values: 'bytes' or 'str' (unicode strings, that
+        are stored encoded as UTF-8).  If None, it is guessed from the
+        first value in `array` (defaulting to 'bytes').
+    rootdir : str, optional
+        The directory where all the data and metadata will be stored.
+        If specified, then the vlarray object will be disk-based and
+        persistent.
+    mode : str, optional
+        The mode that a *persistent* vlarray should be created/opened.
+        The values can be 'r', 'w' or 'a', as for barray objects.
+    kwargs : list of parameters or dictionary
+        Any parameter supported by the barray constructor (`bparams`,
+        `storage`...).  `chunklen` and `expectedlen` refer to the
+        number of values, and are used for the offsets.
+
+    """
+
+    # Properties
+    # ``````````
+
+    @property
+    def bparams(self):
+        "The compression parameters for this object."
+        return self.data.bparams
+
+    @property
+    def cbytes(self):
+        "The compressed size of this object (in bytes)."
+        return self.data.cbytes + self.offsets.cbytes
+
+    @property
+    def chunklen(self):
+        "The number of values in each chunk of offsets."
+        return self.offsets.chunklen
+
+    @property
+    def dtype(self):
+        "The dtype of this object (always object)."
+        return np.dtype(object)
+
+    @property
+    def len(self):
+        "The length of this object."
+        return len(self.offsets)
+
+    @property
+    def nbytes(self):
+        "The original (uncompressed) size of this object (in bytes)."
+        return self.data.nbytes + self.offsets.nbytes
+
+    @property
+    def ndim(self):
+        "The number of dimensions of this object."
+        return 1
+
+    @property
+    def shape(self):
+        "The shape of this object."
+        return (self.len,)
+
+    @property
+    def size(self):
+        "The size of this object."
+        return self.len
+
+
+    def __init__(self, array=None, kind=None, rootdir=None, mode='a',
+                 **kwargs):
+        self.rootdir = rootdir
+        "The directory where this object is saved."
+        self.mode = mode
+        "The mode in which the object is created/opened."
+        if array is not None:
+            self._create(array, kind, **kwargs)
+        else:
+            self._open()
+
+    def _subdir(self, name):
+        if self.rootdir is None:
+            return None
+        return os.path.join(self.rootdir, name)
+
+    def _create(self, array, kind, **kwargs):
+        """Create a vlarray anew out of `array`."""
+        if isinstance(array, vlarray):
+            kind = kind or array.kind
+        else:
+            if isinstance(array, np.ndarray):
+                array = array.tolist()
+            array = list(array)
+        if kind is None:
+            kind = 'bytes'
+            if len(array) > 0 and isinstance(array[0], unicode):
+                kind = 'str'
+        if kind not in KINDS:
+            raise ValueError("`kind` must be either 'bytes' or 'str'")
+        self.kind = kind
+        "The kind of the values ('bytes' or 'str')."
+
+        if self.rootdir:
+            if os.path.exists(self.rootdir):
+                if self.mode != "w":
+                    raise IOError(
+                        "specified rootdir path '%s' already exists "
+                        "and creation mode is '%s'" % (self.rootdir, self.mode))
+                shutil.rmtree(self.rootdir)
+            os.mkdir(self.rootdir)
+            with open(os.path.join(self.rootdir, VLARRAY_META),
+                      'wb') as metafile:
+                metafile.write(json.dumps({'kind': kind}).encode('ascii'))
+                metafile.write(b"\n")
+
+        kwargs.pop('dflt', None)
+        kwargs.pop('dtype', None)
+        chunklen = kwargs.pop('chunklen', None)
+        expectedlen = kwargs.pop('expectedlen', len(array))
+        self.offsets = barray(np.empty(0, dtype=np.int64),
+                              chunklen=chunklen, expectedlen=expectedlen,
+                              rootdir=self._subdir('offsets'), **kwargs)
+        "The barray with the end offsets of the values in `data`."
+        self.data = barray(np.empty(0, dtype=np.uint8),
+                           rootdir=self._subdir('data'), **kwargs)
+        "The barray with the bytes of all the values, packed."
+        self._nbytes = 0
+        self.append(array)
+        self.flush()
+
+    def _open(self):
+        """Open an existing vlarray on-disk."""
+        if self.rootdir is None:
+            raise ValueError(
+                "you need to pass either an `array` or a `rootdir` param")
+        metafile = os.path.join(self.rootdir, VLARRAY_META)
+        if not os.path.exists(metafile):
+            raise IOError("'%s' is not a vlarray" % self.rootdir)
+        with open(metafile, 'rb') as metafh:
+            meta = json.loads(metafh.read().decode('ascii'))
+        self.kind = str(meta['kind'])
+        self.offsets = barray(rootdir=self._subdir('offsets'), mode=self.mode)
+        self.data = barray(rootdir=self._subdir('data'), mode=self.mode)
+        self._nbytes = len(self.data)
+
+    def _encode(self, value):
+        """Return `value` as bytes."""
+        if self.kind == 'str':
+            if not isinstance(value, unicode):
+                if not isinstance(value, bytes):
+                    raise TypeError("only strings can be stored")
+                value = value.decode(ENCODING)
+            return value.encode(ENCODING)
+        if not isinstance(value, bytes):
+            raise TypeError("only bytes can be stored in 'bytes' vlarrays")
+        return value
+
+    def _decode(self, buf, bounds):
+        """Split the `buf` bytes in values at the `bounds` offsets."""
+        values = [buf[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+        if self.kind == 'str':
+            values = [value.decode(ENCODING) for value in values]
+        out = np.empty(len(values), dtype=object)
+        out[:] = values
+        return out
+
+    def _slice(self, start, stop):
+        """Return the values in the [start, stop) range."""
+        if start >= stop:
+            return np.empty(0, dtype=object)
+        if start == 0:
+            bounds = np.empty(stop + 1, dtype=np.int64)
+            bounds[0] = 0
+            bounds[1:] = self.offsets[:stop]
+        else:
+            bounds = self.offsets[start-1:stop]
+        lo = bounds[0]
+        # Only the chunks of data in the range are decompressed
+        buf = self.data[lo:bounds[-1]].tostring()
+        return self._decode(buf, (bounds - lo).tolist())
+
+    def _getrow(self, nrow):
+        """Return the value in row `nrow`."""
+        if nrow < 0:
+            nrow += self.len
+        if nrow < 0 or nrow >= self.len:
+            raise IndexError("index out of range")
+        return self._slice(nrow, nrow+1)[0]
+
+    def append(self, values):
+        """
+        append(values)
+
+        Append `values` to this instance.
+
+        Parameters
+        ----------
+        values : a value or an iterable of values
+            The bytes or strings to be appended.
+
+        """
+
+        if isinstance(values, (bytes, unicode)):
+            values = [values]
+        if isinstance(values, vlarray):
+            # Append by blocks in order to save memory
+            for i in xrange(0, len(values), values.chunklen):
+                self.append(values[i:i+values.chunklen])
+            return
+        encoded = [self._encode(value) for value in values]
+        if len(encoded) == 0:
+            return
+        sizes = np.fromiter((len(value) for value in encoded),
+                            dtype=np.int64, count=len(encoded))
+        ends = np.cumsum(sizes) + self._nbytes
+        self.data.append(np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        self.offsets.append(ends)
+        self._nbytes = int(ends[-1])
+
+    def trim(self, nitems):
+        """
+        trim(nitems)
+
+        Remove the trailing `nitems` from this instance.
+
+        Parameters
+        ----------
+        nitems : int
+            The number of trailing items to be trimmed.
+
+        """
+
+        if nitems > self.len:
+            raise ValueError("`nitems` must be less than total length")
+        newlen = self.len - nitems
+        end = int(self.offsets[newlen-1]) if newlen > 0 else 0
+        self.data.trim(self._nbytes - end)
+        self.offsets.trim(nitems)
+        self._nbytes = end
+
+    def resize(self, nitems):
+        """
+        resize(nitems)
+
+        Resize the instance to have `nitems`.
+
+        Parameters
+        ----------
+        nitems : int
+            The final length of the object.  If `nitems` is larger than
+            the actual length, new items will be empty values.
+
+        """
+
+        if nitems > self.len:
+            self.offsets.append(np.repeat(np.int64(self._nbytes),
+                                          nitems - self.len))
+            self.offsets.flush()
+        else:
+            self.trim(self.len - nitems)
+
+    def copy(self, **kwargs):
+        """
+        copy(**kwargs)
+
+        Return a copy of this object.
+
+        Parameters
+        ----------
+        kwargs : list of parameters or dictionary
+            Any parameter supported by the vlarray constructor.
+
+        Returns
+        -------
+        out : vlarray object
+            The copy of this object.
+
+        """
+
+        kwargs.setdefault('bparams', self.bparams)
+        return vlarray(self, kind=self.kind, **kwargs)
+
+    def recompress(self, bparams):
+        """
+        recompress(bparams)
+
+        Recompress this object in-place with new compression parameters.
+
+        Parameters
+        ----------
+        bparams : instance of the `bparams` class
+            The new parameters for the internal Blosc compressor.
+
+        See Also
+        --------
+        barray.recompress
+
+        """
+
+        self.offsets.recompress(bparams)
+        self.data.recompress(bparams)
+
+    def flush(self):
+        """Flush data in internal buffers to disk."""
+        self.offsets.flush()
+        self.data.flush()
+
+    def free_cachemem(self):
+        """Get rid of internal caches to free memory."""
+        self.offsets.free_cachemem()
+        self.data.free_cachemem()
+
+    def __len__(self):
+        return self.len
+
+    def __sizeof__(self):
+        return self.cbytes
+
+    def __getitem__(self, key):
+        """
+        x.__getitem__(key) <==> x[key]
+
+        Returns values based on `key`.  Integers, slices (with positive
+        steps), and arrays of integers or booleans are supported.
+        Values are returned as Python objects or as NumPy arrays of
+        objects.
+        """
+        if isinstance(key, _inttypes):
+            return self._getrow(key)
+        elif isinstance(key, slice):
+            start, stop, step = key.indices(self.len)
+            if step <= 0:
+                raise NotImplementedError("step in slice can only be positive")
+            values = self._slice(start, stop)
+            if step > 1:
+                values = values[::step]
+            return values
+        elif isinstance(key, tuple) and len(key) == 1:
+            return self[key[0]]
+        key = np.asarray(key[:] if isinstance(key, barray) else key)
+        if key.dtype.kind == 'b':
+            if len(key) != self.len:
+                raise IndexError("boolean key must have the same length")
+            key = np.flatnonzero(key)
+        elif key.dtype.kind not in ('i', 'u'):
+            raise IndexError("arrays used as indices must be integer or bool")
+        key = np.where(key < 0, key + self.len, key)
+        if len(key) and (key.min() < 0 or key.max() >= self.len):
+            raise IndexError("index out of range")
+        out = np.empty(len(key), dtype=object)
+        # Rows are read in sorted order, one block of offsets at a time
+        order = np.argsort(key, kind='mergesort')
+        skey = key[order]
+        chunklen = self.chunklen
+        i = 0
+        while i < len(skey):
+            start = skey[i] - skey[i] % chunklen
+            stop = min(start + chunklen, self.len)
+            j = np.searchsorted(skey, stop)
+            block = self._slice(start, stop)
+            out[order[i:j]] = block[skey[i:j] - start]
+            i = j
+        return out
+
+    def __setitem__(self, key, value):
+        raise NotImplementedError(
+            "vlarray values cannot be modified in-place; "
+            "use `trim()` and `append()` instead")
+
+    def __iter__(self):
+        return self.iter()
+
+    def iter(self, start=0, stop=None, step=1, limit=None, skip=0):
+        """
+        iter(start=0, stop=None, step=1, limit=None, skip=0)
+
+        Iterator with `start`, `stop` and `step` bounds.  See
+        `barray.iter()` for details.
+        """
+        if step <= 0:
+            raise NotImplementedError("step param can only be positive")
+        start, stop, step = slice(start, stop, step).indices(self.len)
+        start = min(start + skip * step, stop)
+        if limit is not None:
+            stop = min(stop, start + limit * step)
+        return self._iter(start, stop, step)
+
+    def _iter(self, start, stop, step):
+        # Values are decoded in blocks of about a chunk of offsets
+        bsize = max(self.chunklen // step, 1) * step
+        for bstart in xrange(start, stop, bsize):
+            bstop = min(bstart + bsize, stop)
+            for value in self._slice(bstart, bstop)[::step]:
+                yield value
+
+    def where(self, boolarr, limit=None, skip=0):
+        """
+        where(boolarr, limit=None, skip=0)
+
+        Iterator that returns values of this object where `boolarr` is
+        true.  See `barray.where()` for details.
+        """
+        if len(boolarr) != self.len:
+            raise ValueError("`boolarr` must be of the same length than ``self``")
+        chunklen = self.chunklen
+        nhits = 0
+        stop = None if limit is None else skip + limit
+        for bstart in xrange(0, self.len, chunklen):
+            mask = np.asarray(boolarr[bstart:bstart+chunklen], dtype=np.bool_)
+            rows = np.flatnonzero(mask)
+            if len(rows) == 0:
+                continue
+            values = self._slice(bstart + rows[0], bstart + rows[-1] + 1)
+            for value in values[rows - rows[0]]:
+                if nhits >= skip:
+                    yield value
+                nhits += 1
+                if stop is not None and nhits >= stop:
+                    return
+
+    def __str__(self):
+        return arrayprint.array2string(self)
+
+    def __repr__(self):
+        snbytes = utils.human_readable_size(self.nbytes)
+        scbytes = utils.human_readable_size(self.cbytes)
+        cratio = self.nbytes / float(self.cbytes)
+        header = "vlarray(%s, '%s')\n" % (self.shape, self.kind)
+        header += "  nbytes: %s; cbytes: %s; ratio: %.2f\n" % (
+            snbytes, scbytes, cratio)
+        header += "  bparams := %r\n" % self.bparams
+        if self.rootdir:
+            header += "  rootdir := '%s'\n" % self.rootdir
+        return header + str(self)
+
+
+## Local Variables:
+## mode: python
+## py-indent-offset: 4
+## tab-width: 4
+## fill-column: 78
+## End:
@@ -535,8 +535,10 @@ static int blosc_c(int32_t blocksize, int32_t leftoverblock,
       /* cbytes should never be negative */
       return -2;
     }
-    else if (cbytes == 0) {
+    else if (cbytes == 0 || cbytes == neblock) {
       /* The compressor has been unable to compress data at all. */
+      /* A compressed split as large as the original one would be
+         taken as a memcpy'ed one by blosc_d(), so store it as such. */
       /* Before doing the copy, check that we are not running into a
          buffer overflow. */
       if ((ntbytes+neblock) > maxbytes) {